@@ -8,7 +8,9 @@ from loguru import logger
 
 project_root = pathlib.Path(__file__).parent.parent
 
-project_root.joinpath('data').mkdir(exist_ok=True)
+# tokens and logs, `loadtest` points it somewhere else
+data_dir = project_root.joinpath('data')
+data_dir.mkdir(exist_ok=True)
 
 
 def load_config():
@@ -38,24 +40,43 @@ if config.get('socketio').get('debug'):
 
 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-socf_file_channel = logging.handlers.TimedRotatingFileHandler(
-    project_root.joinpath('data/socf.log'), interval=1, when='H', backupCount=48
-)
-socf_file_channel.setFormatter(formatter)
-socf_logger.addHandler(socf_file_channel)
-sock_file_channel = logging.handlers.TimedRotatingFileHandler(
-    project_root.joinpath('data/sock.log'), interval=1, when='H', backupCount=48
-)
-sock_file_channel.setFormatter(formatter)
-sock_logger.addHandler(sock_file_channel)
-socc_file_channel = logging.handlers.TimedRotatingFileHandler(
-    project_root.joinpath('data/socc.log'), interval=1, when='H', backupCount=48
-)
-socc_file_channel.setFormatter(formatter)
-socc_logger.addHandler(socc_file_channel)
+socketio_loggers = {'socf': socf_logger, 'sock': sock_logger, 'socc': socc_logger}
+
+
+def set_socketio_logs(suffix=''):
+    """
+    write the socket-io loggers to `<data_dir>/<socf|sock|socc><suffix>.log`, replacing the files written so far
+    :param suffix: e.g. `.shard0`, processes rotating the same file would rename it under each other
+    """
+    for name, socketio_logger in socketio_loggers.items():
+        for handler in list(socketio_logger.handlers):
+            socketio_logger.removeHandler(handler)
+            handler.close()
+
+        file_channel = logging.handlers.TimedRotatingFileHandler(
+            data_dir.joinpath(f'{name}{suffix}.log'), interval=1, when='H', backupCount=48, delay=True
+        )
+        file_channel.setFormatter(formatter)
+        socketio_logger.addHandler(file_channel)
+
+
+set_socketio_logs()
 
 # endregion
 
+log_level = config.get('logging', {}).get('level', 'DEBUG')
+# serialize=True writes one json record per line, including the `extra` fields bound by the api clients
+log_serialize = config.get('logging', {}).get('serialize', False)
+
 logger.remove()
-logger.add(project_root.joinpath('data/main.log'), rotation='1 hour', retention=48)
-logger.add(sys.stdout, colorize=True)
+
+
+def add_main_log(name='main'):
+    return logger.add(
+        data_dir.joinpath(f'{name}.log'), rotation='1 hour', retention=48, level=log_level,
+        serialize=log_serialize
+    )
+
+
+main_log_handler_id = add_main_log()
+logger.add(sys.stdout, colorize=True, level=log_level)
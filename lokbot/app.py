@@ -1,15 +1,13 @@
 import asyncio
-import functools
 import threading
 import time
 
-import schedule
-
 import lokbot.util
-from lokbot import project_root, logger, config
+from lokbot import logger, config
 from lokbot.async_farmer import AsyncLokFarmer
 from lokbot.exceptions import NoAuthException
 from lokbot.farmer import LokFarmer
+from lokbot.scheduler import scheduler
 
 
 def find_alliance(farmer: LokFarmer):
@@ -23,71 +21,82 @@ def find_alliance(farmer: LokFarmer):
         time.sleep(60 * 5)
 
 
-thread_map = {}
-
-
-def run_threaded(name, job_func):
-    if name in thread_map and thread_map[name].is_alive():
-        return
-
-    job_thread = threading.Thread(target=job_func, name=name, daemon=True)
-    thread_map[name] = job_thread
-    job_thread.start()
-
-
 def async_main(token):
     async_farmer = AsyncLokFarmer(token)
 
     asyncio.run(async_farmer.parallel_buy_caravan())
 
 
-def main(token, captcha_solver_config=None):
-    # async_main(token)
-    # exit()
-
+def load_farmer(token, captcha_solver_config=None):
+    """
+    log in with the token saved by the last run if it is still valid, else with `token`
+    :param token:
+    :param captcha_solver_config:
+    :return:
+    """
     if captcha_solver_config is None:
         captcha_solver_config = {}
 
     _id = lokbot.util.decode_jwt(token).get('_id')
-    token_file = project_root.joinpath(f'data/{_id}.token')
+    token_file = lokbot.data_dir.joinpath(f'{_id}.token')
     if token_file.exists():
         token_from_file = token_file.read_text()
         logger.info(f'Using token: {token_from_file} from file: {token_file}')
         try:
-            farmer = LokFarmer(token_from_file, captcha_solver_config)
+            return LokFarmer(token_from_file, captcha_solver_config)
         except NoAuthException:
             logger.info('Token is invalid, using token from command line')
-            farmer = LokFarmer(token, captcha_solver_config)
-    else:
-        farmer = LokFarmer(token, captcha_solver_config)
 
-    threading.Thread(target=farmer.sock_thread, daemon=True).start()
-    threading.Thread(target=farmer.socc_thread, daemon=True).start()
+    return LokFarmer(token, captcha_solver_config)
 
-    farmer.keepalive_request()
 
-    for job in config.get('main').get('jobs'):
+def schedule_farmer(farmer: LokFarmer, jobs, threads):
+    """
+    :param farmer:
+    :param jobs: `main.jobs` of the config, run now and then every `interval` minutes
+    :param threads: `main.threads` of the config, run now and re-armed by themselves
+    :return:
+    """
+    for job in jobs:
         if not job.get('enabled'):
             continue
 
         name = job.get('name')
+        interval = job.get('interval')
 
-        schedule.every(
-            job.get('interval').get('start')
-        ).to(
-            job.get('interval').get('end')
-        ).minutes.do(run_threaded, name, functools.partial(getattr(farmer, name), **job.get('kwargs', {})))
+        scheduler.every(
+            farmer.get_job_name(name), (interval.get('start') * 60, interval.get('end') * 60),
+            getattr(farmer, name), **job.get('kwargs', {})
+        )
 
-    schedule.run_all()
+    scheduler.run_all(farmer.get_job_name(''))
 
-    # schedule.every(15).to(20).minutes.do(farmer.keepalive_request)
+    # scheduler.every(farmer.get_job_name('keepalive_request'), (15 * 60, 20 * 60), farmer.keepalive_request)
 
-    for thread in config.get('main').get('threads'):
+    for thread in threads:
         if not thread.get('enabled'):
             continue
 
-        threading.Thread(target=getattr(farmer, thread.get('name')), kwargs=thread.get('kwargs'), daemon=True).start()
+        name = thread.get('name')
+        # these jobs re-arm themselves on the scheduler
+        scheduler.call_later(0, farmer.get_job_name(name), getattr(farmer, name), **(thread.get('kwargs') or {}))
+
+
+def main(token, captcha_solver_config=None):
+    # async_main(token)
+    # exit()
+
+    farmer = load_farmer(token, captcha_solver_config)
+
+    threading.Thread(target=farmer.sock_thread, daemon=True).start()
+    threading.Thread(target=farmer.socc_thread, daemon=True).start()
+
+    farmer.keepalive_request()
+
+    scheduler.start()
+    schedule_farmer(farmer, config.get('main').get('jobs'), config.get('main').get('threads'))
 
     while True:
-        schedule.run_pending()
-        time.sleep(1)
+        time.sleep(600)
+        upcoming = ', '.join(f'{each["name"]} {each["run_at"].humanize()}' for each in scheduler.get_upcoming(8))
+        logger.debug(f'upcoming jobs: {upcoming}')
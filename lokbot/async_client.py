@@ -1,49 +1,344 @@
+import asyncio
+import base64
 import json
+import time
 
 import httpx
+import tenacity
 
 import lokbot.enum
-from lokbot import logger
-
-
-class AsyncLokBotApi:
-    def __init__(self, access_token):
-        self.opener = httpx.AsyncClient(
-            headers={
-                'User-Agent': 'BestHTTP',
-                'x-access-token': access_token
-            },
-            http2=True,
-            base_url=lokbot.enum.API_BASE_URL
+from lokbot.client import BaseLokBotApi, HEADERS
+from lokbot.exceptions import *
+from lokbot.pool import pool_manager
+
+
+class AsyncLokBotApi(BaseLokBotApi):
+    def __init__(self, token, captcha_solver_config=None, request_callback=None, rate_limits=None):
+        super().__init__(token, captcha_solver_config or {}, request_callback, rate_limits)
+
+        self.opener = pool_manager.async_client(
+            headers={**HEADERS, 'X-Access-Token': token},
+            base_url=lokbot.enum.API_BASE_URL,
         )
 
     async def post(self, url, json_data=None):
         if json_data is None:
             json_data = {}
 
-        response = await self.opener.post(url, data={'json': json.dumps(json_data)})
+        # shared by every retry of this request
+        request_stats = {'attempts': 0, 'queue_wait': 0.0}
 
-        log_data = {
-            'url': url,
-            'data': json_data,
-            'elapsed': response.elapsed.total_seconds(),
-        }
+        return await self._post(url, json_data, request_stats)
+
+    @tenacity.retry(
+        stop=tenacity.stop_after_attempt(2),
+        wait=tenacity.wait_random_exponential(multiplier=1, max=60),
+        # general http error or json decode error
+        retry=tenacity.retry_if_exception_type((httpx.HTTPError, json.JSONDecodeError)),
+        reraise=True
+    )
+    @tenacity.retry(
+        wait=tenacity.wait_fixed(2),
+        retry=tenacity.retry_if_exception_type(DuplicatedException),  # server-side rate limiter(wait 2s)
+    )
+    @tenacity.retry(
+        wait=tenacity.wait_fixed(3600),
+        retry=tenacity.retry_if_exception_type(ExceedLimitPacketException),  # server-side rate limiter(wait 1h)
+    )
+    async def _post(self, url, json_data, request_stats):
+        request_stats['attempts'] += 1
+
+        api_path = self._get_api_path(url)
+
+        cached_response = self._get_cached_response(api_path, json_data)
+        if cached_response is not None:
+            return cached_response
+
+        post_data = self._encode_request(api_path, json_data)
+
+        request_stats['queue_wait'] += await self.rate_limiter.async_acquire(api_path)
+
+        # remove request cookie since it's not needed and may cause account ban
+        self.opener.cookies.clear()
+
+        response = await self.opener.post(url, data={'json': post_data})
+        self.last_requested_at = time.time()
+
+        json_response = self._decode_response(url, api_path, json_data, response)
+        self._log_request(url, json_data, json_response, response.elapsed.total_seconds(), request_stats)
 
         try:
-            json_response = response.json()
-        except json.JSONDecodeError:
-            log_data.update({'res': response.text})
-            logger.error(log_data)
+            json_response = self._handle_response(json_response)
+        except NeedCaptchaException:
+            if not self.captcha_solver:
+                raise
 
-            return None
+            await self._solve_captcha()
 
-        log_data.update({'res': json_response})
-        logger.debug(json.dumps(log_data))
+            raise DuplicatedException()
+
+        self._update_response_cache(api_path, json_data, json_response)
 
         return json_response
 
+    @tenacity.retry(
+        stop=tenacity.stop_after_attempt(4),
+        wait=tenacity.wait_random_exponential(multiplier=1, max=60)
+    )
+    async def _solve_captcha(self):
+        # captcha solvers are synchronous, run them in a worker thread and call back into the loop
+        loop = asyncio.get_running_loop()
+
+        def get_picture_base64_func():
+            response = asyncio.run_coroutine_threadsafe(self.auth_captcha(), loop).result()
+
+            return base64.b64encode(response.content).decode()
+
+        def captcha_confirm_func(_captcha):
+            res = asyncio.run_coroutine_threadsafe(self.auth_captcha_confirm(_captcha), loop).result()
+
+            return res.get('valid')
+
+        if not await asyncio.to_thread(self.captcha_solver.solve, get_picture_base64_func, captcha_confirm_func):
+            raise tenacity.TryAgain()
+
+    async def auth_captcha(self):
+        return await self.opener.get('auth/captcha')
+
+    async def auth_captcha_confirm(self, value):
+        return await self.post('auth/captcha/confirm', {'value': value})
+
+    async def auth_connect(self, json_data=None):
+        try:
+            res = await self.post('https://lok-api-live.leagueofkingdoms.com/api/auth/connect', json_data)
+        except OtherException:
+            # {"result":false,"err":{}} when no auth
+            lokbot.data_dir.joinpath(f'{self._id}.token').unlink(missing_ok=True)
+            raise NoAuthException()
+
+        self.opener.headers['x-access-token'] = res['token']
+
+        return res
+
+    async def auth_set_device_info(self, device_info):
+        return await self.post('auth/setDeviceInfo', {'deviceInfo': device_info})
+
+    async def alliance_research_list(self):
+        return await self.post('alliance/research/list')
+
+    async def alliance_research_donate_all(self, code):
+        return await self.post('alliance/research/donateAll', {'code': code})
+
+    async def alliance_shop_list(self):
+        return await self.post('alliance/shop/list')
+
+    async def alliance_shop_buy(self, code, amount):
+        return await self.post('alliance/shop/buy', {'code': code, 'amount': amount})
+
+    async def alliance_gift_claim_all(self):
+        return await self.post('alliance/gift/claim/all')
+
+    async def chat_logs(self, chat_channel):
+        return await self.post('chat/logs', {'chatChannel': chat_channel})
+
+    async def quest_main(self):
+        return await self.post('quest/main')
+
+    async def quest_list(self):
+        return await self.post('quest/list')
+
+    async def quest_list_daily(self):
+        return await self.post('quest/list/daily')
+
+    async def quest_claim(self, quest):
+        return await self.post('quest/claim', {'questId': quest.get('_id'), 'code': quest.get('code')})
+
+    async def quest_claim_daily(self, quest):
+        return await self.post('quest/claim/daily', {'questId': quest.get('_id'), 'code': quest.get('code')})
+
+    async def quest_claim_daily_level(self, reward):
+        return await self.post('quest/claim/daily/level', {'level': reward.get('level')})
+
+    async def pkg_recommend(self):
+        return await self.post('pkg/recommend')
+
+    async def pkg_list(self):
+        return await self.post('pkg/list')
+
+    async def event_roulette_open(self):
+        return await self.post('event/roulette/open')
+
+    async def event_cvc_open(self):
+        return await self.post('event/cvc/open')
+
+    async def drago_lair_list(self):
+        return await self.post('drago/lair/list')
+
+    async def event_list(self):
+        return await self.post('event/list')
+
+    async def event_info(self, root_event_id):
+        return await self.post('event/info', {'rootEventId': root_event_id})
+
+    async def event_claim(self, event_id, event_target_id, code):
+        return await self.post('event/claim', {'eventId': event_id, 'eventTargetId': event_target_id, 'code': code})
+
+    async def train_troop(self, troop_code, amount):
+        return await self.post('kingdom/barrack/train', {'troopCode': troop_code, 'amount': amount, 'instant': 0})
+
+    async def kingdom_wall_info(self):
+        return await self.post('kingdom/wall/info')
+
+    async def kingdom_wall_repair(self):
+        return await self.post('kingdom/wall/repair')
+
+    async def kingdom_treasure_list(self):
+        return await self.post('kingdom/treasure/list')
+
+    async def kingdom_enter(self):
+        res = await self.post('https://lok-api-live.leagueofkingdoms.com/api/kingdom/enter')
+
+        captcha = res.get('captcha')
+        if captcha and captcha.get('next'):
+            if not self.captcha_solver:
+                raise NeedCaptchaException()
+
+            await self._solve_captcha()
+
+        return res
+
+    async def kingdom_task_all(self):
+        return await self.post('kingdom/task/all')
+
+    async def kingdom_task_claim(self, position):
+        return await self.post('kingdom/task/claim', {'position': position})
+
+    async def kingdom_task_speedup(self, task_id, code, amount, is_buy=0):
+        res = await self.post(
+            'kingdom/task/speedup', {'taskId': task_id, 'code': code, 'amount': amount, 'isBuy': is_buy}
+        )
+
+        await self.auth_analytics('item/use', f'{code}|{amount}')
+
+        return res
+
+    async def kingdom_heal_speedup(self, code, amount, is_buy=0):
+        res = await self.post('kingdom/heal/speedup', {'code': code, 'amount': amount, 'isBuy': is_buy})
+
+        await self.auth_analytics('item/use', f'{code}|{amount}')
+
+        return res
+
+    async def kingdom_tutorial_finish(self, code):
+        return await self.post('kingdom/tutorial/finish', {'code': code})
+
+    async def kingdom_academy_research_list(self):
+        return await self.post('kingdom/arcademy/research/list')
+
+    async def kingdom_hospital_recover(self):
+        return await self.post('kingdom/hospital/recover')
+
+    async def kingdom_hospital_wounded(self):
+        return await self.post('kingdom/hospital/wounded')
+
+    async def kingdom_resource_harvest(self, position):
+        return await self.post('kingdom/resource/harvest', {'position': position})
+
+    async def kingdom_building_upgrade(self, building, instant=0):
+        return await self.post('kingdom/building/upgrade', {
+            'position': building.get('position'),
+            'level': building.get('level'),
+            'instant': instant
+        })
+
+    async def kingdom_building_build(self, building, instant=0):
+        return await self.post('kingdom/building/build', {
+            'position': building.get('position'),
+            'buildingCode': building.get('code'),
+            'instant': instant
+        })
+
+    async def kingdom_academy_research(self, research, instant=0):
+        return await self.post('kingdom/arcademy/research', {
+            'researchCode': research.get('code'),
+            'instant': instant
+        })
+
+    async def kingdom_vip_info(self):
+        return await self.post('kingdom/vip/info')
+
+    async def kingdom_vip_claim(self):
+        return await self.post('kingdom/vip/claim')
+
+    async def kingdom_world_change(self, world_id):
+        return await self.post('kingdom/world/change', {'worldId': world_id})
+
     async def kingdom_caravan_list(self):
         return await self.post('kingdom/caravan/list')
 
     async def kingdom_caravan_buy(self, caravan_item_id):
         return await self.post('kingdom/caravan/buy', {'caravanItemId': caravan_item_id})
+
+    async def kingdom_profile_troops(self):
+        return await self.post('kingdom/profile/troops')
+
+    async def kingdom_vipshop_buy(self, code, amount):
+        return await self.post('kingdom/vipshop/buy', {'code': code, 'amount': amount})
+
+    async def alliance_help_all(self):
+        return await self.post('alliance/help/all')
+
+    async def alliance_recommend(self):
+        return await self.post('alliance/recommend')
+
+    async def alliance_join(self, alliance_id):
+        return await self.post('alliance/join', {'allianceId': alliance_id})
+
+    async def alliance_battle_list_v2(self):
+        return await self.post('alliance/battle/list/v2')
+
+    async def item_list(self):
+        return await self.post('item/list')
+
+    async def item_use(self, code, amount=1):
+        res = await self.post('item/use', {'code': code, 'amount': amount})
+
+        await self.auth_analytics('item/use', f'{code}|{amount}')
+
+        return res
+
+    async def auth_analytics(self, url, param):
+        return await self.post('auth/analytics', {'url': url, 'param': param})
+
+    async def item_free_chest(self, _type=0):
+        return await self.post('item/freechest', {'type': _type})
+
+    async def event_roulette_spin(self):
+        return await self.post('event/roulette/spin')
+
+    async def mail_list_check(self):
+        return await self.post('mail/list/check')
+
+    async def mail_claim_all(self, category=1):
+        return await self.post('mail/claim/all', {'category': category})
+
+    async def field_worldmap_devrank(self):
+        return await self.post('field/worldmap/devrank')
+
+    async def field_march_info(self, data):
+        return await self.post('field/march/info', data)
+
+    async def field_march_start(self, data):
+        return await self.post('field/march/start', data)
+
+    async def chat_new(self, chat_channel, chat_type, text, param=None):
+        data = {
+            'chatChannel': chat_channel,
+            'chatType': chat_type,
+            'text': text,
+        }
+
+        if param:
+            data['param'] = param
+
+        return await self.post('chat/new', data)
@@ -3,11 +3,15 @@ import asyncio
 import lokbot.async_client
 
 import lokbot.enum
+from lokbot import logger
+
+# the buys of `parallel_buy_caravan` race each other on purpose, the rate limiter would send them one by one
+PARALLEL_RATE_LIMITS = {'*': (0, 0), 'kingdom/caravan/buy': (0, 0)}
 
 
 class AsyncLokFarmer:
     def __init__(self, token, concurrency=50):
-        self.api = lokbot.async_client.AsyncLokBotApi(token)
+        self.api = lokbot.async_client.AsyncLokBotApi(token, rate_limits=PARALLEL_RATE_LIMITS)
         self.concurrency = concurrency
 
     async def parallel_buy_caravan(self):
@@ -24,5 +28,7 @@ class AsyncLokFarmer:
                 asyncio.ensure_future(self.api.kingdom_caravan_buy(each_item.get('_id')))
                 for _ in range(self.concurrency)
             ]
-            await asyncio.gather(*jobs)
+            results = await asyncio.gather(*jobs, return_exceptions=True)
+            errors = [result for result in results if isinstance(result, Exception)]
+            logger.info(f'parallel_buy_caravan: {len(results) - len(errors)} bought, {len(errors)} failed')
             return
@@ -0,0 +1,87 @@
+import concurrent.futures
+import random
+import threading
+import time
+
+# endpoint(api method name): max in-flight calls, endpoints not listed here use `DEFAULT_CONCURRENCY`
+CONCURRENCY_MAP = {
+    'item_use': 1,
+    'mail_claim_all': 1,
+    'kingdom_caravan_buy': 1,
+    'field_march_start': 1,
+}
+
+DEFAULT_CONCURRENCY = 4
+
+
+class BatchExecutor:
+    """
+    issue independent api calls concurrently over the shared connection,
+    human-like jitter is applied as a random start offset of each call instead of sleeping between calls.
+    the calling thread submits every call at its offset, no worker or endpoint slot is held while waiting
+    """
+
+    def __init__(self, max_workers=8, jitter=(0, 0), shuffle=False, concurrency_map=None):
+        self.max_workers = max_workers
+        self.jitter = jitter
+        self.shuffle = shuffle
+        self.concurrency_map = {**CONCURRENCY_MAP, **(concurrency_map or {})}
+        self.calls = []
+
+    def add(self, func, *args, **kwargs):
+        self.calls.append((func, args, kwargs))
+
+        return self
+
+    def _get_semaphore(self, semaphores, func):
+        endpoint = func.__name__
+
+        if endpoint not in semaphores:
+            semaphores[endpoint] = threading.Semaphore(self.concurrency_map.get(endpoint, DEFAULT_CONCURRENCY))
+
+        return semaphores[endpoint]
+
+    def run(self, return_exceptions=False):
+        """
+        :param return_exceptions: return exceptions in place of results instead of raising the first one
+        :return: results in the order the calls were added
+        """
+        calls, self.calls = self.calls, []
+        if not calls:
+            return []
+
+        order = list(range(len(calls)))
+        if self.shuffle:
+            random.shuffle(order)
+
+        started_at = time.monotonic()
+        semaphores = {}
+        for func, _, _ in calls:
+            self._get_semaphore(semaphores, func)
+
+        def worker(func, args, kwargs):
+            with semaphores[func.__name__]:
+                return func(*args, **kwargs)
+
+        # sorted by offset only, so calls of the same offset keep the shuffled order
+        start_offsets = sorted(((random.uniform(*self.jitter), index) for index in order), key=lambda x: x[0])
+
+        futures = [None] * len(calls)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(calls))) as executor:
+            for offset, index in start_offsets:
+                delay = started_at + offset - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+                func, args, kwargs = calls[index]
+                futures[index] = executor.submit(worker, func, args, kwargs)
+
+        results = []
+        for future in futures:
+            exception = future.exception()
+            if exception is not None and not return_exceptions:
+                raise exception
+
+            results.append(exception if exception is not None else future.result())
+
+        return results
@@ -0,0 +1,89 @@
+import collections
+import threading
+import time
+import weakref
+
+
+class TTLCache:
+    """
+    thread-safe LRU cache whose entries expire after `ttl` seconds
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.data = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.data.get(key)
+
+            if entry is None or (entry[1] is not None and entry[1] < time.monotonic()):
+                self.data.pop(key, None)
+                self.misses += 1
+                return default
+
+            self.data.move_to_end(key)
+            self.hits += 1
+
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        with self.lock:
+            self.data[key] = (value, expires_at)
+            self.data.move_to_end(key)
+
+            while self.maxsize and len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def delete_where(self, predicate):
+        with self.lock:
+            for key in [key for key in self.data if predicate(key)]:
+                del self.data[key]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get_stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.data), 'maxsize': self.maxsize}
+
+
+class CacheRegistry:
+    """
+    every named cache of the process, for stats. caches are owned by their instance(e.g. the response cache of
+    an api client) and are only weakly referenced here, so that they are released with it
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.caches = weakref.WeakValueDictionary()
+
+    def register(self, name, cache: TTLCache) -> TTLCache:
+        with self.lock:
+            self.caches[name] = cache
+
+        return cache
+
+    def get_stats(self):
+        with self.lock:
+            caches = dict(self.caches)
+
+        return {name: cache.get_stats() for name, cache in sorted(caches.items())}
+
+
+cache_registry = CacheRegistry()
@@ -1,8 +1,7 @@
 import json
 
-import httpx
-
 from lokbot import logger
+from lokbot.pool import pool_manager
 
 
 class Base:
@@ -12,7 +11,7 @@ class Base:
 
 class Ttshitu(Base):
     def __init__(self, username, password):
-        self.client = httpx.Client(base_url='https://api.ttshitu.com/')
+        self.client = pool_manager.client(base_url='https://api.ttshitu.com/')
         self.username = username
         self.password = password
 
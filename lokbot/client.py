@@ -1,42 +1,93 @@
 import base64
+import copy
 import gzip
 import json
 import time
 import typing
 
 import httpx
-import ratelimit
 import tenacity
 
 import lokbot.enum
+import lokbot.serializer
 import lokbot.util
+from lokbot.cache import TTLCache, cache_registry
+from lokbot.codec import XorCodec, FieldPackDecoder, FieldObjects
 from lokbot.exceptions import *
-from lokbot import logger, project_root
-
-
-class LokBotApi:
-    def __init__(self, token, captcha_solver_config, request_callback=None):
-        self.opener = httpx.Client(
-            headers={
-                'Accept': '*/*',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Origin': 'https://play.leagueofkingdoms.com',
-                'Referer': 'https://play.leagueofkingdoms.com/',
-                'Sec-Fetch-Dest': 'empty',
-                'Sec-Fetch-Mode': 'cors',
-                'Sec-Fetch-Site': 'same-site',
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/114.0',
-                'X-Access-Token': token
-            },
-            http2=True,
-            base_url=lokbot.enum.API_BASE_URL,
-        )
+from lokbot.pool import pool_manager
+from lokbot.ratelimiter import RateLimiter
+from lokbot import logger, config
+
+
+HEADERS = {
+    'Accept': '*/*',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Origin': 'https://play.leagueofkingdoms.com',
+    'Referer': 'https://play.leagueofkingdoms.com/',
+    'Sec-Fetch-Dest': 'empty',
+    'Sec-Fetch-Mode': 'cors',
+    'Sec-Fetch-Site': 'same-site',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/114.0',
+}
+
+LOG_TRUNCATE_CONFIG = {
+    'max_length': config.get('logging', {}).get('max_length', 256),
+    'max_items': config.get('logging', {}).get('max_items', 32),
+}
+
+# api_path: ttl in seconds, responses of these read-only apis are reused by all jobs within the ttl
+RESPONSE_CACHE_TTL_MAP = {
+    'item/list': 10,
+    'kingdom/task/all': 5,
+    'kingdom/profile/troops': 5,
+    'drago/lair/list': 30,
+    'kingdom/wall/info': 60,
+}
+
+# api_path: cached api_paths which are outdated once this api succeeded
+RESPONSE_CACHE_INVALIDATION_MAP = {
+    'item/use': ('item/list',),
+    'item/freechest': ('item/list',),
+    'kingdom/task/speedup': ('item/list', 'kingdom/task/all'),
+    'kingdom/heal/speedup': ('item/list',),
+    'kingdom/task/claim': ('kingdom/task/all', 'kingdom/profile/troops'),
+    'kingdom/building/upgrade': ('kingdom/task/all',),
+    'kingdom/building/build': ('kingdom/task/all',),
+    'kingdom/arcademy/research': ('kingdom/task/all',),
+    'kingdom/barrack/train': ('kingdom/task/all',),
+    'kingdom/hospital/recover': ('kingdom/profile/troops',),
+    'kingdom/wall/repair': ('kingdom/wall/info',),
+    'kingdom/caravan/buy': ('item/list',),
+    'kingdom/vipshop/buy': ('item/list',),
+    'kingdom/vip/claim': ('item/list',),
+    'alliance/shop/buy': ('item/list',),
+    'alliance/gift/claim/all': ('item/list',),
+    'mail/claim/all': ('item/list',),
+    'quest/claim': ('item/list',),
+    'quest/claim/daily': ('item/list',),
+    'quest/claim/daily/level': ('item/list',),
+    'event/claim': ('item/list',),
+    'event/roulette/spin': ('item/list',),
+    'field/march/start': ('kingdom/profile/troops', 'drago/lair/list'),
+}
+
+
+class BaseLokBotApi:
+    """
+    transport independent part of the api client: xor protection, response unpacking and error code mapping,
+    shared by `LokBotApi` and `lokbot.async_client.AsyncLokBotApi`
+    """
+
+    def __init__(self, token, captcha_solver_config, request_callback=None, rate_limits=None):
         self.token = token
         self.request_callback = request_callback
         self._id = lokbot.util.decode_jwt(token).get('_id')
+        self.rate_limiter = RateLimiter(rate_limits)
+        self.response_cache = cache_registry.register(f'account_{self._id}.responses', TTLCache(maxsize=64))
 
-        self.xor_password = None
+        self.xor_codec = None
+        self.field_pack_decoder = None
         self.protected_api_list = []
 
         self.last_requested_at = time.time()
@@ -46,79 +97,122 @@ class LokBotApi:
             from lokbot.captcha_solver import Ttshitu
             self.captcha_solver = Ttshitu(**captcha_solver_config['ttshitu'])
 
+    @property
+    def xor_password(self):
+        return self.xor_codec.password if self.xor_codec else None
+
+    @xor_password.setter
+    def xor_password(self, value):
+        self.xor_codec = XorCodec(value) if value else None
+        self.field_pack_decoder = FieldPackDecoder(self.xor_codec) if value else None
+
     def xor(self, plain: bytes) -> bytes:
-        assert self.xor_password is not None
+        assert self.xor_codec is not None
 
-        return bytearray([
-            each_plain ^ ord(self.xor_password[index % len(self.xor_password)])
-            for index, each_plain in enumerate(plain)
-        ])
+        return self.xor_codec.xor(plain)
 
     def b64xor_enc(self, d: dict) -> str:
-        return base64.b64encode(self.xor(json.dumps(d, separators=(',', ':')).encode())).decode()
+        return base64.b64encode(self.xor(lokbot.serializer.dumpb(d))).decode()
 
     def b64xor_dec(self, s: typing.Union[str, bytes]) -> dict:
-        return json.loads(self.xor(base64.b64decode(s)))
+        return lokbot.serializer.loads(self.xor(base64.b64decode(s)))
 
-    @tenacity.retry(
-        stop=tenacity.stop_after_attempt(2),
-        wait=tenacity.wait_random_exponential(multiplier=1, max=60),
-        # general http error or json decode error
-        retry=tenacity.retry_if_exception_type((httpx.HTTPError, json.JSONDecodeError)),
-        reraise=True
-    )
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(2),
-        retry=tenacity.retry_if_exception_type(DuplicatedException),  # server-side rate limiter(wait 2s)
-    )
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(3600),
-        retry=tenacity.retry_if_exception_type(ExceedLimitPacketException),  # server-side rate limiter(wait 1h)
-    )
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=0.1)
-    def post(self, url, json_data=None):
-        if json_data is None:
-            json_data = {}
+    def decode_field_objects(self, packs) -> FieldObjects:
+        """
+        decode `packs` of `/field/objects/v4`
+        :param packs: gzip compressed, base64 encoded and xor encrypted json
+        :return:
+        """
+        assert self.field_pack_decoder is not None
 
-        post_data = json.dumps(json_data, separators=(',', ':'))
-        api_path = str(url).split('/api/').pop()
-        if api_path in self.protected_api_list:
-            post_data = self.b64xor_enc(json_data)
+        return self.field_pack_decoder.decode_objects(packs)
 
-        # remove request cookie since it's not needed and may cause account ban
-        self.opener.cookies.clear()
+    def invalidate_cache(self, *api_paths):
+        """
+        drop cached responses of `api_paths`, for state changes the api client can not see(e.g. socket events)
+        :param api_paths:
+        :return:
+        """
+        self.response_cache.delete_where(lambda key: key[0] in api_paths)
 
-        response = self.opener.post(url, data={'json': post_data})
-        self.last_requested_at = time.time()
+    @staticmethod
+    def _get_cache_key(api_path, json_data):
+        return api_path, json.dumps(json_data, sort_keys=True)
 
-        log_data = {
-            'url': url,
-            'data': json_data,
-            'elapsed': response.elapsed.total_seconds(),
-        }
+    def _get_cached_response(self, api_path, json_data):
+        if api_path not in RESPONSE_CACHE_TTL_MAP:
+            return None
+
+        json_response = self.response_cache.get(self._get_cache_key(api_path, json_data))
+
+        # callers are free to mutate the response
+        return copy.deepcopy(json_response) if json_response is not None else None
+
+    def _update_response_cache(self, api_path, json_data, json_response):
+        outdated_api_paths = RESPONSE_CACHE_INVALIDATION_MAP.get(api_path)
+        if outdated_api_paths:
+            self.invalidate_cache(*outdated_api_paths)
+
+        ttl = RESPONSE_CACHE_TTL_MAP.get(api_path)
+        if ttl:
+            self.response_cache.set(self._get_cache_key(api_path, json_data), copy.deepcopy(json_response), ttl)
+
+    @staticmethod
+    def _get_api_path(url):
+        return str(url).split('/api/').pop()
+
+    def _encode_request(self, api_path, json_data):
+        if api_path in self.protected_api_list:
+            return self.b64xor_enc(json_data)
+
+        return lokbot.serializer.dumps(json_data)
 
+    def _decode_response(self, url, api_path, json_data, response):
         try:
             if api_path in self.protected_api_list and response.text[0] != '{':
                 json_response = self.b64xor_dec(response.text)
             else:
-                json_response = response.json()
+                json_response = lokbot.serializer.loads(response.content)
         except json.JSONDecodeError:
-            log_data.update({'res': response.text})
-            logger.error(log_data)
+            logger.error({
+                'url': url,
+                'data': json_data,
+                'elapsed': response.elapsed.total_seconds(),
+                'res': lokbot.util.truncate(response.text, **LOG_TRUNCATE_CONFIG)
+            })
 
             raise
 
         if json_response.get('isPacked') is True:
-            json_response = json.loads(gzip.decompress(bytearray(json_response.get('payload'))))
+            json_response = lokbot.serializer.loads(gzip.decompress(bytearray(json_response.get('payload'))))
 
-        log_data.update({'res': json_response})
+        return json_response
 
-        logger.debug(json.dumps(log_data))
+    @staticmethod
+    def _log_request(url, json_data, json_response, elapsed, request_stats):
+        """
+        the record is serialized only when a sink accepts DEBUG,
+        timing fields are available to sinks as `extra` attributes
+        """
+        fields = {
+            'url': url,
+            'elapsed': elapsed,
+            'queue_wait': round(request_stats['queue_wait'], 3),
+            'retry_count': request_stats['attempts'] - 1,
+        }
 
+        logger.bind(**fields).opt(lazy=True).debug('{}', lambda: lokbot.serializer.dumps({
+            **fields,
+            'data': json_data,
+            'res': lokbot.util.truncate(json_response, **LOG_TRUNCATE_CONFIG),
+        }))
+
+    def _handle_response(self, json_response):
+        """
+        map error codes to exceptions, `NeedCaptchaException` is left for the caller to solve
+        :param json_response:
+        :return:
+        """
         if json_response.get('result'):
             if callable(self.request_callback):
                 self.request_callback(json_response)
@@ -129,16 +223,11 @@ class LokBotApi:
         code = err.get('code')
 
         if code == 'no_auth':
-            project_root.joinpath(f'data/{self._id}.token').unlink(missing_ok=True)
+            lokbot.data_dir.joinpath(f'{self._id}.token').unlink(missing_ok=True)
             raise NoAuthException()
 
         if code == 'need_captcha':
-            if not self.captcha_solver:
-                raise NeedCaptchaException()
-
-            self._solve_captcha()
-
-            raise DuplicatedException()
+            raise NeedCaptchaException()
 
         if code == 'duplicated':
             raise DuplicatedException()
@@ -151,6 +240,76 @@ class LokBotApi:
 
         raise OtherException(code)
 
+
+class LokBotApi(BaseLokBotApi):
+    def __init__(self, token, captcha_solver_config, request_callback=None, rate_limits=None):
+        super().__init__(token, captcha_solver_config, request_callback, rate_limits)
+
+        self.opener = pool_manager.client(
+            headers={**HEADERS, 'X-Access-Token': token},
+            base_url=lokbot.enum.API_BASE_URL,
+        )
+
+    def post(self, url, json_data=None):
+        if json_data is None:
+            json_data = {}
+
+        # shared by every retry of this request
+        request_stats = {'attempts': 0, 'queue_wait': 0.0}
+
+        return self._post(url, json_data, request_stats)
+
+    @tenacity.retry(
+        stop=tenacity.stop_after_attempt(2),
+        wait=tenacity.wait_random_exponential(multiplier=1, max=60),
+        # general http error or json decode error
+        retry=tenacity.retry_if_exception_type((httpx.HTTPError, json.JSONDecodeError)),
+        reraise=True
+    )
+    @tenacity.retry(
+        wait=tenacity.wait_fixed(2),
+        retry=tenacity.retry_if_exception_type(DuplicatedException),  # server-side rate limiter(wait 2s)
+    )
+    @tenacity.retry(
+        wait=tenacity.wait_fixed(3600),
+        retry=tenacity.retry_if_exception_type(ExceedLimitPacketException),  # server-side rate limiter(wait 1h)
+    )
+    def _post(self, url, json_data, request_stats):
+        request_stats['attempts'] += 1
+
+        api_path = self._get_api_path(url)
+
+        cached_response = self._get_cached_response(api_path, json_data)
+        if cached_response is not None:
+            return cached_response
+
+        post_data = self._encode_request(api_path, json_data)
+
+        request_stats['queue_wait'] += self.rate_limiter.acquire(api_path)
+
+        # remove request cookie since it's not needed and may cause account ban
+        self.opener.cookies.clear()
+
+        response = self.opener.post(url, data={'json': post_data})
+        self.last_requested_at = time.time()
+
+        json_response = self._decode_response(url, api_path, json_data, response)
+        self._log_request(url, json_data, json_response, response.elapsed.total_seconds(), request_stats)
+
+        try:
+            json_response = self._handle_response(json_response)
+        except NeedCaptchaException:
+            if not self.captcha_solver:
+                raise
+
+            self._solve_captcha()
+
+            raise DuplicatedException()
+
+        self._update_response_cache(api_path, json_data, json_response)
+
+        return json_response
+
     @tenacity.retry(
         stop=tenacity.stop_after_attempt(4),
         wait=tenacity.wait_random_exponential(multiplier=1, max=60)
@@ -170,11 +329,6 @@ class LokBotApi:
     def auth_captcha(self):
         return self.opener.get('auth/captcha')
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=2)
     def auth_captcha_confirm(self, value):
         return self.post('auth/captcha/confirm', {'value': value})
 
@@ -183,7 +337,7 @@ class LokBotApi:
             res = self.post('https://lok-api-live.leagueofkingdoms.com/api/auth/connect', json_data)
         except OtherException:
             # {"result":false,"err":{}} when no auth
-            project_root.joinpath(f'data/{self._id}.token').unlink(missing_ok=True)
+            lokbot.data_dir.joinpath(f'{self._id}.token').unlink(missing_ok=True)
             raise NoAuthException()
 
         self.opener.headers['x-access-token'] = res['token']
@@ -228,11 +382,6 @@ class LokBotApi:
         """
         return self.post('quest/list/daily')
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=1)
     def quest_claim(self, quest):
         """
         领取任务奖励
@@ -241,11 +390,6 @@ class LokBotApi:
         """
         return self.post('quest/claim', {'questId': quest.get('_id'), 'code': quest.get('code')})
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=1)
     def quest_claim_daily(self, quest):
         """
         领取日常任务奖励
@@ -254,11 +398,6 @@ class LokBotApi:
         """
         return self.post('quest/claim/daily', {'questId': quest.get('_id'), 'code': quest.get('code')})
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=1)
     def quest_claim_daily_level(self, reward):
         """
         领取日常任务上方进度条奖励
@@ -289,11 +428,6 @@ class LokBotApi:
         """
         return self.post('event/list')
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=2)
     def event_info(self, root_event_id):
         """
         获取活动信息
@@ -301,11 +435,6 @@ class LokBotApi:
         """
         return self.post('event/info', {'rootEventId': root_event_id})
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=1)
     def event_claim(self, event_id, event_target_id, code):
         """
         领取活动奖励
@@ -348,11 +477,6 @@ class LokBotApi:
         """
         return self.post('kingdom/task/all')
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=4)
     def kingdom_task_claim(self, position):
         """
         领取任务奖励
@@ -360,11 +484,6 @@ class LokBotApi:
         """
         return self.post('kingdom/task/claim', {'position': position})
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=2)
     def kingdom_task_speedup(self, task_id, code, amount, is_buy=0):
         """
         加速任务
@@ -376,11 +495,6 @@ class LokBotApi:
 
         return res
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=2)
     def kingdom_heal_speedup(self, code, amount, is_buy=0):
         """
         加速治疗
@@ -416,11 +530,6 @@ class LokBotApi:
     def kingdom_hospital_wounded(self):
         return self.post('kingdom/hospital/wounded')
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=4)
     def kingdom_resource_harvest(self, position):
         """
         收获资源
@@ -429,11 +538,6 @@ class LokBotApi:
         """
         return self.post('kingdom/resource/harvest', {'position': position})
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),  # client-side rate limiter
-    )
-    @ratelimit.limits(calls=1, period=6)
     def kingdom_building_upgrade(self, building, instant=0):
         """
         建筑升级
@@ -447,11 +551,6 @@ class LokBotApi:
             'instant': instant
         })
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=6)
     def kingdom_building_build(self, building, instant=0):
         """
         建筑建造
@@ -465,11 +564,6 @@ class LokBotApi:
             'instant': instant
         })
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=6)
     def kingdom_academy_research(self, research, instant=0):
         """
         学院研究升级
@@ -508,11 +602,6 @@ class LokBotApi:
     def kingdom_caravan_list(self):
         return self.post('kingdom/caravan/list')
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=4)
     def kingdom_caravan_buy(self, caravan_item_id):
         return self.post('kingdom/caravan/buy', {'caravanItemId': caravan_item_id})
 
@@ -557,11 +646,6 @@ class LokBotApi:
         """
         return self.post('item/list')
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=2)
     def item_use(self, code, amount=1):
         """
         使用道具
@@ -584,11 +668,6 @@ class LokBotApi:
         """
         return self.post('auth/analytics', {'url': url, 'param': param})
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=4)
     def item_free_chest(self, _type=0):
         """
         领取免费宝箱
@@ -597,11 +676,6 @@ class LokBotApi:
         """
         return self.post('item/freechest', {'type': _type})
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=2)
     def event_roulette_spin(self):
         """
         转轮抽奖
@@ -613,11 +687,6 @@ class LokBotApi:
     def mail_list_check(self):
         return self.post('mail/list/check')
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=2)
     def mail_claim_all(self, category=1):
         return self.post('mail/claim/all', {'category': category})
 
@@ -633,11 +702,6 @@ class LokBotApi:
     def field_march_info(self, data):
         return self.post('field/march/info', data)
 
-    @tenacity.retry(
-        wait=tenacity.wait_fixed(1),
-        retry=tenacity.retry_if_exception_type(ratelimit.RateLimitException),
-    )
-    @ratelimit.limits(calls=1, period=4)
     def field_march_start(self, data):
         return self.post('field/march/start', data)
 
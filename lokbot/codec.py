@@ -0,0 +1,213 @@
+import binascii
+import threading
+import timeit
+import typing
+import zlib
+
+import numpy
+
+import lokbot.serializer
+
+# gunzipped packs are written to the text buffer this many bytes at a time
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+
+class XorCodec:
+    """
+    XOR codec for protected api payloads, the key stream of `xor_password` is computed once
+    and applied to the whole buffer at a time instead of byte by byte
+    """
+
+    def __init__(self, password: str):
+        self.password = password
+        self._key = numpy.frombuffer(password.encode('latin-1'), dtype=numpy.uint8)
+        self._key_stream = self._key.copy()
+
+    def _get_key_stream(self, length):
+        if len(self._key_stream) < length:
+            # grow to the next power of two, so that the stream is rebuilt only a few times
+            size = 1 << (length - 1).bit_length()
+            self._key_stream = numpy.resize(self._key, size)
+
+        return self._key_stream[:length]
+
+    def xor(self, plain) -> bytes:
+        data = numpy.frombuffer(plain, dtype=numpy.uint8)
+
+        return numpy.bitwise_xor(data, self._get_key_stream(len(data))).tobytes()
+
+    def xor_into(self, data, out):
+        """
+        :param data: buffer to xor
+        :param out: writable buffer(bytearray, memoryview, ...) of the same length, may be `data` itself
+        :return: out
+        """
+        data = numpy.frombuffer(data, dtype=numpy.uint8)
+        numpy.bitwise_xor(data, self._get_key_stream(len(data)), out=numpy.frombuffer(out, dtype=numpy.uint8))
+
+        return out
+
+
+class FieldObject:
+    """
+    wrapper of a parsed field object(dict), naming the fields read by the target matcher
+    """
+    __slots__ = ('raw',)
+
+    def __init__(self, raw: dict):
+        self.raw = raw
+
+    @property
+    def id(self):
+        return self.raw.get('_id')
+
+    @property
+    def code(self):
+        return self.raw.get('code')
+
+    @property
+    def level(self):
+        return self.raw.get('level')
+
+    @property
+    def loc(self):
+        return self.raw.get('loc')
+
+    @property
+    def occupied(self):
+        return self.raw.get('occupied')
+
+    def __repr__(self):
+        return repr(self.raw)
+
+
+class FieldObjects:
+    """
+    the parsed `objects` of a `/field/objects/v4` pack, only the selected ones are wrapped
+    """
+    __slots__ = ('_objects',)
+
+    def __init__(self, objects: list):
+        self._objects = objects
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __iter__(self) -> typing.Iterator[FieldObject]:
+        return map(FieldObject, self._objects)
+
+    def select(self, codes) -> typing.Iterator[FieldObject]:
+        """
+        iterate over objects whose code is in `codes`, other objects are never wrapped
+        :param codes: set of object codes
+        :return:
+        """
+        return map(FieldObject, [each for each in self._objects if each.get('code') in codes])
+
+
+class FieldPackDecoder:
+    """
+    gzip -> base64 -> xor -> json decode pipeline of `/field/objects/v4` packs.
+
+    the gunzipped text and the xor-ed json go to a pair of buffers which is reused across packs,
+    one pair per pack decoded at the same time.
+    copies left per pack: `bytes(packs)` when socket.io hands a list of int, the chunks of `zlib` on their way
+    into the text buffer and the output of `binascii.a2b_base64`, which cannot write into a buffer.
+    the json is parsed as a whole, `FieldObject` wraps the parsed dicts
+    """
+
+    def __init__(self, codec: XorCodec):
+        self.codec = codec
+        # packs are decoded on the threads of the socket.io handlers, every one takes a pair of its own
+        self.lock = threading.Lock()
+        self.free_buffers = []
+
+    @staticmethod
+    def _reserve(buffer: bytearray, size, exact=False):
+        """
+        :param exact: resize to `size`, at least `size` otherwise, contents are kept when it grows
+        """
+        if len(buffer) < size:
+            buffer.extend(bytes(size - len(buffer)))
+        elif exact and len(buffer) > size:
+            del buffer[size:]
+
+        return buffer
+
+    def _decompress(self, packs, text: bytearray) -> int:
+        """
+        gunzip `packs` into `text`
+        :return: size of the text
+        """
+        if not isinstance(packs, (bytes, bytearray, memoryview)):
+            # list of int from socket.io
+            packs = bytes(packs)
+
+        data = memoryview(packs)
+        # ISIZE of the gzip trailer: size of the uncompressed data modulo 2 ** 32, a hint only,
+        # capped by the best ratio of deflate
+        size_hint = int.from_bytes(data[-4:], 'little') if len(data) >= 4 else 0
+        self._reserve(text, min(size_hint, len(data) * 1032))
+        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+
+        size = 0
+        while True:
+            chunk = decompressor.decompress(data, DECOMPRESS_CHUNK_SIZE)
+            if not chunk:
+                break
+
+            end = size + len(chunk)
+            if end > len(text):
+                # ISIZE was off, e.g. a pack of several gzip members
+                self._reserve(text, max(end, 2 * len(text)))
+
+            text[size:end] = chunk
+            size = end
+            data = decompressor.unconsumed_tail
+
+        return size
+
+    def decode(self, packs) -> dict:
+        with self.lock:
+            text, plain = self.free_buffers.pop() if self.free_buffers else (bytearray(), bytearray())
+
+        try:
+            size = self._decompress(packs, text)
+            with memoryview(text) as view:
+                encoded = binascii.a2b_base64(view[:size])
+
+            return lokbot.serializer.loads(self.codec.xor_into(encoded, self._reserve(plain, len(encoded), True)))
+        finally:
+            with self.lock:
+                self.free_buffers.append((text, plain))
+
+    def decode_objects(self, packs) -> FieldObjects:
+        return FieldObjects(self.decode(packs).get('objects', []))
+
+
+def _legacy_xor(password, plain):
+    return bytearray([
+        each_plain ^ ord(password[index % len(password)])
+        for index, each_plain in enumerate(plain)
+    ])
+
+
+def benchmark(sizes=(1024, 16 * 1024, 256 * 1024, 2 * 1024 * 1024), password='5e0a9b7c1d3f'):
+    codec = XorCodec(password)
+
+    for size in sizes:
+        plain = numpy.random.randint(0, 256, size, dtype=numpy.uint8).tobytes()
+        assert codec.xor(plain) == _legacy_xor(password, plain)
+
+        number = max(1, 2 ** 20 // size)
+        legacy = timeit.timeit(lambda: _legacy_xor(password, plain), number=number) / number
+        vectorized = timeit.timeit(lambda: codec.xor(plain), number=number * 10) / (number * 10)
+
+        print(
+            f'{size:>8} bytes: legacy {legacy * 1000:10.3f} ms, '
+            f'vectorized {vectorized * 1000:8.3f} ms, x{legacy / vectorized:.0f}'
+        )
+
+
+if __name__ == '__main__':
+    benchmark()
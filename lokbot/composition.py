@@ -0,0 +1,241 @@
+"""
+Troop composition of a march: the fewest troops(or the fastest march) covering the load of a mine
+or the troops needed against a monster within `march_size`.
+
+every troop adds its `carry`(gathering) or 1(monster) and counts 1 against `march_size`,
+so for a given set of allowed troops the fewest troops are the heaviest ones first, which is exact.
+troops of equal weight are taken from the highest tier down, like the troops of a monster march always were.
+a march moves at the speed of its slowest troop, so the allowed sets are the troops at or above
+each distinct speed, and the best of them is chosen by the objective
+"""
+import json
+import math
+import sys
+import timeit
+
+import numpy
+
+from lokbot import project_root
+from lokbot.enum import *
+
+troop_json = {
+    each.get('code'): each for each in json.load(open(project_root.joinpath('lokbot/assets/troop.json')))
+}
+
+OBJECTIVE_TROOPS = 'troops'
+OBJECTIVE_TIME = 'time'
+
+# troops of any tier a monster takes per `param.value`
+MONSTER_TROOPS_PER_VALUE = 2.5
+
+
+def get_requirement(value, march_type):
+    """
+    :param value: `param.value` of the field object, resources of a mine or strength of a monster
+    :param march_type:
+    :return: load or troops the march has to carry
+    """
+    if march_type == MARCH_TYPE_MONSTER:
+        return value * MONSTER_TROOPS_PER_VALUE
+
+    return value
+
+
+def get_weight(code, march_type):
+    if march_type == MARCH_TYPE_MONSTER:
+        return 1
+
+    return TROOP_LOAD_MAP.get(code, 1)
+
+
+class _Table:
+    """
+    allowed troops of one speed, heaviest first, with running totals of load and count
+    """
+    __slots__ = ('speed', 'indexes', 'weights', 'amounts', 'cum_load', 'cum_count')
+
+    def __init__(self, speed, indexes, weights, amounts):
+        self.speed = speed
+        self.indexes = indexes
+        self.weights = weights
+        self.amounts = amounts
+        self.cum_load = numpy.concatenate(([0.0], numpy.cumsum(weights * amounts)))
+        self.cum_count = numpy.concatenate(([0.0], numpy.cumsum(amounts)))
+
+    def get_counts(self, requirements):
+        """
+        :param requirements: numpy array
+        :return: troops needed for every requirement, inf where the troops are not enough
+        """
+        # all troops before `tier` are taken, the one before it partially
+        tier = numpy.searchsorted(self.cum_load, requirements)
+        partial = numpy.clip(tier - 1, 0, len(self.weights) - 1)
+        counts = self.cum_count[partial] + numpy.ceil(
+            (requirements - self.cum_load[partial]) / self.weights[partial] - 1e-9
+        )
+
+        counts = numpy.where(tier == 0, 0, counts)
+
+        return numpy.where(tier < len(self.cum_load), counts, numpy.inf)
+
+    def get_load(self, count):
+        """
+        :return: the most load of `count` troops
+        """
+        tier = int(numpy.searchsorted(self.cum_count, count, side='right'))
+        if tier >= len(self.cum_count):
+            return float(self.cum_load[-1])
+
+        return float(self.cum_load[tier - 1] + (count - self.cum_count[tier - 1]) * self.weights[tier - 1])
+
+    def get_amounts(self, requirement):
+        """
+        :return: {index of the troop: amount}
+        """
+        amounts = {}
+        for index, weight, amount, cum_load in zip(self.indexes, self.weights, self.amounts, self.cum_load):
+            if cum_load >= requirement:
+                break
+
+            amounts[index] = min(math.ceil((requirement - cum_load) / weight - 1e-9), amount)
+
+        return amounts
+
+
+class TroopSolver:
+    """
+    built once per `troops` of `field/march/info` and march type, then asked for any number of targets
+    """
+
+    def __init__(self, troops, march_type, march_size, objective=OBJECTIVE_TROOPS):
+        """
+        :param troops: `troops` of `field/march/info`, [{'code': ..., 'amount': ...}, ...]
+        :param march_type: MARCH_TYPE_GATHER or MARCH_TYPE_MONSTER
+        :param march_size: most troops of a march
+        :param objective: OBJECTIVE_TROOPS for the fewest troops, faster on ties,
+                          OBJECTIVE_TIME for the fastest march, fewer troops on ties
+        """
+        self.codes = [troop.get('code') for troop in troops]
+        self.march_type = march_type
+        self.march_size = march_size
+        self.objective = objective
+
+        amounts = numpy.array([max(troop.get('amount'), 0) for troop in troops], dtype=numpy.float64)
+        weights = numpy.array([get_weight(code, march_type) for code in self.codes], dtype=numpy.float64)
+        speeds = numpy.array([troop_json.get(code, {}).get('speed', 0) for code in self.codes])
+        codes = numpy.array(self.codes)
+
+        # fastest first, every table allows the troops of its speed and faster ones
+        self.tables = []
+        for speed in sorted(set(speeds[amounts > 0].tolist()), reverse=True):
+            indexes = numpy.flatnonzero((speeds >= speed) & (amounts > 0))
+            indexes = indexes[numpy.lexsort((-speeds[indexes], -codes[indexes], -weights[indexes]))]
+            self.tables.append(_Table(speed, indexes, weights[indexes], amounts[indexes]))
+
+        # gathering takes what `march_size` can carry when the mine is bigger than that
+        self.max_load = self.tables[-1].get_load(march_size) if self.tables else 0.0
+
+    def _choose(self, requirements):
+        if self.march_type == MARCH_TYPE_GATHER:
+            requirements = numpy.minimum(requirements, self.max_load)
+
+        if not self.tables:
+            counts = numpy.where(requirements > 0, numpy.inf, 0)
+            return counts, numpy.zeros(len(requirements), dtype=numpy.intp), requirements
+
+        counts = numpy.stack([table.get_counts(requirements) for table in self.tables])
+        counts[counts > self.march_size] = numpy.inf
+
+        if self.objective == OBJECTIVE_TIME:
+            choices = numpy.argmax(numpy.isfinite(counts), axis=0)
+        else:
+            # the first of equal counts is the fastest
+            choices = numpy.argmin(counts, axis=0)
+
+        return counts[choices, numpy.arange(len(requirements))], choices, requirements
+
+    def get_troop_counts(self, values):
+        """
+        vectorized, for ranking many targets at once
+        :param values: `param.value` of the targets
+        :return: numpy array of troops per target, inf where the target can not be marched to
+        """
+        requirements = get_requirement(numpy.asarray(values, dtype=numpy.float64), self.march_type)
+
+        return self._choose(requirements)[0]
+
+    def solve(self, value):
+        """
+        :param value: `param.value` of the target
+        :return: {code: amount} of every troop, None if the target can not be marched to
+        """
+        counts, choices, requirements = self._choose(
+            get_requirement(numpy.array([value], dtype=numpy.float64), self.march_type)
+        )
+        if not numpy.isfinite(counts[0]):
+            return None
+
+        amounts = dict.fromkeys(self.codes, 0)
+        if self.tables:
+            for index, amount in self.tables[choices[0]].get_amounts(requirements[0]).items():
+                amounts[self.codes[index]] = int(amount)
+
+        return amounts
+
+
+def _legacy_prepare(troops, value, march_type, march_size):
+    need_troop_count = value * 2.5 if march_type == MARCH_TYPE_MONSTER else value
+    troop_count = sum(troop.get('amount') for troop in troops)
+    if march_type == MARCH_TYPE_MONSTER and need_troop_count > troop_count:
+        return None
+
+    amounts = {}
+    for troop in sorted(troops, key=lambda x: x.get('code'), reverse=True):
+        load = TROOP_LOAD_MAP.get(troop.get('code'), 1) if march_type == MARCH_TYPE_GATHER else 1
+        amount = troop.get('amount')
+        if amount * load >= need_troop_count:
+            amount = math.ceil(need_troop_count / load) if need_troop_count else 0
+            need_troop_count = 0
+        else:
+            need_troop_count -= amount * load
+        amounts[troop.get('code')] = amount
+
+    return amounts if sum(amounts.values()) <= march_size else None
+
+
+def benchmark(march_info_path=None, march_size=100000, candidates=1000, number=100):
+    """
+    :param march_info_path: a saved response of `field/march/info`, e.g. a `field.march.info.json` fixture
+                            of `lokbot.mock_server`, all troops when omitted
+    """
+    if march_info_path:
+        troops = json.load(open(march_info_path)).get('troops')
+    else:
+        troops = [{'code': code, 'amount': 20000} for code in troop_json]
+
+    values = numpy.random.default_rng(0).integers(1000, 600000, candidates)
+
+    for march_type in (MARCH_TYPE_GATHER, MARCH_TYPE_MONSTER):
+        solver = TroopSolver(troops, march_type, march_size)
+
+        legacy_troops = [_legacy_prepare(troops, int(value), march_type, march_size) for value in values]
+        solved_troops = [solver.solve(int(value)) for value in values]
+        legacy_total = sum(sum(each.values()) for each in legacy_troops if each)
+        solved_total = sum(sum(each.values()) for each in solved_troops if each)
+
+        legacy = timeit.timeit(
+            lambda: [_legacy_prepare(troops, int(value), march_type, march_size) for value in values], number=1
+        )
+        scalar = timeit.timeit(lambda: [solver.solve(int(value)) for value in values], number=1)
+        vectorized = timeit.timeit(lambda: solver.get_troop_counts(values), number=number) / number
+
+        print(
+            f'march type {march_type}: {candidates} targets, '
+            f'legacy {legacy * 1000:8.3f} ms ({sum(map(bool, legacy_troops))} marched, {legacy_total} troops), '
+            f'solve {scalar * 1000:8.3f} ms ({sum(map(bool, solved_troops))} marched, {solved_total} troops), '
+            f'vectorized {vectorized * 1000:8.3f} ms'
+        )
+
+
+if __name__ == '__main__':
+    benchmark(*sys.argv[1:2])
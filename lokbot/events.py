@@ -0,0 +1,151 @@
+import collections
+import itertools
+import threading
+import time
+
+from lokbot import logger
+
+# `/task/update` of `sock_thread`, data is the task
+EVENT_TASK_FINISHED = 'task_finished'
+EVENT_TASK_CLAIMED = 'task_claimed'
+# `/resource/upgrade`, data: {'resourceIdx', 'value'}
+EVENT_RESOURCE_UPDATE = 'resource_update'
+# `/building/update`, data is the building
+EVENT_BUILDING_UPDATE = 'building_update'
+
+# events kept per type for subscribers which started listening a bit late
+HISTORY_SIZE = 16
+
+
+class _Subscription:
+    __slots__ = ('seq', 'event_type', 'callback', 'match', 'once', 'on_timeout')
+
+    def __init__(self, seq, event_type, callback, match, once, on_timeout):
+        self.seq = seq
+        self.event_type = event_type
+        self.callback = callback
+        self.match = match
+        self.once = once
+        self.on_timeout = on_timeout
+
+
+class EventBus:
+    """
+    events of the sockets of an account, handed to subscribers instead of threads blocked on `threading.Event`s.
+
+    one-shot subscribers may give a timeout with a fallback, e.g. polling the api for what the event
+    would have told, so that they are never stuck on a dropped socket
+    """
+
+    def __init__(self, scheduler, name='events'):
+        """
+        :param scheduler: `lokbot.scheduler.Scheduler` running the timeouts
+        :param name: prefix of the timeout jobs
+        """
+        self.scheduler = scheduler
+        self.name = name
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        self.subscriptions = collections.defaultdict(dict)
+        self.history = collections.defaultdict(lambda: collections.deque(maxlen=HISTORY_SIZE))
+        # {key: subscription} of the one-shot subscribers giving a key
+        self.keyed = {}
+
+    def subscribe(self, event_type, callback, match=None):
+        """
+        :param event_type: EVENT_*
+        :param callback: called with the data of every matched event, on the publishing thread
+        :param match: predicate of the data, every event when omitted
+        :return: id of the subscription
+        """
+        with self.lock:
+            seq = next(self.counter)
+            self.subscriptions[event_type][seq] = _Subscription(seq, event_type, callback, match, False, None)
+
+        return seq
+
+    def _find_published(self, event_type, match, since):
+        for published_at, data in self.history[event_type]:
+            if published_at >= since and (match is None or match(data)):
+                return data,
+
+        return None
+
+    def once(self, event_type, callback, match=None, timeout=None, on_timeout=None, since=None, key=None):
+        """
+        :param event_type: EVENT_*
+        :param callback: called with the data of the first matched event
+        :param match: predicate of the data
+        :param timeout: seconds, `on_timeout` is called instead if no event matched by then
+        :param on_timeout: `callback` is called with None when omitted
+        :param since: timestamp, an event published after it but before subscribing is taken as well
+        :param key: replaces the pending subscription of the same key, also names the timeout job
+        :return: id of the subscription, None if a published event was taken
+        """
+        with self.lock:
+            if key is not None and key in self.keyed:
+                replaced = self.keyed.pop(key)
+                self.subscriptions[replaced.event_type].pop(replaced.seq, None)
+
+            published = self._find_published(event_type, match, since) if since is not None else None
+
+            if published is None:
+                seq = next(self.counter)
+                subscription = _Subscription(
+                    seq, event_type, callback, match, True, on_timeout or (lambda: callback(None))
+                )
+                self.subscriptions[event_type][seq] = subscription
+                if key is not None:
+                    self.keyed[key] = subscription
+
+        if published is not None:
+            self._call(callback, published[0])
+            return None
+
+        if timeout is not None:
+            self.scheduler.call_later(timeout, f'{self.name}.{key or f"timeout_{seq}"}', self._expire, subscription)
+
+        return seq
+
+    def unsubscribe(self, event_type, seq):
+        with self.lock:
+            return self.subscriptions[event_type].pop(seq, None) is not None
+
+    def _expire(self, subscription: _Subscription):
+        if not self.unsubscribe(subscription.event_type, subscription.seq):
+            # the event came first
+            return
+
+        logger.info(f'no {subscription.event_type} event in time, fall back')
+        subscription.on_timeout()
+
+    @staticmethod
+    def _call(callback, data):
+        try:
+            callback(data)
+        except Exception as e:
+            logger.opt(exception=e).error(f'event callback failed: {e}')
+
+    def publish(self, event_type, data):
+        """
+        :param event_type: EVENT_*
+        :param data:
+        :return: subscribers called
+        """
+        with self.lock:
+            self.history[event_type].append((time.time(), data))
+
+            matched = []
+            for seq, subscription in list(self.subscriptions[event_type].items()):
+                if subscription.match is not None and not subscription.match(data):
+                    continue
+
+                if subscription.once:
+                    del self.subscriptions[event_type][seq]
+
+                matched.append(subscription)
+
+        for subscription in matched:
+            self._call(subscription.callback, data)
+
+        return len(matched)
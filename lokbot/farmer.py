@@ -1,21 +1,42 @@
 import base64
-import functools
-import gzip
+import collections
+import concurrent.futures
 import math
 import random
 import threading
 import time
 
 import arrow
-import numpy
 import socketio
 import tenacity
 
+import lokbot.composition
+import lokbot.march
+import lokbot.serializer
+import lokbot.spatial
 import lokbot.util
 from lokbot import logger, socf_logger, sock_logger, socc_logger
+from lokbot.batch import BatchExecutor
 from lokbot.client import LokBotApi
 from lokbot.enum import *
+from lokbot.events import EventBus, EVENT_TASK_FINISHED, EVENT_TASK_CLAIMED, EVENT_RESOURCE_UPDATE, \
+    EVENT_BUILDING_UPDATE
 from lokbot.exceptions import OtherException, FatalApiException
+from lokbot.field_index import FieldObjectIndex
+from lokbot.march import MarchTable
+from lokbot.planner import ZoneSweepPlanner
+from lokbot.scheduler import scheduler
+from lokbot.state import KingdomState, KingdomSnapshot
+from lokbot.targets import TargetRules
+
+# a queue event of `sock_thread` not coming within this many seconds, the tasks are polled again
+QUEUE_EVENT_TIMEOUT = 1800
+# seconds to wait for the field server
+SOCF_WAIT_TIMEOUT = 120
+# zone enter-leave actions of a field session, 9 times enter-leave action will cause ban
+SOCF_GRACE = 7
+# seconds `socf_thread` waits for a free march slot at once, before it checks whether the farmer is stopped
+MARCH_SLOT_WAIT_TIMEOUT = 60
 
 ws_headers = {
     'Accept': '*/*',
@@ -28,49 +49,10 @@ ws_headers = {
 }
 
 
-# Ref: https://stackoverflow.com/a/16858283/6266737
-def blockshaped(arr, nrows, ncols):
-    """
-    Return an array of shape (n, nrows, ncols) where
-    n * nrows * ncols = arr.size
-
-    If arr is a 2D array, the returned array should look like n subblocks with
-    each subblock preserving the "physical" layout of arr.
-    """
-    h, w = arr.shape
-    assert h % nrows == 0, f"{h} rows is not evenly divisible by {nrows}"
-    assert w % ncols == 0, f"{w} cols is not evenly divisible by {ncols}"
-    return (arr.reshape(h // nrows, nrows, -1, ncols)
-            .swapaxes(1, 2)
-            .reshape(-1, nrows, ncols))
-
-
-# Ref: https://stackoverflow.com/a/432175/6266737
-# noinspection PyBroadException
-def ndindex(ndarray, item):
-    if len(ndarray.shape) == 1:
-        try:
-            return [ndarray.tolist().index(item)]
-        except:
-            pass
-    else:
-        for i, subarray in enumerate(ndarray):
-            try:
-                return [i] + ndindex(subarray, item)
-            except:
-                pass
-
-
-# Ref: https://stackoverflow.com/a/22550933/6266737
-def neighbors(a, radius, row_number, column_number):
-    return [[a[i][j] if 0 <= i < len(a) and 0 <= j < len(a[0]) else 0
-             for j in range(column_number - 1 - radius, column_number + radius)]
-            for i in range(row_number - 1 - radius, row_number + radius)]
-
-
 class LokFarmer:
     def __init__(self, token, captcha_solver_config):
         self.kingdom_enter = None
+        self.state = KingdomState()
         self.token = token
         self.api = LokBotApi(token, captcha_solver_config, self._request_callback)
 
@@ -82,9 +64,10 @@ class LokFarmer:
         logger.debug(f'xor_password: {self.api.xor_password}')
         self.token = auth_res.get('token')
         self._id = lokbot.util.decode_jwt(token).get('_id')
-        project_root.joinpath(f'data/{self._id}.token').write_text(self.token)
+        lokbot.data_dir.joinpath(f'{self._id}.token').write_text(self.token)
 
         self.kingdom_enter = self.api.kingdom_enter()
+        self.world_id = self.kingdom_enter.get('kingdom').get('worldId')
         self.alliance_id = self.kingdom_enter.get('kingdom', {}).get('allianceId')
 
         self.api.auth_set_device_info({
@@ -98,31 +81,39 @@ class LokFarmer:
             "pushId": ""
         })
 
-        self.api.chat_logs(f'w{self.kingdom_enter.get("kingdom").get("worldId")}')
+        self.api.chat_logs(f'w{self.world_id}')
         if self.alliance_id:
             self.api.chat_logs(f'a{self.alliance_id}')
 
-        # [food, lumber, stone, gold]
-        self.resources = self.kingdom_enter.get('kingdom').get('resources')
         self.buff_item_use_lock = threading.Lock()
         self.hospital_recover_lock = threading.Lock()
         self.has_additional_building_queue = self.kingdom_enter.get('kingdom').get('vip', {}).get('level') >= 5
-        self.troop_queue = []
-        self.march_limit = 2
+        self.march_table = MarchTable()
         self.march_size = 10000
+        self.available_troops = None
         self.level = self.kingdom_enter.get('kingdom').get('level')
-        self.socf_entered = False
-        self.socf_world_id = None
-        self.field_object_processed = False
         self.started_at = time.time()
-        self.building_queue_available = threading.Event()
-        self.research_queue_available = threading.Event()
-        self.train_queue_available = threading.Event()
-        self.kingdom_tasks = []
-        self.zones = []
-        self.available_dragos = self._get_available_dragos()
+        self.zone_planners = {}
+        self.api.drago_lair_list()
         self.drago_action_point = self.kingdom_enter.get('kingdom').get('dragoActionPoint', {}).get('value', 0)
-        self.shared_objects = set()
+        self.field_objects = FieldObjectIndex()
+        self.scheduler = scheduler
+        self.stopped = False
+        # {name: socketio.Client} of the running socket threads, disconnected by `stop`
+        self.sockets = {}
+        self.sockets_lock = threading.Lock()
+        self.events = EventBus(self.scheduler, self.get_job_name('events'))
+
+    @property
+    def resources(self):
+        """
+        [food, lumber, stone, gold]
+        """
+        return self.state.get_resources()
+
+    @property
+    def available_dragos(self):
+        return self.state.snapshot().get_available_dragos()
 
     @staticmethod
     def calc_time_diff_in_seconds(expected_ended):
@@ -134,14 +125,101 @@ class LokFarmer:
 
         return diff_in_seconds + random.randint(5, 10)
 
-    def _is_building_upgradeable(self, building, buildings):
+    def get_job_name(self, name):
+        """
+        jobs of all accounts share one scheduler, names are scoped by account
+        """
+        return f'{self._id}.{name}'
+
+    def _call_later(self, delay, func, *args):
+        """
+        re-arm a job, a run due while the current one is still going starts right after it
+        """
+        if self.stopped:
+            return
+
+        self.scheduler.call_later(delay, self.get_job_name(func.__name__), func, *args)
+
+    def _continue_on(self, event_type, match, since, func, *args):
+        """
+        re-arm a job on an event of `sock_thread`, or after `QUEUE_EVENT_TIMEOUT` to poll the tasks again
+        in case the event does not come, e.g. the socket dropped meanwhile
+        :param event_type:
+        :param match: predicate of the event data
+        :param since: when the job started, events since then are taken as well
+        :param func:
+        :param args:
+        :return:
+        """
+        def on_timeout():
+            self.state.invalidate_tasks()
+            self._call_later(0, func, *args)
+
+        self.events.once(
+            event_type, lambda data: self._call_later(0, func, *args), match, QUEUE_EVENT_TIMEOUT, on_timeout,
+            since=since, key=func.__name__
+        )
+
+    def _get_tasks(self, code):
+        """
+        tasks of `self.state`, which `sock_thread` keeps up to date.
+        `kingdom/task/all` is only polled when the state is not loaded or may have missed updates,
+        i.e. at the first run, after `sock_thread` (re)connected or after an event timed out in `_continue_on`
+        :param code: TASK_CODE_*
+        :return: (task, ...)
+        """
+        if not self.state.tasks_loaded:
+            self.state.set_tasks(self.api.kingdom_task_all().get('kingdomTasks', []))
+
+        return self.state.snapshot().get_tasks(code)
+
+    def _connect_socket(self, name, sio, url, **kwargs):
+        """
+        connect a socket client which `stop` is able to disconnect
+        :param name:
+        :param sio:
+        :param url:
+        :param kwargs: of `socketio.Client.connect`
+        :return: False if the farmer is stopped, the client is left disconnected then
+        """
+        with self.sockets_lock:
+            if self.stopped:
+                return False
+
+            self.sockets[name] = sio
+
+        sio.connect(url, **kwargs)
+
+        if self.stopped:
+            # stopped while connecting
+            sio.disconnect()
+            return False
+
+        return True
+
+    def stop(self):
+        """
+        drop the pending jobs of the account, stop re-arming them and disconnect the sockets,
+        e.g. before logging in again
+        """
+        with self.sockets_lock:
+            self.stopped = True
+            sockets, self.sockets = self.sockets, {}
+
+        self.scheduler.cancel(self.get_job_name(''))
+
+        for name, sio in sockets.items():
+            try:
+                sio.disconnect()
+            except Exception as e:
+                logger.warning(f'disconnecting {name} failed: {e}')
+
+    def _is_building_upgradeable(self, building, snapshot: KingdomSnapshot):
         if building.get('state') != BUILDING_STATE_NORMAL:
             return False
 
-        if building.get('code') == BUILDING_CODE_MAP['barrack']:
-            for t in self.kingdom_tasks:
-                if t.get('code') == TASK_CODE_CAMP:
-                    return False
+        if building.get('code') == BUILDING_CODE_MAP['barrack'] and snapshot.get_tasks(TASK_CODE_CAMP):
+            return False
 
         # 暂时忽略联盟中心
         if building.get('code') == BUILDING_CODE_MAP['hall_of_alliance']:
@@ -159,14 +237,14 @@ class LokFarmer:
             req_type = requirement.get('type')
             req_code = BUILDING_CODE_MAP.get(req_type)
 
-            if not [b for b in buildings if b.get('code') == req_code and b.get('level') >= req_level]:
+            if not [b for b in snapshot.get_buildings(req_code) if b.get('level') >= req_level]:
                 return False
 
         for res_requirement in next_level_building_json.get('resources'):
             req_value = res_requirement.get('value')
             req_type = res_requirement.get('type')
 
-            if self.resources[RESOURCE_IDX_MAP[req_type]] < req_value:
+            if snapshot.resources[RESOURCE_IDX_MAP[req_type]] < req_value:
                 return False
 
         return True
@@ -215,25 +293,21 @@ class LokFarmer:
 
         return True
 
-    def _update_kingdom_enter_building(self, building):
+    def _update_building(self, building):
         if building.get('code') == BUILDING_CODE_MAP['hospital']:
             if building.get('param', {}).get('wounded', []):
                 logger.info('hospital has wounded troops, try to recover')
                 self.hospital_recover()
 
-        buildings = self.kingdom_enter.get('kingdom', {}).get('buildings', [])
-
-        self.kingdom_enter['kingdom']['buildings'] = [
-                                                         b for b in buildings if
-                                                         b.get('position') != building.get('position')
-                                                     ] + [building]
+        self.state.update_building(building)
 
     def _request_callback(self, json_response):
         resources = json_response.get('resources')
 
         if resources and len(resources) == 4:
             logger.info(f'resources updated: {resources}')
-            self.resources = resources
+
+        self.state.on_response(json_response)
 
     def _get_optimal_speedups(self, need_seconds, speedup_type):
         current_map = ITEM_CODE_SPEEDUP_MAP.get(speedup_type)
@@ -309,8 +383,8 @@ class LokFarmer:
                         self.api.kingdom_task_speedup(task_id, code, count)
                     time.sleep(random.randint(1, 3))
 
-    def _upgrade_building(self, building, buildings, speedup):
-        if not self._is_building_upgradeable(building, buildings):
+    def _upgrade_building(self, building, snapshot: KingdomSnapshot, speedup):
+        if not self._is_building_upgradeable(building, snapshot):
             return 'continue'
 
         try:
@@ -328,8 +402,7 @@ class LokFarmer:
             logger.info(f'building upgrade failed: {building}')
             return 'continue'
 
-        building['state'] = BUILDING_STATE_UPGRADING
-        self._update_kingdom_enter_building(building)
+        self._update_building({**building, 'state': BUILDING_STATE_UPGRADING})
 
         if speedup:
             self.do_speedup(res.get('newTask').get('expectedEnded'), res.get('newTask').get('_id'), 'building')
@@ -393,106 +466,27 @@ class LokFarmer:
 
             alliance_point -= cost * amount
 
-    @functools.lru_cache()
-    def _get_land_with_level(self):
-        rank = self.api.field_worldmap_devrank().get('lands')
-
-        land_with_level = [[], [], [], [], [], [], [], [], [], []]
-        for index, level in enumerate(rank):
-            # land id start from 100000
-            land_with_level[int(level)].append(100000 + index)
+    def _get_land_index(self):
+        return lokbot.spatial.devrank_store.get(self.world_id, self.api.field_worldmap_devrank)
 
-        return land_with_level
+    def _get_top_leveled_land(self, limit=1024):
+        return self._get_land_index().get_top_lands(limit)
 
     @staticmethod
-    @functools.lru_cache()
-    def _get_land_array():
-        return numpy.arange(100000, 165536).reshape(256, 256)
-
-    @functools.lru_cache()
-    def _get_land_array_4_by_4(self):
-        return blockshaped(self._get_land_array(), 4, 4)
+    def _get_zone_id_by_land_id(land_id):
+        return lokbot.spatial.get_zone_id_by_land_id(land_id)
 
     @staticmethod
-    @functools.lru_cache()
-    def _get_zone_array():
-        return numpy.arange(0, 4096).reshape(64, 64)
-
-    @functools.lru_cache()
-    def _get_nearest_land(self, x, y, radius=32):
-        land_array = self._get_land_array()
-        # current_land_id = land_array[y // 8, x // 8]
-        nearby_land_ids = neighbors(land_array, radius, y // 8 + 1, x // 8 + 1)
-        nearby_land_ids = [item for sublist in nearby_land_ids for item in sublist if item != 0]
-        land_with_level = self._get_land_with_level()
-
-        lands = []
-        for index, each_level in enumerate(reversed(land_with_level)):
-            level = 10 - index
-
-            # if level < 3:
-            #     continue
-
-            lands += [(each_land_id, level) for each_land_id in each_level if each_land_id in nearby_land_ids]
-
-        return lands
-
-    def _get_top_leveled_land(self, limit=1024):
-        land_with_level = self._get_land_with_level()
-
-        lands = []
-        for index, each_level in enumerate(reversed(land_with_level)):
-            level = 10 - index
-
-            if level < 2:
-                continue
-
-            if len(each_level) > limit:
-                return lands + each_level[:limit]
-
-            lands += [(each, level) for each in each_level]
-            limit -= len(each_level)
-
-        return lands
-
-    @functools.lru_cache()
-    def _get_zone_id_by_land_id(self, land_id):
-        land_array = self._get_land_array_4_by_4()
-
-        return ndindex(land_array, land_id)[0]
-
-    @functools.lru_cache()
-    def _get_nearest_zone(self, x, y, radius=16):
-        lands = self._get_nearest_land(x, y, radius)
-        zones = []
-        for land_id, _ in lands:
-            zone_id = self._get_zone_id_by_land_id(land_id)
-            if zone_id not in zones:
-                zones.append(zone_id)
-
-        return zones
-
-    def _get_nearest_zone_ng(self, x, y, radius=8):
-        current_zone_id = lokbot.util.get_zone_id_by_coords(x, y)
-
-        idx = ndindex(self._get_zone_array(), current_zone_id)
-
-        nearby_zone_ids = neighbors(self._get_zone_array(), radius, idx[0] + 1, idx[1] + 1)
-        nearby_zone_ids = [item.item() for sublist in nearby_zone_ids for item in sublist if item != 0]
-
-        return nearby_zone_ids
+    def _get_nearest_zone_ng(x, y, radius=8):
+        return lokbot.spatial.get_nearby_zone_ids(x, y, radius)
 
     def _update_march_limit(self):
         troops = self.api.kingdom_profile_troops().get('troops')
-        self.troop_queue = troops.get('field')
-        self.march_limit = troops.get('info').get('marchLimit')
+        self.march_table.reset(troops.get('field'), troops.get('info').get('marchLimit'))
         self.march_size = troops.get('info').get('marchSize')
 
     def _is_march_limit_exceeded(self):
-        if len(self.troop_queue) >= self.march_limit:
-            return True
-
-        return False
+        return self.march_table.is_full()
 
     @staticmethod
     def _calc_distance(from_loc, to_loc):
@@ -511,15 +505,20 @@ class LokFarmer:
 
         res = self.api.field_march_start(data)
 
-        new_task = res.get('newTask')
-        new_task['endTime'] = new_task['expectedEnded']
-        self.troop_queue.append(new_task)
+        self.march_table.add(res.get('newTask'))
 
-    def _prepare_march_troops(self, each_obj, march_type=MARCH_TYPE_GATHER):
+    def _get_march_info(self, each_obj):
         march_info = self.api.field_march_info({
             'fromId': self.kingdom_enter.get('kingdom').get('fieldObjectId'),
             'toLoc': each_obj.get('loc')
         })
+        self.available_troops = march_info.get('troops')
+
+        return march_info
+
+    def _prepare_march_troops(self, each_obj, march_type=MARCH_TYPE_GATHER, march_info=None):
+        if march_info is None:
+            march_info = self._get_march_info(each_obj)
 
         expired_ts = arrow.get(march_info.get('fo').get('expired')).timestamp()
         if expired_ts < arrow.now().timestamp():
@@ -531,61 +530,29 @@ class LokFarmer:
             if march_info.get('fo').get('code') != each_obj.get('code'):
                 return []
 
-        troops = march_info.get('troops')
-        troops.sort(key=lambda x: x.get('code'), reverse=True)  # priority using high tier troops
-
-        need_troop_count = march_info.get('fo').get('param').get('value')
-        if march_type == MARCH_TYPE_MONSTER:
-            need_troop_count *= 2.5
-
-        if not need_troop_count:
+        value = march_info.get('fo').get('param').get('value')
+        if not value:
             # "value": 0, means no more resources or monster
             return []
 
-        troop_count = sum([each_troop.get('amount') for each_troop in troops])
-        # we don't care about insufficient troops when gathering
-        if (march_type == MARCH_TYPE_MONSTER) and (need_troop_count > troop_count):
-            logger.info(f'Insufficient troops: {troop_count} < {need_troop_count}: {each_obj}')
+        troops = march_info.get('troops')
+        amounts = lokbot.composition.TroopSolver(troops, march_type, self.march_size).solve(value)
+        if not amounts or not any(amounts.values()):
+            logger.info(f'Insufficient troops within march size {self.march_size}: {troops}: {each_obj}')
             return []
 
-        march_troops = []
-        for troop in troops:
-            code = troop.get('code')
-            amount = troop.get('amount')
-
-            # todo: calc troops load for MARCH_TYPE_MONSTER
-            load = 1
-            if march_type == MARCH_TYPE_GATHER:
-                load = TROOP_LOAD_MAP.get(code, 1)
-
-            total_load = amount * load
-
-            if total_load >= need_troop_count:
-                if need_troop_count == 0:
-                    amount = 0
-                else:
-                    amount = math.ceil(need_troop_count / load)
-                    need_troop_count = 0
-            else:
-                need_troop_count -= total_load
-
-            march_troops.append({
-                'code': code,
-                'level': 0,
-                'select': 0,
-                'amount': int(amount),
-                'dead': 0,
-                'wounded': 0,
-                'hp': 0,
-                'attack': 0,
-                'defense': 0,
-                'seq': 0
-            })
-
-        march_troop_count = sum([each_troop.get('amount') for each_troop in march_troops])
-        if march_troop_count > self.march_size:
-            logger.info(f'Troop count exceeded: {march_troop_count} > {self.march_size}: {each_obj}')
-            return []
+        march_troops = [{
+            'code': troop.get('code'),
+            'level': 0,
+            'select': 0,
+            'amount': amounts.get(troop.get('code')),
+            'dead': 0,
+            'wounded': 0,
+            'hp': 0,
+            'attack': 0,
+            'defense': 0,
+            'seq': 0
+        } for troop in troops]
 
         distance = march_info.get('distance')
         logger.info(f'distance: {distance}, object: {each_obj}')
@@ -594,43 +561,105 @@ class LokFarmer:
 
         return march_troops
 
-    def _get_available_dragos(self):
-        drago_lair_list = self.api.drago_lair_list()
-        dragos = drago_lair_list.get('dragos')
-        available_dragos = [each for each in dragos if each['lair']['status'] == DRAGO_LAIR_STATUS_STANDBY]
-
-        return available_dragos
-
-    def _on_field_objects_gather(self, each_obj):
+    def _is_gatherable(self, each_obj):
         if each_obj.get('occupied'):
             return False
 
         if each_obj.get('code') == OBJECT_CODE_CRYSTAL_MINE and self.level < 11:
             return False
 
-        to_loc = each_obj.get('loc')
+        return True
+
+    def _start_field_march(self, each_obj, march_type, march_troops):
+        if march_type == MARCH_TYPE_GATHER and each_obj.get('code') == OBJECT_CODE_DRAGON_SOUL_CAVERN:
+            self._start_march(each_obj.get('loc'), march_troops, march_type, self.available_dragos[0]['_id'])
+            return
+
+        self._start_march(each_obj.get('loc'), march_troops, march_type)
+
+    def _on_field_objects_gather(self, each_obj):
+        if not self._is_gatherable(each_obj):
+            return False
+
         march_troops = self._prepare_march_troops(each_obj, MARCH_TYPE_GATHER)
 
         if not march_troops:
             return False
 
-        if each_obj.get('code') == OBJECT_CODE_DRAGON_SOUL_CAVERN:
-            self._start_march(to_loc, march_troops, MARCH_TYPE_GATHER, self.available_dragos[0]['_id'])
-            return True
-
-        self._start_march(to_loc, march_troops, MARCH_TYPE_GATHER)
+        self._start_field_march(each_obj, MARCH_TYPE_GATHER, march_troops)
         return True
 
     def _on_field_objects_monster(self, each_obj):
-        to_loc = each_obj.get('loc')
         march_troops = self._prepare_march_troops(each_obj, MARCH_TYPE_MONSTER)
 
         if not march_troops:
             return False
 
-        self._start_march(to_loc, march_troops, MARCH_TYPE_MONSTER)
+        self._start_field_march(each_obj, MARCH_TYPE_MONSTER, march_troops)
         return True
 
+    def _dispatch_marches(self, candidates, from_loc):
+        """
+        fill the free march slots with the candidates of a sweep yielding the most per troop-minute,
+        march info is only requested for a shortlist ranked by a local estimate
+        :param candidates: [lokbot.march.MarchCandidate, ...]
+        :param from_loc:
+        :return:
+        """
+        if not candidates:
+            return
+
+        # other jobs compete for the same march slots, the requests below are made outside of any lock
+        free_slots = self.march_table.reserve(self.march_table.march_limit)
+        if not free_slots:
+            return
+
+        try:
+            planned = []
+            ranked = lokbot.march.rank(candidates, from_loc, self.available_troops, self.march_size)
+            for candidate in ranked[:free_slots * lokbot.march.SHORTLIST_FACTOR]:
+                each_obj = candidate.field_object.raw
+                candidate.march_info = self._get_march_info(each_obj)
+                candidate.march_troops = self._prepare_march_troops(
+                    each_obj, candidate.march_type, candidate.march_info
+                )
+                if not candidate.march_troops:
+                    continue
+
+                candidate.score = lokbot.march.get_yield_per_troop_minute(
+                    candidate.value, sum(troop.get('amount') for troop in candidate.march_troops),
+                    candidate.march_info.get('distance') or 0, candidate.march_type
+                )
+                planned.append(candidate)
+
+            planned.sort(key=lambda x: x.score, reverse=True)
+
+            used = collections.Counter()
+            for candidate in planned[:free_slots]:
+                each_obj = candidate.field_object.raw
+                march_troops = candidate.march_troops
+                if used:
+                    # troops sent by the previous marches are still listed in the march info
+                    march_info = {
+                        **candidate.march_info,
+                        'troops': lokbot.march.subtract_troops(candidate.march_info.get('troops'), used)
+                    }
+                    march_troops = self._prepare_march_troops(each_obj, candidate.march_type, march_info)
+                    if not march_troops:
+                        continue
+
+                self._start_field_march(each_obj, candidate.march_type, march_troops)
+                # the started march is in the table now, its reservation is given back
+                free_slots -= 1
+                self.march_table.release()
+                logger.info(f'march_started {each_obj.get("code")}({each_obj.get("level")}): {each_obj}')
+                self.field_objects.mark(candidate.field_object)
+
+                for troop in march_troops:
+                    used[troop.get('code')] += troop.get('amount')
+        finally:
+            self.march_table.release(free_slots)
+
     @tenacity.retry(
         stop=tenacity.stop_after_attempt(4),
         wait=tenacity.wait_random_exponential(multiplier=1, max=60),
@@ -644,17 +673,21 @@ class LokFarmer:
         """
         url = self.kingdom_enter.get('networks').get('kingdoms')[0]
 
-        sio = socketio.Client(reconnection=False, logger=sock_logger, engineio_logger=sock_logger)
+        sio = socketio.Client(
+            reconnection=False, logger=sock_logger, engineio_logger=sock_logger, json=lokbot.serializer.SocketioJson
+        )
 
         @sio.on('/building/update')
         def on_building_update(data):
             logger.debug(data)
-            self._update_kingdom_enter_building(data)
+            self._update_building(data)
+            self.events.publish(EVENT_BUILDING_UPDATE, data)
 
         @sio.on('/resource/upgrade')
         def on_resource_update(data):
             logger.debug(data)
-            self.resources[data.get('resourceIdx')] = data.get('value')
+            self.state.update_resource(data.get('resourceIdx'), data.get('value'))
+            self.events.publish(EVENT_RESOURCE_UPDATE, data)
 
         @sio.on('/buff/list')
         def on_buff_list(data):
@@ -705,32 +738,49 @@ class LokFarmer:
         @sio.on('/task/update')
         def on_task_update(data):
             logger.debug(data)
+            self.api.invalidate_cache('kingdom/task/all', 'kingdom/profile/troops')
+            self.march_table.on_task_update(data)
+
+            if data.get('status') == STATUS_FINISHED and \
+                    data.get('code') in (TASK_CODE_SILVER_HAMMER, TASK_CODE_GOLD_HAMMER):
+                # a building task leaves `kingdom/task/all` once finished, the others once claimed
+                self.state.remove_task(data.get('_id'))
+            else:
+                self.state.update_task(data)
+
             if data.get('status') == STATUS_FINISHED:
-                if data.get('code') in (TASK_CODE_SILVER_HAMMER, TASK_CODE_GOLD_HAMMER):
-                    self.building_queue_available.set()
+                self.events.publish(EVENT_TASK_FINISHED, data)
 
             if data.get('status') == STATUS_CLAIMED:
-                if data.get('code') == TASK_CODE_ACADEMY:
-                    self.research_queue_available.set()
-                if data.get('code') == TASK_CODE_CAMP:
-                    self.train_queue_available.set()
+                self.events.publish(EVENT_TASK_CLAIMED, data)
 
-        sio.connect(f'{url}?token={self.token}', transports=["websocket"], headers=ws_headers)
+        if not self._connect_socket('sock', sio, f'{url}?token={self.token}', transports=["websocket"],
+                                    headers=ws_headers):
+            return
+
+        # task updates were not received while disconnected
+        self.state.invalidate_tasks()
         sio.emit('/kingdom/enter', {'token': self.token})
 
         sio.wait()
+        if self.stopped:
+            return
+
         logger.warning('sock_thread disconnected, reconnecting')
         raise tenacity.TryAgain()
 
-    @tenacity.retry(
-        stop=tenacity.stop_after_attempt(4),
-        wait=tenacity.wait_random_exponential(multiplier=1, max=60),
-        retry=tenacity.retry_if_not_exception_type(FatalApiException),
-        reraise=True
-    )
-    def socf_thread(self, radius, targets, share_to=None):
+    def socf_thread(self, radius, targets, share_to=None, worlds=None):
         """
         websocket connection of the field
+        :param radius:
+        :param targets: see `lokbot.targets.TargetRule`
+        :param share_to:
+        :param worlds: worlds scanned after the world the field server puts us in
+                       (e.g. the home world while a cvc event moves us to the cvc world map),
+                       [{"world_id": 1, "loc": [x, y]}, ...], `loc` is the kingdom's one in that world and
+                       may be omitted for the home world, a bare world id stands for {"world_id": id}.
+                       every world is scanned concurrently by a field session of its own(socket, zone planner
+                       and enter-leave budget), the march slots of the account are shared through `march_table`
         :return:
         """
         while self.api.last_requested_at + 16 > time.time():
@@ -739,61 +789,145 @@ class LokFarmer:
             logger.info(f'last requested at {arrow.get(self.api.last_requested_at).humanize()}, waiting...')
             time.sleep(4)
 
-        self._update_march_limit()
-
-        while self._is_march_limit_exceeded():
-            nearest_end_time = sorted(
-                self.troop_queue,
-                key=lambda x: x.get('endTime') if x.get('endTime') else '9999-99-99T99:99:99.999Z'
-            )[0].get('endTime')
-            seconds = self.calc_time_diff_in_seconds(nearest_end_time)
-            logger.info(f'_is_march_limit_exceeded: wait {seconds} seconds')
-            time.sleep(seconds)
+        if not self.march_table.initialized:
             self._update_march_limit()
 
-        self.socf_entered = False
-        self.socf_world_id = self.kingdom_enter.get('kingdom').get('worldId')
+        while not self.march_table.wait_for_slot(self._update_march_limit, MARCH_SLOT_WAIT_TIMEOUT):
+            if self.stopped:
+                return
+
+        extra_worlds = self._get_socf_worlds(worlds)
+        if not extra_worlds:
+            self._socf_session(radius, targets, share_to)
+            return
+
+        # the world the field server puts us in is known once entered, a listed world equal to it is not scanned twice
+        field_world = {'world_id': None, 'entered': threading.Event()}
+        with concurrent.futures.ThreadPoolExecutor(len(extra_worlds) + 1, thread_name_prefix='socf') as executor:
+            futures = [executor.submit(self._socf_session, radius, targets, share_to, field_world=field_world)]
+            futures += [
+                executor.submit(self._socf_session, radius, targets, share_to, world_id, loc, field_world=field_world)
+                for world_id, loc in extra_worlds
+            ]
+
+        for future in futures:
+            future.result()
+
+    def _get_socf_worlds(self, worlds):
+        """
+        :param worlds: see `socf_thread`
+        :return: [(world_id, [world_id, x, y]), ...] without duplicates
+        """
+        kingdom_loc = self.kingdom_enter.get('kingdom').get('loc')
+        socf_worlds = {}
+
+        for world in worlds or []:
+            if not isinstance(world, dict):
+                world = {'world_id': world}
+
+            world_id = world.get('world_id')
+            if world_id is None or world_id in socf_worlds:
+                continue
+
+            loc = world.get('loc')
+            if loc is None and world_id == self.world_id:
+                loc = kingdom_loc[1:]
+
+            if loc is None:
+                logger.warning(f'loc of the kingdom in world {world_id} is unknown, skip')
+                continue
+
+            socf_worlds[world_id] = [world_id, loc[-2], loc[-1]]
+
+        return list(socf_worlds.items())
+
+    def _get_zone_planner(self, loc, radius):
+        world_id = loc[0]
+
+        if world_id not in self.zone_planners:
+            logger.info(f'planning zone sweep of world {world_id}')
+            # the devrank is only known for the home world, lands of other worlds are treated alike
+            land_index = self._get_land_index() if world_id == self.world_id else None
+            self.zone_planners[world_id] = ZoneSweepPlanner(land_index, loc, radius)
+
+        return self.zone_planners[world_id]
+
+    @tenacity.retry(
+        stop=tenacity.stop_after_attempt(4),
+        wait=tenacity.wait_random_exponential(multiplier=1, max=60),
+        retry=tenacity.retry_if_not_exception_type(FatalApiException),
+        reraise=True
+    )
+    def _socf_session(self, radius, targets, share_to=None, world_id=None, loc=None, field_world=None):
+        """
+        one field connection sweeping the zones of a world
+        :param world_id: None for the world the field server puts us in
+        :param loc: of the kingdom in `world_id`, the sweep is centered on it
+        :param field_world: {'world_id', 'entered'} shared by the sessions of a `socf_thread` run,
+                            set by the session of the world the field server puts us in
+        :return: world id of the session
+        """
+        if world_id is not None and field_world is not None:
+            field_world['entered'].wait(SOCF_WAIT_TIMEOUT)
+            if field_world['world_id'] == world_id:
+                logger.info(f'world {world_id} is scanned by the session of the field server already')
+                return world_id
+
         url = self.kingdom_enter.get('networks').get('fields')[0]
-        from_loc = self.kingdom_enter.get('kingdom').get('loc')
+        entered = threading.Event()
+        processed = threading.Event()
+        session = {'world_id': world_id, 'loc': loc, 'planner': None, 'target_rules': None}
 
-        if not self.zones:
-            logger.info('getting nearest zone')
-            self.zones = self._get_nearest_zone_ng(from_loc[1], from_loc[2], radius)
+        sio = socketio.Client(
+            reconnection=False, logger=socf_logger, engineio_logger=socf_logger, json=lokbot.serializer.SocketioJson
+        )
 
-        sio = socketio.Client(reconnection=False, logger=socf_logger, engineio_logger=socf_logger)
+        chat_channels = share_to.get('chat_channels') if share_to else None
+
+        # every event is handled on a thread of its own, a session ends once its marches are dispatched
+        handling = {'count': 0, 'idle': threading.Condition()}
+
+        def tracked(handler):
+            def wrapper(data):
+                with handling['idle']:
+                    handling['count'] += 1
+
+                try:
+                    return handler(data)
+                finally:
+                    with handling['idle']:
+                        handling['count'] -= 1
+                        handling['idle'].notify_all()
+
+            return wrapper
 
         @sio.on('/field/objects/v4')
+        @tracked
         def on_field_objects(data):
-            packs = data.get('packs')
-            gzip_decompress = gzip.decompress(bytearray(packs))
-            data_decoded = self.api.b64xor_dec(gzip_decompress)
-            objects = data_decoded.get('objects')
-            target_code_set = set([target['code'] for target in targets])
-
-            logger.debug(f'Processing {len(objects)} objects')
-            for each_obj in objects:
-                if self._is_march_limit_exceeded():
-                    continue
+            target_rules = session['target_rules']
+            objects = self.api.decode_field_objects(data.get('packs'))
+            pending_objects = self.field_objects.update(objects.select(target_rules.codes))
 
-                code = each_obj.get('code')
-                level = each_obj.get('level')
-                loc = each_obj.get('loc')
+            logger.debug(f'Processing {len(pending_objects)} of {len(objects)} objects')
+            candidates = []
+            for field_object in pending_objects:
+                session['planner'].record_found(field_object.loc)
 
-                level_whitelist = [target['level'] for target in targets if target['code'] == code]
-                if not level_whitelist:
-                    # not the one we are looking for
+                if self._is_march_limit_exceeded():
                     continue
 
-                if share_to and share_to.get('chat_channels'):
-                    for chat_channel in share_to.get('chat_channels'):
-                        text = f'Lv.{level}?fo_{code}'
-                        obj_hash = f'{text}_{loc[0]}_{loc[1]}_{loc[2]}'
-                        if obj_hash in self.shared_objects:
+                each_obj = field_object.raw
+                code = field_object.code
+                level = field_object.level
+                loc = field_object.loc
+
+                if chat_channels:
+                    for chat_channel in chat_channels:
+                        if not self.field_objects.mark(field_object, f'shared_{chat_channel}'):
                             # already shared
                             continue
 
-                        self.shared_objects.add(obj_hash)
-                        self.api.chat_new(chat_channel, CHAT_TYPE_LOC, text, {'loc': loc})
+                        self.api.chat_new(chat_channel, CHAT_TYPE_LOC, f'Lv.{level}?fo_{code}', {'loc': loc})
 
                 if code == OBJECT_CODE_DRAGON_SOUL_CAVERN:
                     if self.drago_action_point < 1:
@@ -803,94 +937,115 @@ class LokFarmer:
                         logger.info(f'not_available_drago, ignore: {each_obj}')
                         continue
 
-                level_whitelist = level_whitelist[0]
-                if level_whitelist and level not in level_whitelist:
+                rule = target_rules.get(code)
+                if not rule.match_level(level):
                     logger.info(f'level not in whitelist, ignore: {each_obj}')
+                    self.field_objects.mark(field_object)
                     continue
 
-                res = False
-                try:
-                    if code in set(OBJECT_MINE_CODE_LIST).intersection(target_code_set):
-                        res = self._on_field_objects_gather(each_obj)
+                failed_predicate = rule.match(field_object)
+                if failed_predicate:
+                    logger.info(f'{failed_predicate} not matched, ignore: {each_obj}')
+                    self.field_objects.mark(field_object)
+                    continue
 
-                    if code in set(OBJECT_MONSTER_CODE_LIST).intersection(target_code_set):
-                        res = self._on_field_objects_monster(each_obj)
-                except OtherException as error_code:
-                    if str(error_code) in (
-                            'full_task', 'not_enough_troop', 'insufficient_actionpoint', 'not_open_gate',
-                            'no_drago_action_point', 'no_drago', 'exceed_crystal_daily_quota',
-                            'not_available_drago'
-                    ):
-                        logger.warning(f'on_field_objects: {error_code}, skip')
-                        self.field_object_processed = True
-                        return
+                if rule.march_type not in (MARCH_TYPE_GATHER, MARCH_TYPE_MONSTER):
+                    self.field_objects.mark(field_object)
+                    continue
+
+                if rule.march_type == MARCH_TYPE_GATHER and not self._is_gatherable(each_obj):
+                    continue
+
+                candidates.append(lokbot.march.MarchCandidate(field_object, rule.march_type))
+
+            try:
+                self._dispatch_marches(candidates, session['loc'])
+            except OtherException as error_code:
+                if str(error_code) not in (
+                        'full_task', 'not_enough_troop', 'insufficient_actionpoint', 'not_open_gate',
+                        'no_drago_action_point', 'no_drago', 'exceed_crystal_daily_quota',
+                        'not_available_drago'
+                ):
                     raise
-                else:
-                    if res is True:
-                        logger.info(f'march_started {code}({level}): {each_obj}')
 
-            self.field_object_processed = True
+                logger.warning(f'on_field_objects: {error_code}, skip')
+
+            processed.set()
 
         @sio.on('/field/enter/v3')
         def on_field_enter(data):
             data_decoded = self.api.b64xor_dec(data)
             logger.debug(data_decoded)
-            self.socf_world_id = data_decoded.get('loc')[0]  # in case of cvc event world map
+            if session['world_id'] is None:
+                # in case of cvc event world map
+                loc = session['loc'] = data_decoded.get('loc')
+                session['world_id'] = loc[0]
+                if field_world is not None:
+                    field_world['world_id'] = loc[0]
+                    field_world['entered'].set()
+            else:
+                loc = session['loc']
+
+            session['planner'] = self._get_zone_planner(loc, radius)
+            session['target_rules'] = TargetRules(targets, loc)
 
             # knock
-            sio.emit('/zone/leave/list/v2', {'world': self.socf_world_id, 'zones': '[]'})
+            sio.emit('/zone/leave/list/v2', {'world': session['world_id'], 'zones': '[]'})
             default_zones = '[0,64,1,65]'
-            sio.emit('/zone/enter/list/v4', self.api.b64xor_enc({'world': self.socf_world_id, 'zones': default_zones}))
-            sio.emit('/zone/leave/list/v2', {'world': self.socf_world_id, 'zones': default_zones})
-
-            self.socf_entered = True
+            sio.emit('/zone/enter/list/v4', self.api.b64xor_enc({'world': session['world_id'], 'zones': default_zones}))
+            sio.emit('/zone/leave/list/v2', {'world': session['world_id'], 'zones': default_zones})
 
-        sio.connect(f'{url}?token={self.token}', transports=["websocket"], headers=ws_headers)
-        logger.debug(f'entering field: {self.zones}')
-        sio.emit('/field/enter/v3', self.api.b64xor_enc({'token': self.token}))
-
-        while not self.socf_entered:
-            time.sleep(1)
+            entered.set()
 
-        step = 9
-        grace = 7  # 9 times enter-leave action will cause ban
-        index = 0
-        while self.zones:
-            if index >= grace:
-                logger.info('socf_thread grace exceeded, break')
-                break
+        if not self._connect_socket(f'socf_{world_id}', sio, f'{url}?token={self.token}', transports=["websocket"],
+                                    headers=ws_headers):
+            return
 
-            index += 1
-            zone_ids = []
-            for _ in range(step):
-                if not self.zones:
-                    break
+        logger.debug('entering field')
+        sio.emit('/field/enter/v3', self.api.b64xor_enc({'token': self.token}))
 
-                zone_ids.append(self.zones.pop(0))
+        if not entered.wait(SOCF_WAIT_TIMEOUT):
+            if self.stopped:
+                return
 
-            if len(zone_ids) < step:
-                logger.info(f'len(zone_ids) < {step}, break')
-                self.zones = []
-                break
+            logger.warning('socf_thread entering field timed out, reconnecting')
+            sio.disconnect()
+            raise tenacity.TryAgain()
 
+        for zone_ids in session['planner'].plan(rounds=SOCF_GRACE):
             if not sio.connected:
+                if self.stopped:
+                    return
+
                 logger.warning('socf_thread disconnected, reconnecting')
                 raise tenacity.TryAgain()
 
-            message = {'world': self.socf_world_id, 'zones': json.dumps(zone_ids, separators=(',', ':'))}
+            message = {'world': session['world_id'], 'zones': lokbot.serializer.dumps(zone_ids)}
             encoded_message = self.api.b64xor_enc(message)
 
+            session['planner'].mark_visited(zone_ids)
+            processed.clear()
             sio.emit('/zone/enter/list/v4', encoded_message)
-            self.field_object_processed = False
-            logger.debug(f'entering zone: {zone_ids} and waiting for processing')
-            while not self.field_object_processed:
-                time.sleep(1)
+            logger.debug(f'entering zone: {zone_ids} of world {session["world_id"]} and waiting for processing')
+            if not processed.wait(SOCF_WAIT_TIMEOUT):
+                if self.stopped:
+                    return
+
+                logger.warning('socf_thread processing zones timed out, reconnecting')
+                sio.disconnect()
+                raise tenacity.TryAgain()
+
             sio.emit('/zone/leave/list/v2', message)
 
-        logger.info('a loop is finished')
+        logger.info(f'a loop of world {session["world_id"]} is finished')
+        with handling['idle']:
+            handling['idle'].wait_for(lambda: not handling['count'], SOCF_WAIT_TIMEOUT)
+
         sio.disconnect()
         sio.wait()
 
+        return session['world_id']
+
     @tenacity.retry(
         stop=tenacity.stop_after_attempt(4),
         wait=tenacity.wait_random_exponential(multiplier=1, max=60),
@@ -904,13 +1059,20 @@ class LokFarmer:
         """
         url = self.kingdom_enter.get('networks').get('chats')[0]
 
-        sio = socketio.Client(reconnection=False, logger=socc_logger, engineio_logger=socc_logger)
+        sio = socketio.Client(
+            reconnection=False, logger=socc_logger, engineio_logger=socc_logger, json=lokbot.serializer.SocketioJson
+        )
 
         # no token needed in query string, yet
-        sio.connect(url, transports=["websocket"], headers=ws_headers)
+        if not self._connect_socket('socc', sio, url, transports=["websocket"], headers=ws_headers):
+            return
+
         sio.emit('/chat/enter', {'token': self.token})
 
         sio.wait()
+        if self.stopped:
+            return
+
         logger.warning('socc_thread disconnected, reconnecting')
         raise tenacity.TryAgain()
 
@@ -919,7 +1081,7 @@ class LokFarmer:
         收获资源
         :return:
         """
-        buildings = self.kingdom_enter.get('kingdom', {}).get('buildings', [])
+        buildings = list(self.state.snapshot().get_buildings())
 
         random.shuffle(buildings)
 
@@ -953,7 +1115,7 @@ class LokFarmer:
         if len([self.api.quest_claim(q) for q in quest_list.get('sideQuests') if
                 q.get('status') == STATUS_FINISHED]) >= 5:
             # 若五个均为已完成, 则翻页
-            threading.Thread(target=self.quest_monitor_thread).start()
+            self._call_later(0, self.quest_monitor_thread)
             return
 
         quest_list_daily = self.api.quest_list_daily().get('dailyQuest')
@@ -962,7 +1124,7 @@ class LokFarmer:
         if len([self.api.quest_claim_daily(q) for q in quest_list_daily.get('quests') if
                 q.get('status') == STATUS_FINISHED]) >= 5:
             # 若五个均为已完成, 则翻页
-            threading.Thread(target=self.quest_monitor_thread).start()
+            self._call_later(0, self.quest_monitor_thread)
             return
 
         # daily quest reward
@@ -987,13 +1149,14 @@ class LokFarmer:
             ) for each in event_info.get('event').get('events') if each.get('code') in finished_code]
 
         logger.info('quest_monitor: done, sleep for 1h')
-        threading.Timer(3600, self.quest_monitor_thread).start()
+        self._call_later(3600, self.quest_monitor_thread)
         return
 
     def _building_farmer_worker(self, speedup=False):
-        buildings = self.kingdom_enter.get('kingdom', {}).get('buildings', [])
-        buildings.sort(key=lambda x: x.get('level'))
-        kingdom_level = [b for b in buildings if b.get('code') == BUILDING_CODE_MAP['castle']][0].get('level')
+        snapshot = self.state.snapshot()
+        buildings = sorted(snapshot.get_buildings(), key=lambda x: x.get('level'))
+        kingdom_level = snapshot.get_buildings(BUILDING_CODE_MAP['castle'])[0].get('level')
+        built_positions = {building.get('position') for building in buildings}
 
         # First check if there is any empty position available for building
         for level_requirement, positions in BUILD_POSITION_UNLOCK_MAP.items():
@@ -1001,7 +1164,7 @@ class LokFarmer:
                 continue
 
             for position in positions:
-                if position.get('position') in [building.get('position') for building in buildings]:
+                if position.get('position') in built_positions:
                     continue
 
                 building = {
@@ -1011,7 +1174,7 @@ class LokFarmer:
                     'state': BUILDING_STATE_NORMAL,
                 }
 
-                res = self._upgrade_building(building, buildings, speedup)
+                res = self._upgrade_building(building, snapshot, speedup)
 
                 if res == 'continue':
                     continue
@@ -1022,7 +1185,7 @@ class LokFarmer:
 
         # Then check if there is any upgradeable building
         for building in buildings:
-            res = self._upgrade_building(building, buildings, speedup)
+            res = self._upgrade_building(building, snapshot, speedup)
 
             if res == 'continue':
                 continue
@@ -1039,20 +1202,21 @@ class LokFarmer:
         :param speedup:
         :return:
         """
-        self.kingdom_tasks = self.api.kingdom_task_all().get('kingdomTasks', [])
-
-        silver_in_use = [t for t in self.kingdom_tasks if t.get('code') == TASK_CODE_SILVER_HAMMER]
-        gold_in_use = [t for t in self.kingdom_tasks if t.get('code') == TASK_CODE_GOLD_HAMMER]
+        started_at = time.time()
+        silver_in_use = self._get_tasks(TASK_CODE_SILVER_HAMMER)
+        gold_in_use = self._get_tasks(TASK_CODE_GOLD_HAMMER)
 
         if not silver_in_use or (self.has_additional_building_queue and not gold_in_use):
             if not self._building_farmer_worker(speedup):
                 logger.info(f'no building to upgrade, sleep for 2h')
-                threading.Timer(7200, self.building_farmer_thread).start()
+                self._call_later(7200, self.building_farmer_thread, speedup)
                 return
 
-        self.building_queue_available.wait()  # wait for building queue available from `sock_thread`
-        self.building_queue_available.clear()
-        threading.Thread(target=self.building_farmer_thread, args=[speedup]).start()
+        # continue once a building queue is available
+        self._continue_on(
+            EVENT_TASK_FINISHED, lambda task: task.get('code') in (TASK_CODE_SILVER_HAMMER, TASK_CODE_GOLD_HAMMER),
+            started_at, self.building_farmer_thread, speedup
+        )
 
     def academy_farmer_thread(self, to_max_level=False, speedup=False):
         """
@@ -1061,23 +1225,25 @@ class LokFarmer:
         :param speedup:
         :return:
         """
-        self.kingdom_tasks = self.api.kingdom_task_all().get('kingdomTasks', [])
-
-        worker_used = [t for t in self.kingdom_tasks if t.get('code') == TASK_CODE_ACADEMY]
+        started_at = time.time()
+        worker_used = self._get_tasks(TASK_CODE_ACADEMY)
 
         if worker_used:
             if worker_used[0].get('status') != STATUS_CLAIMED:
-                self.research_queue_available.wait()  # wait for research queue available from `sock_thread`
-                self.research_queue_available.clear()
-                threading.Thread(target=self.academy_farmer_thread, args=[to_max_level, speedup]).start()
+                # continue once the research queue is available
+                task_id = worker_used[0].get('_id')
+                self._continue_on(
+                    EVENT_TASK_CLAIMED, lambda task: task.get('_id') == task_id,
+                    started_at, self.academy_farmer_thread, to_max_level, speedup
+                )
                 return
 
             # 如果已完成, 则领取奖励并继续
             self.api.kingdom_task_claim(BUILDING_POSITION_MAP['academy'])
+            self.state.remove_task(worker_used[0].get('_id'))
 
         exist_researches = self.api.kingdom_academy_research_list().get('researches', [])
-        buildings = self.kingdom_enter.get('kingdom', {}).get('buildings', [])
-        academy_level = [b for b in buildings if b.get('code') == BUILDING_CODE_MAP['academy']][0].get('level')
+        academy_level = self.state.get_buildings(BUILDING_CODE_MAP['academy'])[0].get('level')
 
         for category_name, each_category in RESEARCH_CODE_MAP.items():
             for research_name, research_code in each_category.items():
@@ -1099,24 +1265,26 @@ class LokFarmer:
                 if speedup:
                     self.do_speedup(res.get('newTask').get('expectedEnded'), res.get('newTask').get('_id'), 'research')
 
-                self.research_queue_available.wait()  # wait for research queue available from `sock_thread`
-                self.research_queue_available.clear()
-                threading.Thread(target=self.academy_farmer_thread, args=[to_max_level, speedup]).start()
+                # continue once the research queue is available,
+                # matched by `_id` as the claim above publishes a claimed academy task as well
+                task_id = res.get('newTask', {}).get('_id')
+                self._continue_on(
+                    EVENT_TASK_CLAIMED, lambda task: task.get('_id') == task_id,
+                    started_at, self.academy_farmer_thread, to_max_level, speedup
+                )
                 return
 
         logger.info('academy_farmer: no research to do, sleep for 2h')
-        threading.Timer(2 * 3600, self.academy_farmer_thread, [to_max_level]).start()
+        self._call_later(2 * 3600, self.academy_farmer_thread, to_max_level, speedup)
         return
 
     def _troop_training_capacity(self):
         """
         return total troop training capacity of all barracks
         """
-        buildings = self.kingdom_enter.get('kingdom', {}).get('buildings', [])
         troop_training_capacity = 0
-        for building in buildings:
-            if building['code'] == BUILDING_CODE_MAP['barrack']:
-                troop_training_capacity += BARRACK_LEVEL_TROOP_TRAINING_RATE_MAP[int(building['level'])]
+        for building in self.state.get_buildings(BUILDING_CODE_MAP['barrack']):
+            troop_training_capacity += BARRACK_LEVEL_TROOP_TRAINING_RATE_MAP[int(building['level'])]
 
         return troop_training_capacity
 
@@ -1140,8 +1308,7 @@ class LokFarmer:
         """
         return a random building object with the building_code
         """
-        buildings = self.kingdom_enter.get('kingdom', {}).get('buildings', [])
-        return random.choice([building for building in buildings if building['code'] == building_code])
+        return random.choice(self.state.get_buildings(building_code))
 
     def train_troop_thread(self, troop_code, speedup=False, interval=3600):
         """
@@ -1156,23 +1323,26 @@ class LokFarmer:
             logger.info(f'last requested at {arrow.get(self.api.last_requested_at).humanize()}, waiting...')
             time.sleep(4)
 
-        self.kingdom_tasks = self.api.kingdom_task_all().get('kingdomTasks', [])
-
-        worker_used = [t for t in self.kingdom_tasks if t.get('code') == TASK_CODE_CAMP]
+        started_at = time.time()
+        worker_used = self._get_tasks(TASK_CODE_CAMP)
 
         troop_training_capacity = self._troop_training_capacity()
 
         if worker_used:
             if worker_used[0].get('status') == STATUS_CLAIMED:
                 self.api.kingdom_task_claim(self._random_choice_building(BUILDING_CODE_MAP['barrack'])['position'])
+                self.state.remove_task(worker_used[0].get('_id'))
                 logger.info(f'train_troop: one loop completed, sleep for {interval} seconds')
-                threading.Timer(interval, self.train_troop_thread, [troop_code, speedup, interval]).start()
+                self._call_later(interval, self.train_troop_thread, troop_code, speedup, interval)
                 return
 
             if worker_used[0].get('status') == STATUS_PENDING:
-                self.train_queue_available.wait()  # wait for train queue available from `sock_thread`
-                self.train_queue_available.clear()
-                threading.Thread(target=self.train_troop_thread, args=[troop_code, speedup, interval]).start()
+                # continue once the train queue is available
+                task_id = worker_used[0].get('_id')
+                self._continue_on(
+                    EVENT_TASK_CLAIMED, lambda task: task.get('_id') == task_id,
+                    started_at, self.train_troop_thread, troop_code, speedup, interval
+                )
                 return
 
         # if there are not enough resources, train how much possible
@@ -1182,22 +1352,25 @@ class LokFarmer:
 
         if not troop_training_capacity:
             logger.info('train_troop: no resource, sleep for 1h')
-            threading.Timer(3600, self.train_troop_thread, [troop_code, speedup, interval]).start()
+            self._call_later(3600, self.train_troop_thread, troop_code, speedup, interval)
             return
 
         try:
             res = self.api.train_troop(troop_code, troop_training_capacity)
         except OtherException as error_code:
             logger.info(f'train_troop: {error_code}, sleep for 1h')
-            threading.Timer(3600, self.train_troop_thread, [troop_code, speedup, interval]).start()
+            self._call_later(3600, self.train_troop_thread, troop_code, speedup, interval)
             return
 
         if speedup:
             self.do_speedup(res.get('newTask').get('expectedEnded'), res.get('newTask').get('_id'), 'train')
 
-        self.train_queue_available.wait()  # wait for train queue available from `sock_thread`
-        self.train_queue_available.clear()
-        threading.Thread(target=self.train_troop_thread, args=[troop_code, speedup, interval]).start()
+        # continue once the train queue is available, matched by `_id` as a claim publishes a claimed camp task as well
+        task_id = res.get('newTask', {}).get('_id')
+        self._continue_on(
+            EVENT_TASK_CLAIMED, lambda task: task.get('_id') == task_id,
+            started_at, self.train_troop_thread, troop_code, speedup, interval
+        )
 
     def free_chest_farmer_thread(self, _type=0):
         """
@@ -1209,7 +1382,7 @@ class LokFarmer:
         except OtherException as error_code:
             if str(error_code) == 'free_chest_not_yet':
                 logger.info('free_chest_farmer: free_chest_not_yet, sleep for 2h')
-                threading.Timer(2 * 3600, self.free_chest_farmer_thread).start()
+                self._call_later(2 * 3600, self.free_chest_farmer_thread)
                 return
 
             raise
@@ -1221,10 +1394,9 @@ class LokFarmer:
         }
         next_type = min(next_dict, key=next_dict.get)
 
-        threading.Timer(
-            self.calc_time_diff_in_seconds(next_dict[next_type]),
-            self.free_chest_farmer_thread, [next_type]
-        ).start()
+        self._call_later(
+            self.calc_time_diff_in_seconds(next_dict[next_type]), self.free_chest_farmer_thread, next_type
+        )
 
     def use_resource_in_item_list(self):
         """
@@ -1238,9 +1410,11 @@ class LokFarmer:
 
         usable_item_list = filter(lambda x: x.get('code') in USABLE_ITEM_CODE_LIST, item_list)
 
+        batch = BatchExecutor(jitter=(0, 3))
         for each_item in usable_item_list:
-            self.api.item_use(each_item.get('code'), each_item.get('amount'))
-            time.sleep(random.randint(1, 3))
+            batch.add(self.api.item_use, each_item.get('code'), each_item.get('amount'))
+
+        batch.run()
 
     def vip_chest_claim(self):
         """
@@ -1298,11 +1472,13 @@ class LokFarmer:
             self.api.kingdom_caravan_buy(each_item.get('_id'))
 
     def mail_claim(self):
-        self.api.mail_claim_all(1)  # report
-        time.sleep(random.randint(4, 6))
-        self.api.mail_claim_all(2)  # alliance
-        time.sleep(random.randint(4, 6))
-        self.api.mail_claim_all(3)  # system
+        BatchExecutor(jitter=(0, 3)).add(
+            self.api.mail_claim_all, 1  # report
+        ).add(
+            self.api.mail_claim_all, 2  # alliance
+        ).add(
+            self.api.mail_claim_all, 3  # system
+        ).run()
 
     def wall_repair(self):
         wall_info = self.api.kingdom_wall_info()
@@ -1347,8 +1523,8 @@ class LokFarmer:
             self.api.kingdom_hospital_recover()
 
     def keepalive_request(self):
-        try:
-            lokbot.util.run_functions_in_random_order(
+        batch = BatchExecutor(jitter=(0, 2), shuffle=True)
+        for func in (
                 self.api.kingdom_wall_info,
                 self.api.quest_main,
                 self.api.item_list,
@@ -1359,6 +1535,9 @@ class LokFarmer:
                 self.api.drago_lair_list,
                 self.api.pkg_recommend,
                 self.api.pkg_list,
-            )
-        except OtherException:
-            pass
+        ):
+            batch.add(func)
+
+        for res in batch.run(return_exceptions=True):
+            if isinstance(res, Exception) and not isinstance(res, OtherException):
+                raise res
@@ -0,0 +1,159 @@
+import collections
+import heapq
+import threading
+import time
+
+import arrow
+
+from lokbot.codec import FieldObject
+
+# objects without `expired` are kept for this long
+DEFAULT_OBJECT_TTL = 3600
+
+FLAG_HANDLED = 'handled'
+
+
+class _Entry:
+    __slots__ = ('field_object', 'expires_at', 'flags')
+
+    def __init__(self, field_object: FieldObject, expires_at):
+        self.field_object = field_object
+        self.expires_at = expires_at
+        self.flags = set()
+
+
+class FieldObjectIndex:
+    """
+    field objects seen in zone sweeps, keyed by `_id` and `loc`, indexed by code and
+    dropped once their `expired` time has passed, so that memory stays bounded over days.
+
+    flags(e.g. `handled`, `shared_<channel>`) remember what has been done with an object,
+    `update` returns only the objects of a sweep which are not handled yet
+    """
+
+    def __init__(self, maxsize=50000):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.ids_by_loc = {}
+        self.ids_by_code = collections.defaultdict(set)
+        self.expiry = []
+
+    @staticmethod
+    def _get_expires_at(field_object: FieldObject, now):
+        expired = field_object.raw.get('expired')
+        if not expired:
+            return now + DEFAULT_OBJECT_TTL
+
+        return arrow.get(expired).timestamp()
+
+    @staticmethod
+    def _is_changed(entry: _Entry, field_object: FieldObject):
+        raw, other = entry.field_object.raw, field_object.raw
+
+        return raw.get('state') != other.get('state') or raw.get('occupied') != other.get('occupied')
+
+    def _remove(self, object_id):
+        entry = self.entries.pop(object_id)
+        loc = tuple(entry.field_object.loc)
+
+        if self.ids_by_loc.get(loc) == object_id:
+            del self.ids_by_loc[loc]
+
+        ids = self.ids_by_code[entry.field_object.code]
+        ids.discard(object_id)
+        if not ids:
+            del self.ids_by_code[entry.field_object.code]
+
+    def _expire(self, now):
+        while self.expiry and (self.expiry[0][0] <= now or len(self.entries) > self.maxsize):
+            expires_at, object_id = heapq.heappop(self.expiry)
+
+            entry = self.entries.get(object_id)
+            # stale heap items of replaced entries are skipped
+            if entry is not None and entry.expires_at == expires_at:
+                self._remove(object_id)
+
+    def update(self, field_objects) -> list:
+        """
+        :param field_objects: iterable of `FieldObject`, usually `FieldObjects.select(target_codes)`
+        :return: [FieldObject, ...] not handled yet, objects changed(state, occupied) since they were handled
+                 are returned again
+        """
+        now = time.time()
+        pending = []
+
+        with self.lock:
+            for field_object in field_objects:
+                object_id = field_object.id
+                entry = self.entries.get(object_id)
+
+                if entry is None:
+                    loc = tuple(field_object.loc)
+                    previous_id = self.ids_by_loc.get(loc)
+                    if previous_id is not None:
+                        # respawned
+                        self._remove(previous_id)
+
+                    entry = self.entries[object_id] = _Entry(field_object, self._get_expires_at(field_object, now))
+                    self.ids_by_loc[loc] = object_id
+                    self.ids_by_code[field_object.code].add(object_id)
+                    heapq.heappush(self.expiry, (entry.expires_at, object_id))
+                else:
+                    if self._is_changed(entry, field_object):
+                        entry.flags.discard(FLAG_HANDLED)
+
+                    entry.field_object = field_object
+
+                if entry.expires_at > now and FLAG_HANDLED not in entry.flags:
+                    pending.append(field_object)
+
+            self._expire(now)
+
+        return pending
+
+    def mark(self, field_object: FieldObject, flag=FLAG_HANDLED):
+        """
+        :return: False if the object already has the flag
+        """
+        with self.lock:
+            entry = self.entries.get(field_object.id)
+            if entry is None:
+                return True
+
+            if flag in entry.flags:
+                return False
+
+            entry.flags.add(flag)
+
+            return True
+
+    def get_by_loc(self, loc):
+        with self.lock:
+            object_id = self.ids_by_loc.get(tuple(loc))
+
+            return self.entries[object_id].field_object if object_id else None
+
+    def query(self, codes, levels=None):
+        """
+        :param codes:
+        :param levels: any level when omitted
+        :return: [FieldObject, ...] not expired yet
+        """
+        now = time.time()
+
+        with self.lock:
+            result = []
+            for code in codes:
+                for object_id in self.ids_by_code.get(code, ()):
+                    entry = self.entries[object_id]
+                    if entry.expires_at <= now:
+                        continue
+
+                    if levels is None or entry.field_object.level in levels:
+                        result.append(entry.field_object)
+
+            return result
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,162 @@
+import concurrent.futures
+import pathlib
+import statistics
+import tempfile
+import threading
+import time
+
+import fire
+import httpx
+import jwt
+
+import lokbot
+from lokbot import logger
+from lokbot.cache import cache_registry
+from lokbot.farmer import LokFarmer
+from lokbot.mock_server import MockLokServer
+from lokbot.pool import pool_manager
+from lokbot.spatial import devrank_store
+
+DEFAULT_JOBS = (
+    'keepalive_request',
+    'harvester',
+    'mail_claim',
+    'use_resource_in_item_list',
+    'caravan_farmer',
+    'vip_chest_claim',
+    'wall_repair',
+    'hospital_recover',
+)
+
+# seconds to wait for the socket threads of a farmer once it is stopped
+SOCKET_JOIN_TIMEOUT = 10
+
+
+class RedirectTransport(httpx.HTTPTransport):
+    """
+    send every request to the mock server, whatever the host of the url is
+    """
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = httpx.URL(base_url)
+
+    def handle_request(self, request):
+        request.url = request.url.copy_with(
+            scheme=self.base_url.scheme, host=self.base_url.host, port=self.base_url.port
+        )
+
+        return super().handle_request(request)
+
+    def close(self):
+        pass
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(len(values) * percent))]
+
+
+def run_job(farmer, name, kwargs):
+    started_at = time.perf_counter()
+    getattr(farmer, name)(**kwargs)
+
+    return time.perf_counter() - started_at
+
+
+def main(accounts=4, rounds=1, jobs=DEFAULT_JOBS, port=18080, latency=0.0, fixtures_dir=None, sockets=True,
+         socf_radius=None, socf_worlds=None):
+    """
+    start the mock server and `accounts` farmers against it, run every job `rounds` times on all farmers
+    and report latency and throughput per job
+    :param accounts:
+    :param rounds:
+    :param jobs: names of `LokFarmer` jobs
+    :param port:
+    :param latency: seconds added by the mock server to every http response
+    :param fixtures_dir:
+    :param sockets: start `sock_thread` and `socc_thread` for every farmer
+    :param socf_radius: also run `socf_thread` with this radius
+    :param socf_worlds: `worlds` of `socf_thread`, e.g. [{"world_id": 2, "loc": [1024, 1024]}]
+    :return:
+    """
+    # keep the tokens, logs and devrank of the mock accounts away from the real ones under data/
+    lokbot.data_dir = pathlib.Path(tempfile.mkdtemp())
+    logger.remove(lokbot.main_log_handler_id)
+    lokbot.main_log_handler_id = lokbot.add_main_log()
+    lokbot.set_socketio_logs()
+    devrank_store.directory = lokbot.data_dir.joinpath('devrank')
+    logger.info(f'data of the load test: {lokbot.data_dir}')
+
+    server = MockLokServer(port=port, fixtures_dir=fixtures_dir, latency=latency).start()
+    pool_manager.transport = RedirectTransport(server.base_url, limits=pool_manager.limits)
+
+    tokens = [jwt.encode({'_id': f'{index:024x}'}, 'lokbot') for index in range(accounts)]
+
+    started_at = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=accounts) as executor:
+        farmers = list(executor.map(lambda token: LokFarmer(token, {}), tokens))
+    logger.info(f'{accounts} farmers started in {time.perf_counter() - started_at:.3f}s')
+
+    socket_threads = []
+    if sockets:
+        for farmer in farmers:
+            for target in (farmer.sock_thread, farmer.socc_thread):
+                thread = threading.Thread(target=target, daemon=True)
+                thread.start()
+                socket_threads.append(thread)
+
+    job_list = [(name, {}) for name in jobs]
+    if socf_radius:
+        job_list.append(('socf_thread', {'radius': socf_radius, 'worlds': socf_worlds, 'targets': [
+            {'code': code, 'level': []} for code in (20100101, 20100102, 20100103, 20100104)
+        ]}))
+
+    report = {}
+    for name, kwargs in job_list:
+        durations = []
+        started_at = time.perf_counter()
+
+        for _ in range(rounds):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=accounts) as executor:
+                durations += executor.map(lambda farmer: run_job(farmer, name, kwargs), farmers)
+
+        wall_time = time.perf_counter() - started_at
+        report[name] = {
+            'runs': len(durations),
+            'mean': statistics.mean(durations),
+            'p50': _percentile(durations, 0.5),
+            'p95': _percentile(durations, 0.95),
+            'throughput': len(durations) / wall_time,
+        }
+
+    print(f'{"job":<28}{"runs":>6}{"mean(s)":>10}{"p50(s)":>10}{"p95(s)":>10}{"runs/s":>10}')
+    for name, each in report.items():
+        print(
+            f'{name:<28}{each["runs"]:>6}{each["mean"]:>10.3f}{each["p50"]:>10.3f}'
+            f'{each["p95"]:>10.3f}{each["throughput"]:>10.2f}'
+        )
+
+    print(f'\n{"endpoint":<36}{"requests":>10}{"mean server time(ms)":>22}')
+    for key, stat in sorted(server.get_stats().items()):
+        print(f'{key:<36}{stat["count"]:>10}{stat["seconds"] / stat["count"] * 1000:>22.3f}')
+
+    print(f'\n{"cache":<48}{"hits":>8}{"misses":>8}{"size":>8}')
+    for name, stat in cache_registry.get_stats().items():
+        print(f'{name:<48}{stat["hits"]:>8}{stat["misses"]:>8}{stat["size"]:>8}')
+
+    # the socket clients would keep reconnecting to the stopped server, and keep the interpreter alive
+    for farmer in farmers:
+        farmer.stop()
+
+    for thread in socket_threads:
+        thread.join(SOCKET_JOIN_TIMEOUT)
+        if thread.is_alive():
+            logger.warning(f'{thread.name} is still alive after {SOCKET_JOIN_TIMEOUT}s')
+
+    server.stop()
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
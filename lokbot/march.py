@@ -0,0 +1,245 @@
+import threading
+import time
+
+import arrow
+import numpy
+
+import lokbot.composition
+
+from lokbot import logger
+from lokbot.enum import *
+
+# a march still reported after its predicted end(e.g. on the way back) is checked again after this many seconds
+RECHECK_INTERVAL = 60
+
+
+class MarchTable:
+    """
+    marches of the account in the field by task id, kept up to date by `_start_march`, `/task/update` events of
+    `sock_thread` and predicted end times, so that waiting for a free march slot needs no polling.
+    a march is dropped once its predicted end has passed, `wait_for_slot` asks `kingdom/profile/troops`
+    again then, as no event came about it
+    """
+
+    def __init__(self, march_limit=2):
+        self.condition = threading.Condition()
+        self.march_limit = march_limit
+        self.marches = {}
+        # predicted ends of the marches without an id, which no event can be matched with
+        self.untracked = []
+        # slots taken by `reserve` for marches about to start
+        self.reserved = 0
+        self.initialized = False
+
+    @staticmethod
+    def _get_ended_at(task, now):
+        end_time = task.get('endTime') or task.get('expectedEnded')
+        ended_at = arrow.get(end_time).timestamp() if end_time else 0
+
+        return max(ended_at, now + RECHECK_INTERVAL) if ended_at <= now else ended_at
+
+    def reset(self, marches, march_limit):
+        """
+        :param marches: `troops.field` of `kingdom/profile/troops`
+        :param march_limit: `troops.info.marchLimit`
+        :return:
+        """
+        now = time.time()
+
+        with self.condition:
+            self.march_limit = march_limit
+            self.marches = {
+                march.get('_id'): self._get_ended_at(march, now) for march in marches if march.get('_id')
+            }
+            self.untracked = [self._get_ended_at(march, now) for march in marches if not march.get('_id')]
+            self.initialized = True
+            self.condition.notify_all()
+
+    def add(self, task):
+        """
+        :param task: `newTask` of `field/march/start`
+        :return:
+        """
+        with self.condition:
+            self.marches[task.get('_id')] = self._get_ended_at(task, time.time())
+
+    def on_task_update(self, task):
+        """
+        :param task: data of `/task/update`
+        :return: True if it is one of the marches
+        """
+        task_id = task.get('_id')
+
+        with self.condition:
+            if task_id not in self.marches:
+                return False
+
+            if task.get('status') in (STATUS_FINISHED, STATUS_CLAIMED):
+                del self.marches[task_id]
+                self.condition.notify_all()
+            elif task.get('expectedEnded'):
+                self.marches[task_id] = self._get_ended_at(task, time.time())
+
+            return True
+
+    def _prune(self, now):
+        """
+        drop the marches whose predicted end has passed, the condition must be held
+        :return: count of the dropped marches
+        """
+        expired = [task_id for task_id, ended_at in self.marches.items() if ended_at <= now]
+        for task_id in expired:
+            del self.marches[task_id]
+
+        untracked = [ended_at for ended_at in self.untracked if ended_at > now]
+        pruned = len(expired) + len(self.untracked) - len(untracked)
+        self.untracked = untracked
+
+        return pruned
+
+    def _count(self, now):
+        self._prune(now)
+
+        return len(self.marches) + len(self.untracked) + self.reserved
+
+    def reserve(self, limit):
+        """
+        take free slots for marches about to start, so that the march info can be requested without any lock
+        :param limit: slots wanted at most
+        :return: count of the reserved slots, to be given back by `release` once the marches started or not
+        """
+        with self.condition:
+            count = max(min(limit, self.march_limit - self._count(time.time())), 0)
+            self.reserved += count
+
+            return count
+
+    def release(self, count=1):
+        with self.condition:
+            self.reserved -= count
+            self.condition.notify_all()
+
+    def is_full(self):
+        with self.condition:
+            return self._count(time.time()) >= self.march_limit
+
+    def get_free_slots(self):
+        with self.condition:
+            return max(self.march_limit - self._count(time.time()), 0)
+
+    def wait_for_slot(self, refresh, timeout=None):
+        """
+        block until a march slot is free
+        :param refresh: called to reload the table(`kingdom/profile/troops`) once a predicted end has passed
+        :param timeout: in seconds
+        :return: False on timeout
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+
+        while True:
+            with self.condition:
+                now = time.time()
+                pruned = self._prune(now)
+
+                if not pruned:
+                    if len(self.marches) + len(self.untracked) + self.reserved < self.march_limit:
+                        return True
+
+                    if deadline is not None and now >= deadline:
+                        return False
+
+                    # reserved slots are given back by `release`, which notifies
+                    wait_until = min([*self.marches.values(), *self.untracked], default=now + RECHECK_INTERVAL)
+                    if deadline is not None:
+                        wait_until = min(wait_until, deadline)
+
+                    logger.info(f'march slots are full, wait {wait_until - now:.0f} seconds at most')
+                    self.condition.wait(wait_until - now)
+                    continue
+
+            # no event about the marches which should have ended, ask the server
+            refresh()
+
+
+# rough figures to compare march candidates with each other, not to predict march durations
+MARCH_SECONDS_PER_DISTANCE = 3
+GATHER_PER_SECOND = 50
+# march info is requested for this many candidates per free march slot
+SHORTLIST_FACTOR = 2
+
+
+class MarchCandidate:
+    __slots__ = ('field_object', 'march_type', 'march_info', 'march_troops', 'score')
+
+    def __init__(self, field_object, march_type):
+        self.field_object = field_object
+        self.march_type = march_type
+        self.march_info = None
+        self.march_troops = None
+        self.score = 0
+
+    @property
+    def value(self):
+        return (self.field_object.raw.get('param') or {}).get('value') or 0
+
+
+def get_yield_per_troop_minute(value, troop_count, distance, march_type):
+    """
+    scalars or numpy arrays
+    :param value: remaining resources of a mine or strength of a monster(`param.value`)
+    :param troop_count:
+    :param distance:
+    :param march_type:
+    :return: value gained per troop and minute of the march, there and back plus gathering
+    """
+    seconds = 2 * distance * MARCH_SECONDS_PER_DISTANCE + numpy.where(
+        march_type == MARCH_TYPE_GATHER, value / GATHER_PER_SECOND, 0
+    )
+    troop_minutes = numpy.maximum(troop_count, 1) * numpy.maximum(seconds, 1) / 60
+
+    return value / troop_minutes
+
+
+def rank(candidates, from_loc, troops=None, march_size=None):
+    """
+    order candidates by the score before `field/march/info`, with the straight distance
+    :param candidates: [MarchCandidate, ...]
+    :param from_loc: loc of the kingdom
+    :param troops: `troops` of a recent `field/march/info` to size the marches with `TroopSolver`,
+                   troops of average load when omitted
+    :param march_size:
+    :return:
+    """
+    if not candidates:
+        return []
+
+    values = numpy.array([candidate.value for candidate in candidates], dtype=numpy.float64)
+    march_types = numpy.array([candidate.march_type for candidate in candidates])
+    locs = numpy.array([candidate.field_object.loc for candidate in candidates])
+    distances = numpy.hypot(locs[:, 1] - from_loc[1], locs[:, 2] - from_loc[2])
+
+    troop_counts = numpy.empty(len(candidates))
+    for march_type in set(march_types.tolist()):
+        mask = march_types == march_type
+        if troops:
+            solver = lokbot.composition.TroopSolver(troops, march_type, march_size)
+            troop_counts[mask] = solver.get_troop_counts(values[mask])
+        else:
+            average_weight = numpy.mean([lokbot.composition.get_weight(code, march_type) for code in TROOP_LOAD_MAP])
+            troop_counts[mask] = lokbot.composition.get_requirement(values[mask], march_type) / average_weight
+
+    scores = get_yield_per_troop_minute(values, troop_counts, distances, march_types)
+
+    return [candidates[index] for index in numpy.argsort(-scores, kind='stable')]
+
+
+def subtract_troops(troops, used):
+    """
+    :param troops: `troops` of `field/march/info`
+    :param used: {troop code: amount} already sent since the march info was requested
+    :return:
+    """
+    return [
+        {**troop, 'amount': troop.get('amount') - used.get(troop.get('code'), 0)}
+        for troop in troops if troop.get('amount') > used.get(troop.get('code'), 0)
+    ]
@@ -0,0 +1,350 @@
+"""
+Local stand-in of the LoK api and socket servers for offline load testing, driven by fixtures.
+
+Run `python -m lokbot.mock_server` and point clients at it, see `lokbot.loadtest` for a harness.
+Requires `aiohttp`(dev dependency) for the websocket transport of the socket servers.
+
+Fixtures are json files named after the api path with `/` replaced by `.`(e.g. `kingdom.enter.json`),
+they override the built-in responses below. `sock.events.json` is a list of `[event, data]` emitted on
+`/kingdom/enter` and `field.objects.json` a list of field objects served instead of generated ones.
+"""
+import asyncio
+import base64
+import collections
+import gzip
+import pathlib
+import random
+import threading
+import time
+
+import arrow
+import fire
+import socketio
+from aiohttp import web
+
+import lokbot.enum
+import lokbot.serializer
+import lokbot.util
+from lokbot.codec import XorCodec
+from lokbot.enum import *
+
+PROTECTED_API_LIST = (
+    'kingdom/enter',
+    'field/march/info',
+    'field/march/start',
+    'kingdom/task/speedup',
+    'item/use',
+)
+
+MOCK_XOR_PASSWORD = 'mockpassword'
+
+
+class MockLokServer:
+    def __init__(self, host='127.0.0.1', port=18080, fixtures_dir=None, latency=0.0, seed=0):
+        """
+        :param host:
+        :param port: api port, the kingdom/field/chat socket servers listen on port + 1/2/3
+        :param fixtures_dir:
+        :param latency: seconds added to every http response
+        :param seed: seed of generated world data, same seed same world
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.seed = seed
+        self.codec = XorCodec(MOCK_XOR_PASSWORD)
+        self.fixtures = self._load_fixtures(fixtures_dir)
+        self.field_objects = {}
+
+        self.lock = threading.Lock()
+        self.stats = collections.defaultdict(lambda: {'count': 0, 'seconds': 0.0})
+
+        self.loop = None
+        self.runners = []
+        self.thread = None
+        self.started = threading.Event()
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}'
+
+    @staticmethod
+    def _load_fixtures(fixtures_dir):
+        fixtures = {}
+
+        if fixtures_dir is None:
+            return fixtures
+
+        for each in pathlib.Path(fixtures_dir).glob('*.json'):
+            fixtures[each.stem.replace('.', '/')] = lokbot.serializer.loads(each.read_bytes())
+
+        return fixtures
+
+    def _record(self, key, seconds):
+        with self.lock:
+            self.stats[key]['count'] += 1
+            self.stats[key]['seconds'] += seconds
+
+    def get_stats(self):
+        with self.lock:
+            return {key: dict(stat) for key, stat in self.stats.items()}
+
+    def b64xor_enc(self, d) -> str:
+        return base64.b64encode(self.codec.xor(lokbot.serializer.dumpb(d))).decode()
+
+    def b64xor_dec(self, s):
+        return lokbot.serializer.loads(self.codec.xor(base64.b64decode(s)))
+
+    # region http
+
+    def _kingdom_enter(self, token):
+        _id = lokbot.util.decode_jwt(token).get('_id')
+        rnd = random.Random(f'{self.seed}-{_id}')
+        x, y = rnd.randrange(2048), rnd.randrange(2048)
+
+        return {
+            'kingdom': {
+                '_id': _id,
+                'worldId': 1,
+                'level': 15,
+                'loc': [1, x, y],
+                'fieldObjectId': f'fo{_id}',
+                'allianceId': None,
+                'resources': [10000000, 10000000, 10000000, 10000000],
+                'vip': {'level': 5},
+                'dragoActionPoint': {'value': 0},
+                'buildings': [
+                    {'code': BUILDING_CODE_MAP['castle'], 'position': 1, 'level': 15, 'state': BUILDING_STATE_NORMAL},
+                    {'code': BUILDING_CODE_MAP['academy'], 'position': 5, 'level': 15, 'state': BUILDING_STATE_NORMAL},
+                    {'code': BUILDING_CODE_MAP['hospital'], 'position': 6, 'level': 15, 'state': BUILDING_STATE_NORMAL},
+                    {'code': BUILDING_CODE_MAP['farm'], 'position': 104, 'level': 15, 'state': BUILDING_STATE_NORMAL},
+                    {'code': BUILDING_CODE_MAP['barrack'], 'position': 105, 'level': 15,
+                     'state': BUILDING_STATE_NORMAL},
+                    {'code': BUILDING_CODE_MAP['lumber_camp'], 'position': 106, 'level': 15,
+                     'state': BUILDING_STATE_NORMAL},
+                    {'code': BUILDING_CODE_MAP['quarry'], 'position': 107, 'level': 15, 'state': BUILDING_STATE_NORMAL},
+                    {'code': BUILDING_CODE_MAP['gold_mine'], 'position': 108, 'level': 15,
+                     'state': BUILDING_STATE_NORMAL},
+                ],
+            },
+            'networks': {
+                'kingdoms': [f'http://{self.host}:{self.port + 1}'],
+                'fields': [f'http://{self.host}:{self.port + 2}'],
+                'chats': [f'http://{self.host}:{self.port + 3}'],
+            },
+        }
+
+    def _devrank(self):
+        rnd = random.Random(self.seed)
+
+        return {'lands': ''.join(str(min(9, int(rnd.expovariate(0.6)))) for _ in range(65536))}
+
+    def _march_info(self, payload):
+        fo = self.field_objects.get(tuple(payload.get('toLoc', [])))
+
+        return {
+            'fo': {
+                'code': fo.get('code') if fo else None,
+                'expired': fo.get('expired') if fo else arrow.utcnow().isoformat(),
+                'param': {'value': fo.get('param', {}).get('value', 0) if fo else 0},
+            },
+            'troops': [{'code': TROOP_CODE_FIGHTER, 'amount': 100000}, {'code': TROOP_CODE_WARRIOR, 'amount': 50000}],
+            'distance': 32,
+        }
+
+    def get_response(self, api_path, payload, token):
+        if api_path in self.fixtures:
+            return self.fixtures[api_path]
+
+        if api_path == 'auth/connect':
+            return {
+                'token': token,
+                'lstProtect': base64.b64encode(lokbot.serializer.dumpb([
+                    f'{lokbot.enum.API_BASE_URL}{each}' for each in PROTECTED_API_LIST
+                ])).decode(),
+                'regionHash': base64.b64encode(lokbot.serializer.dumpb(f'mock-{MOCK_XOR_PASSWORD}')).decode(),
+            }
+
+        builtin = {
+            'kingdom/enter': lambda: self._kingdom_enter(token),
+            'field/worldmap/devrank': self._devrank,
+            'field/march/info': lambda: self._march_info(payload),
+            'field/march/start': lambda: {
+                'newTask': {'_id': f'{time.time_ns():x}', 'expectedEnded': arrow.utcnow().shift(minutes=5).isoformat()}
+            },
+            'drago/lair/list': lambda: {'dragos': []},
+            'item/list': lambda: {'items': [{'code': ITEM_CODE_FOOD_1K, 'amount': 2}]},
+            'kingdom/task/all': lambda: {'kingdomTasks': []},
+            'kingdom/profile/troops': lambda: {'troops': {'field': [], 'info': {'marchLimit': 2, 'marchSize': 10000}}},
+            'kingdom/caravan/list': lambda: {'caravan': {'items': []}},
+            'kingdom/vip/info': lambda: {'vip': {'isClaimed': True}},
+            'kingdom/wall/info': lambda: {'wall': {'maxDurability': 100, 'durability': 100, 'lastRepairDate': None}},
+            'kingdom/hospital/wounded': lambda: {'wounded': []},
+            'kingdom/arcademy/research/list': lambda: {'researches': []},
+            'quest/list': lambda: {'mainQuests': [], 'sideQuests': []},
+            'quest/list/daily': lambda: {'dailyQuest': {'quests': [], 'rewards': []}},
+            'event/list': lambda: {'events': []},
+        }.get(api_path)
+
+        return builtin() if builtin else {}
+
+    async def handle_api(self, request):
+        started_at = time.perf_counter()
+        api_path = request.match_info['api_path']
+        token = request.headers.get('x-access-token', '')
+
+        form = await request.post()
+        raw = form.get('json', '{}')
+        payload = self.b64xor_dec(raw) if api_path in PROTECTED_API_LIST else lokbot.serializer.loads(raw)
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        json_response = {'result': True, **self.get_response(api_path, payload, token)}
+
+        if api_path in PROTECTED_API_LIST:
+            response = web.Response(text=self.b64xor_enc(json_response))
+        else:
+            response = web.Response(body=lokbot.serializer.dumpb(json_response), content_type='application/json')
+
+        self._record(api_path, time.perf_counter() - started_at)
+
+        return response
+
+    # endregion
+
+    # region socket
+
+    def _generate_zone_objects(self, world_id, zone_id):
+        if 'field/objects' in self.fixtures:
+            return self.fixtures['field/objects']
+
+        rnd = random.Random(f'{self.seed}-{world_id}-{zone_id}')
+        zone_x, zone_y = zone_id % 64 * 32, zone_id // 64 * 32
+        expired = arrow.utcnow().shift(hours=1).isoformat()
+
+        objects = []
+        for index in range(rnd.randrange(10, 40)):
+            loc = [world_id, zone_x + rnd.randrange(32), zone_y + rnd.randrange(32)]
+            code = rnd.choice(OBJECT_MINE_CODE_LIST + OBJECT_MONSTER_CODE_LIST)
+            each_obj = {
+                '_id': f'{world_id:04x}{zone_id:08x}{index:012x}',
+                'code': code,
+                'level': rnd.randrange(1, 6),
+                'loc': loc,
+                'state': 1,
+                'expired': expired,
+                'occupied': None if rnd.random() > 0.2 else {'worldId': world_id},
+                'param': {'value': rnd.randrange(1000, 100000)},
+            }
+            self.field_objects[tuple(loc)] = each_obj
+            objects.append(each_obj)
+
+        return objects
+
+    def _pack(self, d) -> bytes:
+        return gzip.compress(self.b64xor_enc(d).encode())
+
+    def _create_socket_servers(self):
+        kingdom_sio = socketio.AsyncServer(
+            async_mode='aiohttp', json=lokbot.serializer.SocketioJson, cors_allowed_origins='*'
+        )
+        field_sio = socketio.AsyncServer(
+            async_mode='aiohttp', json=lokbot.serializer.SocketioJson, cors_allowed_origins='*'
+        )
+        chat_sio = socketio.AsyncServer(
+            async_mode='aiohttp', json=lokbot.serializer.SocketioJson, cors_allowed_origins='*'
+        )
+
+        @kingdom_sio.on('/kingdom/enter')
+        async def on_kingdom_enter(sid, data):
+            self._record('sock:/kingdom/enter', 0)
+            for event, event_data in self.fixtures.get('sock/events', []):
+                await kingdom_sio.emit(event, event_data, room=sid)
+
+        @field_sio.on('/field/enter/v3')
+        async def on_field_enter(sid, data):
+            self._record('socf:/field/enter/v3', 0)
+            token = self.b64xor_dec(data).get('token')
+            loc = self._kingdom_enter(token).get('kingdom').get('loc')
+            await field_sio.emit('/field/enter/v3', self.b64xor_enc({'loc': loc}), room=sid)
+
+        @field_sio.on('/zone/enter/list/v4')
+        async def on_zone_enter(sid, data):
+            started_at = time.perf_counter()
+            message = self.b64xor_dec(data)
+            world_id = message.get('world')
+
+            objects = []
+            for zone_id in lokbot.serializer.loads(message.get('zones')):
+                objects += self._generate_zone_objects(world_id, zone_id)
+
+            await field_sio.emit('/field/objects/v4', {'packs': self._pack({'objects': objects})}, room=sid)
+            self._record('socf:/zone/enter/list/v4', time.perf_counter() - started_at)
+
+        @chat_sio.on('/chat/enter')
+        async def on_chat_enter(sid, data):
+            self._record('socc:/chat/enter', 0)
+
+        return kingdom_sio, field_sio, chat_sio
+
+    # endregion
+
+    async def _serve(self):
+        api_app = web.Application()
+        api_app.router.add_post('/api/{api_path:.*}', self.handle_api)
+        api_app.router.add_get('/api/auth/captcha', lambda request: web.Response(body=b'', content_type='image/png'))
+
+        apps = [api_app]
+        for sio in self._create_socket_servers():
+            app = web.Application()
+            sio.attach(app)
+            apps.append(app)
+
+        for offset, app in enumerate(apps):
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, self.host, self.port + offset).start()
+            self.runners.append(runner)
+
+    def start(self):
+        """
+        serve in a background thread
+        :return:
+        """
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            self.loop.run_until_complete(self._serve())
+            self.started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, name='mock_server', daemon=True)
+        self.thread.start()
+        self.started.wait()
+
+        return self
+
+    def stop(self):
+        async def cleanup():
+            for runner in self.runners:
+                await runner.cleanup()
+
+        asyncio.run_coroutine_threadsafe(cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def main(host='127.0.0.1', port=18080, fixtures_dir=None, latency=0.0, seed=0):
+    server = MockLokServer(host, port, fixtures_dir, latency, seed).start()
+    print(f'mock server listening on {server.base_url}, sockets on ports {port + 1}-{port + 3}')
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
@@ -0,0 +1,100 @@
+import threading
+import time
+import typing
+
+import numpy
+
+import lokbot.spatial
+
+
+class ZoneSweepPlanner:
+    """
+    choose which zones `socf_thread` enters within its limited enter/leave rounds
+
+    score = (land_weight * mean land level / 10 + hit_weight * targets found before)
+            * freshness / (1 + distance / distance_scale)
+
+    `freshness` grows from 0 to 1 within `revisit_interval` seconds after a zone was visited,
+    so zones not chosen this cycle get their turn in the next ones
+    """
+
+    def __init__(self, land_index: typing.Optional[lokbot.spatial.LandIndex], loc, radius=8, step=9, land_weight=1.0,
+                 hit_weight=0.5, hit_decay=0.5, distance_scale=4.0, revisit_interval=900):
+        """
+        :param land_index: None when the devrank of the world is unknown, all lands count as level 5
+        :param loc: loc of the kingdom, [world_id, x, y]
+        :param radius: candidate zones within a square of `radius` zones around `loc`
+        :param step: zones per enter/leave round
+        :param land_weight:
+        :param hit_weight:
+        :param hit_decay: found targets are decayed by this factor on every visit of a zone
+        :param distance_scale: in zones, the score halves at this distance
+        :param revisit_interval: in seconds
+        """
+        self.step = step
+        self.land_weight = land_weight
+        self.hit_weight = hit_weight
+        self.hit_decay = hit_decay
+        self.distance_scale = distance_scale
+        self.revisit_interval = revisit_interval
+        self.lock = threading.Lock()
+
+        self.zone_ids = numpy.array(lokbot.spatial.get_nearby_zone_ids(loc[1], loc[2], radius))
+        if land_index is None:
+            self.land_values = numpy.full(len(self.zone_ids), 0.5)
+        else:
+            self.land_values = land_index.get_zone_levels()[self.zone_ids] / 10
+
+        center_x, center_y = lokbot.spatial.get_zone_center_coords(self.zone_ids)
+        distance = numpy.hypot(center_x - loc[1], center_y - loc[2]) / lokbot.spatial.ZONE_SIZE
+        self.distance_penalty = 1 + distance / distance_scale
+
+        self.positions = {zone_id: index for index, zone_id in enumerate(self.zone_ids.tolist())}
+        self.hits = numpy.zeros(len(self.zone_ids))
+        self.last_visited_at = numpy.full(len(self.zone_ids), -numpy.inf)
+
+    def get_scores(self, now=None):
+        now = time.time() if now is None else now
+        freshness = numpy.clip((now - self.last_visited_at) / self.revisit_interval, 0, 1)
+
+        return (self.land_weight * self.land_values + self.hit_weight * self.hits) * freshness / self.distance_penalty
+
+    def plan(self, rounds=7):
+        """
+        best zones for the coming `rounds`
+        :param rounds:
+        :return: [[zone_id, ...], ...], at most `rounds` batches of `step` zones, best batch first
+        """
+        with self.lock:
+            scores = self.get_scores()
+
+        count = min(rounds * self.step, len(scores) // self.step * self.step)
+        # stable sort, ties are broken by the row by row order of the candidate zones
+        zone_ids = self.zone_ids[numpy.argsort(-scores, kind='stable')[:count]].tolist()
+
+        return [zone_ids[index:index + self.step] for index in range(0, count, self.step)]
+
+    def mark_visited(self, zone_ids):
+        """
+        call before entering the zones, targets found there afterwards are recorded on top of the decayed ones
+        :param zone_ids:
+        :return:
+        """
+        positions = [self.positions[zone_id] for zone_id in zone_ids]
+
+        with self.lock:
+            self.last_visited_at[positions] = time.time()
+            self.hits[positions] *= self.hit_decay
+
+    def record_found(self, loc, count=1):
+        """
+        :param loc: loc of a target object
+        :param count:
+        :return:
+        """
+        position = self.positions.get(lokbot.spatial.get_zone_id_by_coords(loc[1], loc[2]))
+        if position is None:
+            return
+
+        with self.lock:
+            self.hits[position] += count
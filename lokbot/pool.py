@@ -0,0 +1,96 @@
+import asyncio
+import threading
+
+import httpx
+
+DEFAULT_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+
+
+class _SharedTransport(httpx.HTTPTransport):
+    """
+    closing a client must not tear down connections used by the other clients, see `PoolManager.close`
+    """
+
+    def close(self):
+        pass
+
+
+class _SharedAsyncTransport(httpx.AsyncBaseTransport):
+    """
+    asyncio connections belong to the event loop which opened them,
+    requests go through the transport of the running loop, see `PoolManager.get_async_transport`
+    """
+
+    def __init__(self, pool_manager):
+        self.pool_manager = pool_manager
+
+    async def handle_async_request(self, request):
+        return await self.pool_manager.get_async_transport().handle_async_request(request)
+
+    async def aclose(self):
+        pass
+
+
+class PoolManager:
+    """
+    process wide connection pool, every account gets its own client(headers, cookies, token)
+    while the underlying connections are reused
+    """
+
+    def __init__(self, limits=DEFAULT_LIMITS, http2=True):
+        self.limits = limits
+        self.http2 = http2
+        self.lock = threading.Lock()
+        self.transport = None
+        # event loop: httpx.AsyncHTTPTransport
+        self.async_transports = {}
+
+    def get_transport(self) -> httpx.HTTPTransport:
+        with self.lock:
+            if self.transport is None:
+                self.transport = _SharedTransport(http2=self.http2, limits=self.limits)
+
+            return self.transport
+
+    def get_async_transport(self) -> httpx.AsyncHTTPTransport:
+        """
+        the transport of the running event loop, transports of closed loops are dropped
+        """
+        loop = asyncio.get_running_loop()
+
+        with self.lock:
+            transport = self.async_transports.get(loop)
+            if transport is None:
+                for closed_loop in [each for each in self.async_transports if each.is_closed()]:
+                    del self.async_transports[closed_loop]
+
+                transport = self.async_transports[loop] = httpx.AsyncHTTPTransport(
+                    http2=self.http2, limits=self.limits
+                )
+
+            return transport
+
+    def client(self, **kwargs) -> httpx.Client:
+        return httpx.Client(transport=self.get_transport(), **kwargs)
+
+    def async_client(self, **kwargs) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=_SharedAsyncTransport(self), **kwargs)
+
+    def close(self):
+        with self.lock:
+            if self.transport is not None:
+                httpx.HTTPTransport.close(self.transport)
+                self.transport = None
+
+    async def aclose(self):
+        """
+        close the connections of the running event loop
+        """
+        with self.lock:
+            transport = self.async_transports.pop(asyncio.get_running_loop(), None)
+
+        if transport is not None:
+            await transport.aclose()
+
+
+pool_manager = PoolManager()
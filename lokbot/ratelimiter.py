@@ -0,0 +1,110 @@
+import asyncio
+import collections
+import threading
+import time
+
+# api_path: (calls, period), `*` applies to every request
+DEFAULT_RATE_LIMITS = {
+    '*': (1, 0.1),
+    'auth/captcha/confirm': (1, 2),
+    'quest/claim': (1, 1),
+    'quest/claim/daily': (1, 1),
+    'quest/claim/daily/level': (1, 1),
+    'event/info': (1, 2),
+    'event/claim': (1, 1),
+    'kingdom/task/claim': (1, 4),
+    'kingdom/task/speedup': (1, 2),
+    'kingdom/heal/speedup': (1, 2),
+    'kingdom/resource/harvest': (1, 4),
+    'kingdom/building/upgrade': (1, 6),
+    'kingdom/building/build': (1, 6),
+    'kingdom/arcademy/research': (1, 6),
+    'kingdom/caravan/buy': (1, 4),
+    'item/use': (1, 2),
+    'item/freechest': (1, 4),
+    'event/roulette/spin': (1, 2),
+    'mail/claim/all': (1, 2),
+    'field/march/start': (1, 4),
+}
+
+
+class TokenBucket:
+    """
+    token bucket of `calls` tokens refilled over `period` seconds,
+    tracked as a theoretical arrival time so that the exact wake-up time is known
+    """
+
+    def __init__(self, calls, period):
+        self.interval = period / calls
+        self.tolerance = period - self.interval
+        self.tat = 0.0
+
+    def earliest(self, now):
+        return max(now, self.tat - self.tolerance)
+
+    def consume(self, at):
+        self.tat = max(self.tat, at) + self.interval
+
+
+class RateLimiter:
+    """
+    client-side rate limiter keyed by api path, shared by every thread (or task) using the same api client
+    """
+
+    def __init__(self, rate_limits=None):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.stats = collections.defaultdict(lambda: {'calls': 0, 'throttled_calls': 0, 'throttled_seconds': 0.0})
+
+        for api_path, (calls, period) in {**DEFAULT_RATE_LIMITS, **(rate_limits or {})}.items():
+            self.configure(api_path, calls, period)
+
+    def configure(self, api_path, calls, period):
+        with self.lock:
+            if not calls:
+                self.buckets.pop(api_path, None)
+                return
+
+            self.buckets[api_path] = TokenBucket(calls, period)
+
+    def reserve(self, api_path):
+        """
+        reserve a slot for `api_path`
+        :param api_path:
+        :return: seconds to wait before the request can be sent
+        """
+        with self.lock:
+            now = time.monotonic()
+            buckets = [bucket for bucket in (self.buckets.get('*'), self.buckets.get(api_path)) if bucket]
+
+            at = max([bucket.earliest(now) for bucket in buckets], default=now)
+            for bucket in buckets:
+                bucket.consume(at)
+
+            delay = at - now
+
+            stat = self.stats[api_path]
+            stat['calls'] += 1
+            if delay > 0:
+                stat['throttled_calls'] += 1
+                stat['throttled_seconds'] += delay
+
+        return delay
+
+    def acquire(self, api_path):
+        delay = self.reserve(api_path)
+        if delay > 0:
+            time.sleep(delay)
+
+        return delay
+
+    async def async_acquire(self, api_path):
+        delay = self.reserve(api_path)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        return delay
+
+    def get_stats(self):
+        with self.lock:
+            return {api_path: dict(stat) for api_path, stat in self.stats.items()}
@@ -0,0 +1,232 @@
+import concurrent.futures
+import heapq
+import itertools
+import random
+import threading
+import time
+
+import arrow
+
+from lokbot import logger
+
+
+class Job:
+    __slots__ = ('name', 'func', 'args', 'kwargs', 'interval', 'seq')
+
+    def __init__(self, name, func, args=(), kwargs=None, interval=None):
+        """
+        :param interval: (start, end) in seconds for jobs running every `start` to `end` seconds, None for one-shots
+        """
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.interval = interval
+        self.seq = None
+
+    def get_delay(self):
+        return random.uniform(*self.interval)
+
+
+class Scheduler:
+    """
+    one timer heap and a bounded worker pool for all jobs of the process, in place of `schedule`
+    plus a thread per run and the `threading.Timer`s jobs used to re-arm themselves with.
+
+    jobs of the same name never run concurrently:
+    a due interval job whose previous run is still going is skipped until its next interval,
+    a due one-shot waits for the running one and starts right after it
+    """
+
+    def __init__(self, max_workers=32):
+        """
+        :param max_workers: runs at a time
+        """
+        self.max_workers = max_workers
+        self.condition = threading.Condition()
+        self.heap = []
+        self.counter = itertools.count()
+        self.jobs = {}
+        self.timers = {}
+        self.running = {}
+        self.deferred = {}
+        self.stats = {}
+        self.executor = None
+        self.thread = None
+        self.stopped = False
+
+    def _push(self, job: Job, run_at):
+        job.seq = next(self.counter)
+        heapq.heappush(self.heap, (run_at, job.seq, job))
+        self.condition.notify_all()
+
+    def every(self, name, interval, func, *args, **kwargs):
+        """
+        run `func` every `interval` seconds, the first run after one interval as well
+        :param name:
+        :param interval: (start, end) for a random interval drawn again before every run
+        :param func:
+        :return:
+        """
+        job = Job(name, func, args, kwargs, tuple(interval))
+
+        with self.condition:
+            self.jobs[name] = job
+            self._push(job, time.time() + job.get_delay())
+
+        return job
+
+    def call_later(self, delay, name, func, *args, **kwargs):
+        """
+        run `func` once after `delay` seconds, replacing a one-shot of the same name which is not started yet
+        :return:
+        """
+        job = Job(name, func, args, kwargs)
+
+        with self.condition:
+            self.timers[name] = job
+            self._push(job, time.time() + delay)
+
+        return job
+
+    def run_all(self, prefix=''):
+        """
+        run every interval job now, their next runs are counted from now on
+        :param prefix: only the jobs whose names start with it
+        :return:
+        """
+        with self.condition:
+            for name, job in self.jobs.items():
+                if name.startswith(prefix):
+                    self._push(job, time.time())
+
+    def cancel(self, prefix):
+        """
+        drop the pending runs of the jobs whose names start with `prefix`, running ones finish undisturbed
+        """
+        with self.condition:
+            for jobs in (self.jobs, self.timers, self.deferred):
+                for name in [name for name in jobs if name.startswith(prefix)]:
+                    del jobs[name]
+
+    def _is_current(self, job: Job, seq):
+        if job.seq != seq:
+            return False
+
+        if job.interval is None:
+            return self.timers.get(job.name) is job
+
+        return self.jobs.get(job.name) is job
+
+    def _dispatch(self, job: Job, now):
+        if job.interval is None:
+            del self.timers[job.name]
+        else:
+            self._push(job, now + job.get_delay())
+
+        if job.name in self.running:
+            if job.interval is None:
+                self.deferred[job.name] = job
+            else:
+                self._get_stat(job.name)['skips'] += 1
+                logger.debug(f'{job.name} is still running, skip')
+
+            return
+
+        self._submit(job)
+
+    def _submit(self, job: Job):
+        self._get_stat(job.name)
+        self.running[job.name] = self.executor.submit(self._run, job)
+
+    def _get_stat(self, name):
+        if name not in self.stats:
+            self.stats[name] = {'runs': 0, 'skips': 0, 'last_run_at': None, 'last_duration': None}
+
+        return self.stats[name]
+
+    def _run(self, job: Job):
+        started_at = time.time()
+
+        try:
+            job.func(*job.args, **job.kwargs)
+        except Exception as e:
+            logger.opt(exception=e).error(f'{job.name} failed: {e}')
+        finally:
+            with self.condition:
+                stat = self._get_stat(job.name)
+                stat['runs'] += 1
+                stat['last_run_at'] = arrow.get(started_at)
+                stat['last_duration'] = time.time() - started_at
+                del self.running[job.name]
+
+                deferred = self.deferred.pop(job.name, None)
+                if deferred is not None and not self.stopped:
+                    self._submit(deferred)
+
+    def _loop(self):
+        with self.condition:
+            while not self.stopped:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+
+                run_at, seq, job = self.heap[0]
+                now = time.time()
+                if run_at > now:
+                    self.condition.wait(run_at - now)
+                    continue
+
+                heapq.heappop(self.heap)
+                if self._is_current(job, seq):
+                    self._dispatch(job, now)
+
+    def start(self):
+        with self.condition:
+            if self.thread is not None:
+                return self
+
+            self.stopped = False
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix='scheduler')
+            self.thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+            self.thread.start()
+
+        return self
+
+    def stop(self, wait=False):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+            thread, self.thread = self.thread, None
+
+        if thread is not None:
+            thread.join()
+            self.executor.shutdown(wait=wait, cancel_futures=True)
+
+    def get_upcoming(self, limit=None):
+        """
+        :param limit:
+        :return: [{'name', 'run_at', 'interval', 'running'}, ...] ordered by run_at
+        """
+        with self.condition:
+            upcoming = [
+                {
+                    'name': job.name,
+                    'run_at': arrow.get(run_at),
+                    'interval': job.interval,
+                    'running': job.name in self.running,
+                }
+                for run_at, seq, job in sorted(self.heap, key=lambda x: x[:2]) if self._is_current(job, seq)
+            ]
+
+        return upcoming[:limit] if limit else upcoming
+
+    def get_stats(self):
+        """
+        :return: {name: {'runs', 'skips', 'last_run_at', 'last_duration', 'running'}} of the jobs started so far
+        """
+        with self.condition:
+            return {name: {**stat, 'running': name in self.running} for name, stat in self.stats.items()}
+
+
+scheduler = Scheduler()
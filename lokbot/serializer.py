@@ -0,0 +1,182 @@
+"""
+json backends of the api clients and socket-io, orjson is the one installed by the Pipfile.
+
+`dumps` is compact with every backend but not byte-identical across them:
+orjson and msgspec always write raw utf-8 while the stdlib json escapes non-ascii characters(`\\uXXXX`)
+"""
+import json
+import timeit
+import typing
+
+from lokbot import config
+
+
+class StdlibBackend:
+    name = 'json'
+
+    @staticmethod
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+    @staticmethod
+    def loads(s: typing.Union[str, bytes, bytearray]):
+        return json.loads(s)
+
+
+class OrjsonBackend:
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+
+        self.orjson = orjson
+
+    def dumps(self, obj) -> bytes:
+        # orjson output is always compact
+        return self.orjson.dumps(obj, option=self.orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, s):
+        # orjson.JSONDecodeError is a subclass of json.JSONDecodeError
+        return self.orjson.loads(s)
+
+
+class MsgspecBackend:
+    name = 'msgspec'
+
+    def __init__(self):
+        import msgspec
+
+        self.msgspec = msgspec
+        self.encoder = msgspec.json.Encoder()
+        self.decoder = msgspec.json.Decoder()
+
+    def dumps(self, obj) -> bytes:
+        return self.encoder.encode(obj)
+
+    def loads(self, s):
+        try:
+            return self.decoder.decode(s)
+        except self.msgspec.DecodeError as e:
+            # keep `json.JSONDecodeError` as the single error type to retry on
+            raise json.JSONDecodeError(str(e), s if isinstance(s, str) else '', 0) from e
+
+
+BACKENDS = {
+    'orjson': OrjsonBackend,
+    'msgspec': MsgspecBackend,
+    'json': StdlibBackend,
+}
+
+
+def get_backend(name='auto'):
+    """
+    :param name: `auto` picks the first installed one of orjson, msgspec and the stdlib json
+    :return:
+    """
+    if name != 'auto':
+        return BACKENDS[name]()
+
+    for backend_class in BACKENDS.values():
+        try:
+            return backend_class()
+        except ImportError:
+            continue
+
+
+backend = get_backend(config.get('json_backend', 'auto'))
+
+
+def set_backend(name):
+    global backend
+
+    backend = get_backend(name)
+
+
+def dumps(obj) -> str:
+    """
+    compact json(`separators=(',', ':')`) as the server expects
+    """
+    return backend.dumps(obj).decode()
+
+
+def dumpb(obj) -> bytes:
+    return backend.dumps(obj)
+
+
+def loads(s: typing.Union[str, bytes, bytearray]):
+    return backend.loads(s)
+
+
+class SocketioJson:
+    """
+    json module replacement for `socketio.Client(json=...)`, which passes stdlib style keyword arguments
+    """
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        return dumps(obj)
+
+    @staticmethod
+    def loads(s, *args, **kwargs):
+        return loads(s)
+
+
+def _sample_kingdom_enter():
+    from lokbot.enum import building_json
+
+    return {
+        'result': True,
+        'kingdom': {
+            'worldId': 1,
+            'loc': [1, 1024, 1024],
+            'resources': [1000000, 2000000, 3000000, 4000000],
+            'buildings': [
+                {'code': code, 'position': position, 'level': position % 30, 'state': 1, 'param': {}}
+                for position, code in enumerate(list(building_json.keys()) * 8)
+            ],
+        },
+        'networks': {'kingdoms': ['wss://sock'], 'fields': ['wss://socf'], 'chats': ['wss://socc']},
+        'buildingInfo': building_json,
+    }
+
+
+def _sample_field_objects(count=5000):
+    return {
+        'objects': [
+            {
+                '_id': f'{index:024x}',
+                'code': 20100101 + index % 6,
+                'level': index % 5 + 1,
+                'loc': [1, index % 2048, index // 2048],
+                'state': 1,
+                'expired': '2026-01-01T00:00:00.000Z',
+                'occupied': None if index % 3 else {'allianceId': 'a', 'name': 'name', 'worldId': 1},
+                'param': {'value': 1000 * index},
+            }
+            for index in range(count)
+        ]
+    }
+
+
+def benchmark(number=50):
+    payloads = {'kingdom/enter': _sample_kingdom_enter(), 'field/objects/v4': _sample_field_objects()}
+
+    for name, payload in payloads.items():
+        encoded = StdlibBackend.dumps(payload)
+        print(f'{name} ({len(encoded)} bytes)')
+
+        for backend_name in BACKENDS:
+            try:
+                each_backend = get_backend(backend_name)
+            except ImportError:
+                print(f'  {backend_name:>8}: not installed')
+                continue
+
+            assert each_backend.loads(encoded) == StdlibBackend.loads(encoded)
+            dumps_time = timeit.timeit(lambda: each_backend.dumps(payload), number=number) / number
+            loads_time = timeit.timeit(lambda: each_backend.loads(encoded), number=number) / number
+            print(f'  {backend_name:>8}: dumps {dumps_time * 1000:8.3f} ms, loads {loads_time * 1000:8.3f} ms')
+
+
+if __name__ == '__main__':
+    benchmark()
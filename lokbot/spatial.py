@@ -0,0 +1,339 @@
+"""
+Closed-form conversions between coordinates, lands and zones, see `docs/land.md`
+
+    world: 2048 * 2048 coordinates, (0, 0) at the left-bottom corner
+    land:  256 * 256, 8 * 8 coordinates each, id = 100000 + row * 256 + col
+    zone:  64 * 64, 4 * 4 lands each, id = row * 64 + col
+
+every function accepts scalars as well as numpy arrays
+"""
+import collections
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+import time
+import timeit
+
+import numpy
+
+import lokbot.util
+from lokbot import logger, project_root
+
+LAND_ID_START = 100000
+LAND_SIZE = 8
+LANDS_PER_ROW = 256
+ZONE_SIZE = 32
+ZONES_PER_ROW = 64
+LANDS_PER_ZONE_ROW = ZONE_SIZE // LAND_SIZE
+
+DEVRANK_DIR = project_root.joinpath('data/devrank')
+# lands are developed continuously, the ranking drifts slowly
+DEVRANK_MAX_AGE = 6 * 3600
+
+
+def get_land_id_by_coords(x, y):
+    return LAND_ID_START + (y // LAND_SIZE) * LANDS_PER_ROW + x // LAND_SIZE
+
+
+def get_land_cell(land_id):
+    """
+    :param land_id:
+    :return: (row, col) of the land in the 256 * 256 devrank grid
+    """
+    return divmod(land_id - LAND_ID_START, LANDS_PER_ROW)
+
+
+def get_zone_id_by_land_id(land_id):
+    row, col = get_land_cell(land_id)
+
+    return (row // LANDS_PER_ZONE_ROW) * ZONES_PER_ROW + col // LANDS_PER_ZONE_ROW
+
+
+def get_zone_id_by_coords(x, y):
+    return lokbot.util.get_zone_id_by_coords(x, y)
+
+
+def get_zone_cell(zone_id):
+    return divmod(zone_id, ZONES_PER_ROW)
+
+
+def get_zone_center_coords(zone_id):
+    row, col = get_zone_cell(zone_id)
+
+    return col * ZONE_SIZE + ZONE_SIZE // 2, row * ZONE_SIZE + ZONE_SIZE // 2
+
+
+def _window(center, radius, size):
+    return max(center - radius, 0), min(center + radius + 1, size)
+
+
+def get_nearby_zone_ids(x, y, radius=8):
+    """
+    zones within a square of `radius` zones around (x, y), row by row from the bottom
+    """
+    row, col = get_zone_cell(get_zone_id_by_coords(x, y))
+    row_start, row_stop = _window(row, radius, ZONES_PER_ROW)
+    col_start, col_stop = _window(col, radius, ZONES_PER_ROW)
+
+    rows = numpy.arange(row_start, row_stop)[:, numpy.newaxis]
+    cols = numpy.arange(col_start, col_stop)[numpy.newaxis, :]
+
+    return (rows * ZONES_PER_ROW + cols).ravel().tolist()
+
+
+class LandIndex:
+    """
+    devrank levels of all lands as a 256 * 256 grid, radius queries are array slices of it
+    """
+
+    TABLES = ('levels', 'zone_levels', 'ranking')
+
+    def __init__(self, levels: numpy.ndarray, zone_levels: numpy.ndarray = None, ranking: numpy.ndarray = None):
+        """
+        :param levels: level of every land, ordered by land id
+        :param zone_levels: mean level of every zone, computed from `levels` when omitted
+        :param ranking: land indexes ordered by level desc then land id, computed from `levels` when omitted
+        """
+        self.levels = levels.reshape(LANDS_PER_ROW, LANDS_PER_ROW)
+
+        if zone_levels is None:
+            zone_levels = self.levels.reshape(
+                ZONES_PER_ROW, LANDS_PER_ZONE_ROW, ZONES_PER_ROW, LANDS_PER_ZONE_ROW
+            ).mean(axis=(1, 3)).ravel().astype(numpy.float32)
+        self.zone_levels = zone_levels
+
+        if ranking is None:
+            flat_levels = self.levels.ravel()
+            ranking = numpy.lexsort((numpy.arange(flat_levels.size), -flat_levels.astype(numpy.int16)))
+            ranking = ranking.astype(numpy.uint32)
+        self.ranking = ranking
+
+    @classmethod
+    def from_devrank(cls, lands: str):
+        """
+        :param lands: `lands` of `field/worldmap/devrank`, one digit per land ordered by land id,
+                      0 ~ 9 for land level 1 ~ 10
+        :return:
+        """
+        levels = numpy.frombuffer(lands.encode(), dtype=numpy.uint8) - (ord('0') - 1)
+
+        return cls(levels)
+
+    def save(self, directory: pathlib.Path):
+        """
+        one `.npy` per table into a new directory, see `DevrankStore` for how it is published
+        """
+        directory.mkdir(parents=True)
+        for table in self.TABLES:
+            numpy.save(directory.joinpath(f'{table}.npy'), getattr(self, table))
+
+    @classmethod
+    def load(cls, directory: pathlib.Path):
+        """
+        tables are memory-mapped read only, processes loading the same files share their pages
+        """
+        tables = {}
+        for table in cls.TABLES:
+            tables[table] = numpy.load(directory.joinpath(f'{table}.npy'), mmap_mode='r')
+
+        return cls(**tables)
+
+    def _query(self, x, y, radius):
+        row, col = y // LAND_SIZE, x // LAND_SIZE
+        row_start, row_stop = _window(row, radius, LANDS_PER_ROW)
+        col_start, col_stop = _window(col, radius, LANDS_PER_ROW)
+
+        levels = self.levels[row_start:row_stop, col_start:col_stop].ravel()
+        rows, cols = numpy.mgrid[row_start:row_stop, col_start:col_stop]
+        land_ids = (LAND_ID_START + rows * LANDS_PER_ROW + cols).ravel()
+
+        # higher level first, lower land id first within a level
+        order = numpy.lexsort((land_ids, -levels.astype(numpy.int16)))
+
+        return land_ids[order], levels[order]
+
+    def get_nearest_lands(self, x, y, radius=32):
+        """
+        lands within a square of `radius` lands around (x, y)
+        :return: [(land_id, level), ...] ordered by level desc
+        """
+        land_ids, levels = self._query(x, y, radius)
+
+        return list(zip(land_ids.tolist(), levels.tolist()))
+
+    def get_nearest_zone_ids(self, x, y, radius=16):
+        """
+        zones of `get_nearest_lands`, ordered by their best land
+        """
+        land_ids, _ = self._query(x, y, radius)
+        zone_ids, first_index = numpy.unique(get_zone_id_by_land_id(land_ids), return_index=True)
+
+        return zone_ids[numpy.argsort(first_index)].tolist()
+
+    def get_zone_levels(self):
+        """
+        :return: mean level of the 4 * 4 lands of every zone, indexed by zone id
+        """
+        return self.zone_levels
+
+    def get_top_lands(self, limit=1024, min_level=2):
+        """
+        :return: [(land_id, level), ...] of the highest leveled lands of the world
+        """
+        levels = self.levels.ravel()
+        # `ranking` is ordered by level desc, so the lands above `min_level` are its head
+        count = int(numpy.count_nonzero(levels >= min_level))
+        land_indexes = self.ranking[:min(count, limit)]
+
+        return list(zip((land_indexes + LAND_ID_START).tolist(), levels[land_indexes].tolist()))
+
+
+class DevrankStore:
+    """
+    `LandIndex` per world, shared by all accounts of the process and persisted under `data/`
+    so that other processes and restarts memory-map it instead of downloading the devrank again.
+    a stale copy is still served while it is refreshed in the background
+
+    every refresh is saved as a new version directory, `world_<id>.json` names the current one and is swapped
+    at once, so readers never mix the tables of two versions and no memory-mapped file is ever replaced
+    (which windows refuses)
+    """
+
+    def __init__(self, directory=DEVRANK_DIR, max_age=DEVRANK_MAX_AGE):
+        """
+        :param directory:
+        :param max_age: in seconds, older copies are refreshed
+        """
+        self.directory = pathlib.Path(directory)
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.land_indexes = {}
+        self.updated_at = {}
+        self.refreshing = set()
+        self.world_locks = collections.defaultdict(threading.Lock)
+
+    def _get_manifest_path(self, world_id):
+        return self.directory.joinpath(f'world_{world_id}.json')
+
+    def _read_manifest(self, world_id):
+        """
+        :return: {'version': name of the version directory, 'updated_at': timestamp}, None if never saved
+        """
+        try:
+            return json.loads(self._get_manifest_path(world_id).read_text())
+        except FileNotFoundError:
+            return None
+
+    def _save(self, world_id, land_index):
+        previous = self._read_manifest(world_id)
+        version = f'world_{world_id}.{time.time_ns()}.{os.getpid()}.{threading.get_ident()}'
+        land_index.save(self.directory.joinpath(version))
+
+        manifest_path = self._get_manifest_path(world_id)
+        temp_path = manifest_path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        temp_path.write_text(json.dumps({'version': version, 'updated_at': time.time()}))
+        os.replace(temp_path, manifest_path)
+
+        # the previous version is kept for readers which have just read the old manifest,
+        # older ones may still be mapped on windows, they are removed by a later refresh then
+        keep = {version, previous and previous.get('version')}
+        for path in self.directory.glob(f'world_{world_id}.*'):
+            if path.is_dir() and path.name not in keep:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def get(self, world_id, fetch) -> LandIndex:
+        """
+        :param world_id:
+        :param fetch: callable returning the response of `field/worldmap/devrank` of the world
+        :return:
+        """
+        with self.lock:
+            land_index = self.land_indexes.get(world_id)
+
+            if land_index is None:
+                try:
+                    manifest = self._read_manifest(world_id)
+                    if manifest is not None:
+                        land_index = LandIndex.load(self.directory.joinpath(manifest['version']))
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning(f'devrank cache of world {world_id} is broken, ignore: {e}')
+                else:
+                    if land_index is not None:
+                        self.land_indexes[world_id] = land_index
+                        self.updated_at[world_id] = manifest['updated_at']
+
+        if land_index is None:
+            with self.world_locks[world_id]:
+                # accounts of the same world starting together download it only once
+                land_index = self.land_indexes.get(world_id)
+                if land_index is None:
+                    return self.refresh(world_id, fetch)
+
+        if time.time() - self.updated_at[world_id] > self.max_age:
+            self.refresh_in_background(world_id, fetch)
+
+        return land_index
+
+    def refresh(self, world_id, fetch) -> LandIndex:
+        land_index = LandIndex.from_devrank(fetch().get('lands'))
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._save(world_id, land_index)
+
+        with self.lock:
+            self.land_indexes[world_id] = land_index
+            self.updated_at[world_id] = time.time()
+
+        logger.info(f'devrank of world {world_id} refreshed')
+
+        return land_index
+
+    def refresh_in_background(self, world_id, fetch):
+        with self.lock:
+            if world_id in self.refreshing:
+                return
+
+            self.refreshing.add(world_id)
+
+        def run():
+            try:
+                self.refresh(world_id, fetch)
+            except Exception as e:
+                logger.warning(f'devrank of world {world_id} refresh failed: {e}')
+            finally:
+                with self.lock:
+                    self.refreshing.discard(world_id)
+
+        threading.Thread(target=run, name=f'devrank_refresh_{world_id}', daemon=True).start()
+
+
+devrank_store = DevrankStore()
+
+
+def benchmark(number=1000):
+    rng = numpy.random.default_rng(0)
+    lands = ''.join(map(str, rng.integers(0, 10, LANDS_PER_ROW * LANDS_PER_ROW)))
+    land_index = LandIndex.from_devrank(lands)
+    directory = pathlib.Path(tempfile.mkdtemp()).joinpath('benchmark')
+    land_index.save(directory)
+
+    cases = {
+        'from_devrank': lambda: LandIndex.from_devrank(lands),
+        'load(mmap)': lambda: LandIndex.load(directory),
+        'get_nearest_lands(r=32)': lambda: land_index.get_nearest_lands(1024, 1024, 32),
+        'get_nearest_zone_ids(r=16)': lambda: land_index.get_nearest_zone_ids(1024, 1024, 16),
+        'get_top_lands(1024)': lambda: land_index.get_top_lands(1024),
+        'get_nearby_zone_ids(r=8)': lambda: get_nearby_zone_ids(1024, 1024, 8),
+        'get_zone_id_by_land_id': lambda: get_zone_id_by_land_id(132896),
+    }
+
+    for name, func in cases.items():
+        seconds = timeit.timeit(func, number=number) / number
+        print(f'{name:>28}: {seconds * 1000000:10.2f} us')
+
+
+if __name__ == '__main__':
+    benchmark()
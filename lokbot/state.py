@@ -0,0 +1,224 @@
+import collections
+import threading
+
+from lokbot.enum import DRAGO_LAIR_STATUS_STANDBY
+
+# [food, lumber, stone, gold]
+RESOURCE_COUNT = 4
+
+
+class KingdomSnapshot:
+    """
+    the state of a kingdom at one version, read without any lock.
+    buildings and tasks are the dicts of the store, which replaces them on updates instead of changing them,
+    so never change them either
+    """
+    __slots__ = ('version', 'resources', 'buildings', 'buildings_by_code', 'tasks', 'dragos')
+
+    def __init__(self, version, resources, buildings, tasks, dragos):
+        self.version = version
+        self.resources = resources
+        self.buildings = buildings
+        self.tasks = tasks
+        self.dragos = dragos
+
+        buildings_by_code = collections.defaultdict(list)
+        for building in buildings:
+            buildings_by_code[building.get('code')].append(building)
+
+        self.buildings_by_code = {code: tuple(each) for code, each in buildings_by_code.items()}
+
+    def get_buildings(self, code=None):
+        """
+        :param code: every building when omitted
+        :return: (building, ...)
+        """
+        if code is None:
+            return self.buildings
+
+        return self.buildings_by_code.get(code, ())
+
+    def get_tasks(self, code=None):
+        """
+        :param code: TASK_CODE_*, every task when omitted
+        :return: (task, ...)
+        """
+        if code is None:
+            return self.tasks
+
+        return tuple(task for task in self.tasks if task.get('code') == code)
+
+    def get_available_dragos(self):
+        return tuple(each for each in self.dragos if each.get('lair', {}).get('status') == DRAGO_LAIR_STATUS_STANDBY)
+
+
+class KingdomState:
+    """
+    buildings, resources, tasks and dragos of a kingdom, fed by the api responses(see `on_response`) and
+    the events of `sock_thread`, shared by the jobs and socket threads of an account.
+
+    buildings are indexed by position and code, every update is O(1) and bumps `version`,
+    `snapshot` hands out an immutable `KingdomSnapshot` which is built once per version
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.buildings = {}
+        self.positions_by_code = collections.defaultdict(set)
+        self.resources = [0] * RESOURCE_COUNT
+        self.tasks = {}
+        self.tasks_loaded = False
+        self.dragos = {}
+        self._snapshot = None
+
+    def _bump(self):
+        self.version += 1
+        self._snapshot = None
+
+    def _put_building(self, building):
+        position = building.get('position')
+        replaced = self.buildings.get(position)
+
+        if replaced is not None and replaced.get('code') != building.get('code'):
+            positions = self.positions_by_code[replaced.get('code')]
+            positions.discard(position)
+            if not positions:
+                del self.positions_by_code[replaced.get('code')]
+
+        self.buildings[position] = building
+        self.positions_by_code[building.get('code')].add(position)
+
+    def load_kingdom(self, kingdom):
+        """
+        :param kingdom: `kingdom` of `kingdom/enter`
+        """
+        with self.lock:
+            self.buildings.clear()
+            self.positions_by_code.clear()
+            for building in kingdom.get('buildings', []):
+                self._put_building(building)
+
+            resources = kingdom.get('resources')
+            if resources and len(resources) == RESOURCE_COUNT:
+                self.resources = list(resources)
+
+            self._bump()
+
+    def update_building(self, building):
+        """
+        :param building: `/building/update` of `sock_thread`, or `newBuilding`/`updateBuilding` of a response
+        """
+        with self.lock:
+            self._put_building(building)
+            self._bump()
+
+    def set_resources(self, resources):
+        with self.lock:
+            self.resources = list(resources)
+            self._bump()
+
+    def update_resource(self, index, value):
+        """
+        :param index: see `RESOURCE_IDX_MAP`
+        :param value:
+        """
+        with self.lock:
+            self.resources[index] = value
+            self._bump()
+
+    def set_tasks(self, tasks):
+        """
+        :param tasks: `kingdomTasks` of `kingdom/task/all`
+        """
+        with self.lock:
+            self.tasks = {task.get('_id'): task for task in tasks}
+            self.tasks_loaded = True
+            self._bump()
+
+    def invalidate_tasks(self):
+        """
+        the tasks may have missed updates, e.g. the socket dropped, `tasks_loaded` is False until `set_tasks`
+        """
+        with self.lock:
+            self.tasks_loaded = False
+
+    def update_task(self, task):
+        """
+        :param task: `/task/update` of `sock_thread`, or `newTask` of a response
+        """
+        with self.lock:
+            self.tasks[task.get('_id')] = task
+            self._bump()
+
+    def remove_task(self, task_id):
+        """
+        :param task_id: of a task which left `kingdom/task/all`, i.e. a claimed or finished building task
+        """
+        with self.lock:
+            if self.tasks.pop(task_id, None) is not None:
+                self._bump()
+
+    def set_dragos(self, dragos):
+        """
+        :param dragos: `dragos` of `drago/lair/list`
+        """
+        with self.lock:
+            self.dragos = {each.get('_id'): each for each in dragos}
+            self._bump()
+
+    def get_building(self, position):
+        with self.lock:
+            return self.buildings.get(position)
+
+    def get_buildings(self, code):
+        """
+        :param code: BUILDING_CODE_MAP[*]
+        :return: [building, ...]
+        """
+        with self.lock:
+            return [self.buildings[position] for position in self.positions_by_code.get(code, ())]
+
+    def get_resources(self):
+        with self.lock:
+            return tuple(self.resources)
+
+    def snapshot(self) -> KingdomSnapshot:
+        with self.lock:
+            if self._snapshot is None:
+                self._snapshot = KingdomSnapshot(
+                    self.version, tuple(self.resources), tuple(self.buildings.values()), tuple(self.tasks.values()),
+                    tuple(self.dragos.values())
+                )
+
+            return self._snapshot
+
+    def on_response(self, json_response):
+        """
+        take what a successful api response tells about the kingdom
+        :param json_response:
+        """
+        kingdom = json_response.get('kingdom')
+        if isinstance(kingdom, dict) and 'buildings' in kingdom:
+            self.load_kingdom(kingdom)
+            return
+
+        resources = json_response.get('resources')
+        if resources and len(resources) == RESOURCE_COUNT:
+            self.set_resources(resources)
+
+        tasks = json_response.get('kingdomTasks')
+        if tasks is not None:
+            self.set_tasks(tasks)
+
+        task = json_response.get('newTask')
+        if task:
+            self.update_task(task)
+
+        building = json_response.get('updateBuilding') or json_response.get('newBuilding')
+        if building:
+            self.update_building(building)
+
+        dragos = json_response.get('dragos')
+        if dragos is not None:
+            self.set_dragos(dragos)
@@ -0,0 +1,461 @@
+"""
+Run many accounts in one process, or sharded over a pool of processes.
+
+accounts of a process share the scheduler, the connection pool, the devrank of their worlds and the asset tables,
+an account only adds its `LokFarmer` state and two socket threads.
+processes share the devrank files under `data/` through memory maps
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import threading
+import time
+
+import fire
+
+import lokbot
+import lokbot.app
+import lokbot.util
+from lokbot import logger, config
+from lokbot.cache import cache_registry
+from lokbot.exceptions import NoAuthException
+from lokbot.scheduler import scheduler
+
+try:
+    import resource
+except ImportError:
+    # windows
+    resource = None
+
+SOCKET_THREADS = ('sock_thread', 'socc_thread')
+# seconds to wait for the socket threads of a stopped farmer, they may be sleeping between two retries
+SOCKET_JOIN_TIMEOUT = 90
+# scheduler workers per account, for the jobs of an account running at the same time
+WORKERS_PER_ACCOUNT = 5
+
+# a shard missing this many replies in a row is taken as hung and restarted
+MAX_MISSED_REPLIES = 6
+
+STATUS_STARTING = 'starting'
+STATUS_RUNNING = 'running'
+STATUS_BACKOFF = 'backoff'
+STATUS_FAILED = 'failed'
+
+
+class Account:
+    def __init__(self, token, captcha_solver_config=None, jobs=None, threads=None):
+        """
+        :param token:
+        :param captcha_solver_config:
+        :param jobs: `main.jobs` of the config when omitted
+        :param threads: `main.threads` of the config when omitted
+        """
+        self.token = token
+        self.captcha_solver_config = captcha_solver_config
+        self.jobs = jobs if jobs is not None else config.get('main').get('jobs')
+        self.threads = threads if threads is not None else config.get('main').get('threads')
+        self.farmer = None
+        self.status = STATUS_STARTING
+        self.error = None
+        self.restarts = 0
+
+
+class Supervisor:
+    """
+    one thread per account logs it in, schedules its jobs and watches its sockets.
+    an account failing to log in or losing its sockets is logged in again with an exponential backoff,
+    without touching the other accounts. an invalid token stops only its own account
+    """
+
+    def __init__(self, accounts, check_interval=30, min_backoff=60, max_backoff=3600, stagger=5):
+        """
+        :param accounts: [Account, ...]
+        :param check_interval: seconds between checks of the socket threads
+        :param min_backoff: seconds
+        :param max_backoff: seconds
+        :param stagger: at most this many seconds between the logins of two accounts
+        """
+        self.accounts = accounts
+        self.check_interval = check_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stagger = stagger
+        self.threads = []
+
+    def _watch(self, account: Account, sockets):
+        """
+        :param account:
+        :param sockets: {name: thread} of the socket threads started
+        :return: why the account has to log in again
+        """
+        farmer = account.farmer
+
+        while True:
+            for name in SOCKET_THREADS:
+                thread = sockets.get(name)
+                if thread is not None and not thread.is_alive():
+                    # `sock_thread` and `socc_thread` retry by themselves, the session is gone if they gave up
+                    return f'{name} stopped'
+
+                if thread is None:
+                    thread = threading.Thread(target=getattr(farmer, name), name=farmer.get_job_name(name), daemon=True)
+                    sockets[name] = thread
+                    thread.start()
+
+            time.sleep(self.check_interval)
+
+    @staticmethod
+    def _stop_farmer(account: Account, sockets):
+        if account.farmer is not None:
+            # disconnects the socket which is still alive, so that sessions do not pile up over restarts
+            account.farmer.stop()
+            account.farmer = None
+
+        for name, thread in sockets.items():
+            thread.join(SOCKET_JOIN_TIMEOUT)
+            if thread.is_alive():
+                logger.warning(f'{name} of account {account.token[-8:]} did not stop in time')
+
+    def _run_account(self, account: Account):
+        backoff = self.min_backoff
+
+        while True:
+            account.status = STATUS_STARTING
+            started_at = time.time()
+            sockets = {}
+
+            try:
+                account.farmer = lokbot.app.load_farmer(account.token, account.captcha_solver_config)
+                account.farmer.keepalive_request()
+                lokbot.app.schedule_farmer(account.farmer, account.jobs, account.threads)
+
+                account.status = STATUS_RUNNING
+                account.error = self._watch(account, sockets)
+            except NoAuthException as e:
+                self._stop_farmer(account, sockets)
+                account.status = STATUS_FAILED
+                account.error = f'{e.__class__.__name__}: {e}'
+                logger.error(f'account {account.token[-8:]} is logged out, token needs to be renewed')
+                return
+            except Exception as e:
+                account.error = f'{e.__class__.__name__}: {e}'
+
+            self._stop_farmer(account, sockets)
+
+            if time.time() - started_at > self.max_backoff:
+                # it ran well for a while, start over
+                backoff = self.min_backoff
+
+            account.status = STATUS_BACKOFF
+            account.restarts += 1
+            logger.warning(f'account {account.token[-8:]} failed: {account.error}, restart in {backoff} seconds')
+            time.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def start(self):
+        scheduler.max_workers = max(scheduler.max_workers, len(self.accounts) * WORKERS_PER_ACCOUNT)
+        scheduler.start()
+
+        for index, account in enumerate(self.accounts):
+            if index:
+                time.sleep(random.uniform(0, self.stagger))
+
+            thread = threading.Thread(target=self._run_account, args=(account,), name=f'account_{index}', daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+        return self
+
+    def get_status(self):
+        """
+        :return: {status: count} of the accounts
+        """
+        status = {}
+        for account in self.accounts:
+            status[account.status] = status.get(account.status, 0) + 1
+
+        return status
+
+    def get_metrics(self):
+        cache_stats = cache_registry.get_stats().values()
+
+        return {
+            'accounts': self.get_status(),
+            'restarts': sum(account.restarts for account in self.accounts),
+            'jobs_running': len(scheduler.running),
+            'threads': threading.active_count(),
+            'cache_hits': sum(stat['hits'] for stat in cache_stats),
+            'cache_misses': sum(stat['misses'] for stat in cache_stats),
+            # kilobytes on linux
+            'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+        }
+
+
+def get_shard(key, shards):
+    """
+    rendezvous hashing, an account stays on its shard across restarts and
+    changing the number of shards only moves the accounts of the added or removed ones
+    :param key: `_id` of the account
+    :param shards:
+    :return: index of the shard
+    """
+    return max(range(shards), key=lambda shard: hashlib.sha1(f'{shard}:{key}'.encode()).digest())
+
+
+def _get_account_key(account):
+    try:
+        return lokbot.util.decode_jwt(account.get('token')).get('_id')
+    except Exception:
+        return account.get('token')
+
+
+def _run_shard(index, accounts, conn):
+    """
+    entry of a worker process, serves the control channel while its `Supervisor` runs the accounts
+    """
+    # processes rotating the same file would rename it under each other
+    logger.remove(lokbot.main_log_handler_id)
+    lokbot.add_main_log(f'main.shard{index}')
+    lokbot.set_socketio_logs(f'.shard{index}')
+
+    supervisor = Supervisor(load_accounts(accounts))
+    threading.Thread(target=supervisor.start, name='supervisor', daemon=True).start()
+
+    commands = {
+        'status': supervisor.get_status,
+        'metrics': supervisor.get_metrics,
+        'upcoming': lambda: [{**each, 'run_at': each['run_at'].isoformat()} for each in scheduler.get_upcoming()],
+    }
+
+    while True:
+        try:
+            request_id, command = conn.recv()
+        except EOFError:
+            # the parent is gone
+            return
+
+        if command == 'stop':
+            conn.send((request_id, None))
+            return
+
+        handler = commands.get(command)
+        conn.send((request_id, handler() if handler else None))
+
+
+class _Worker:
+    __slots__ = (
+        'index', 'accounts', 'process', 'conn', 'lock', 'started_at', 'backoff', 'restart_at', 'restarts', 'request_id',
+        'missed_replies'
+    )
+
+    def __init__(self, index, accounts, backoff):
+        self.index = index
+        self.accounts = accounts
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()
+        self.started_at = None
+        self.backoff = backoff
+        self.restart_at = None
+        self.restarts = 0
+        self.request_id = 0
+        self.missed_replies = 0
+
+
+class ShardedSupervisor:
+    """
+    accounts spread over worker processes by `get_shard`, each running a `Supervisor`,
+    so that decoding of field objects and api responses uses all cores instead of one GIL.
+    crashed workers are restarted with an exponential backoff, status and metrics are asked over a pipe per worker
+    """
+
+    def __init__(self, accounts, processes, check_interval=10, min_backoff=10, max_backoff=600):
+        """
+        :param accounts: [{"token": "...", ...}, ...], see `load_accounts`
+        :param processes:
+        :param check_interval: seconds between checks of the worker processes
+        :param min_backoff: seconds
+        :param max_backoff: seconds
+        """
+        self.check_interval = check_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        # threads are running already, workers start from a fresh interpreter on every platform
+        self.context = multiprocessing.get_context('spawn')
+
+        shards = [[] for _ in range(processes)]
+        for account in accounts:
+            shards[get_shard(_get_account_key(account), processes)].append(account)
+
+        self.workers = [_Worker(index, shard, min_backoff) for index, shard in enumerate(shards) if shard]
+
+    def _start_worker(self, worker: _Worker):
+        with worker.lock:
+            worker.conn, child_conn = self.context.Pipe()
+            worker.process = self.context.Process(
+                target=_run_shard, args=(worker.index, worker.accounts, child_conn), name=f'shard_{worker.index}',
+                daemon=True
+            )
+            worker.process.start()
+            child_conn.close()
+            worker.started_at = time.time()
+            worker.missed_replies = 0
+
+        logger.info(f'shard {worker.index} started with {len(worker.accounts)} accounts, pid: {worker.process.pid}')
+
+    def start(self):
+        for worker in self.workers:
+            self._start_worker(worker)
+
+        return self
+
+    def check(self):
+        """
+        restart the crashed workers whose backoff has passed
+        """
+        now = time.time()
+
+        for worker in self.workers:
+            if worker.process.is_alive():
+                continue
+
+            if worker.restart_at is None:
+                if now - worker.started_at > self.max_backoff:
+                    # it ran well for a while, start over
+                    worker.backoff = self.min_backoff
+
+                worker.restart_at = now + worker.backoff
+                logger.warning(
+                    f'shard {worker.index} exited with {worker.process.exitcode}, restart in {worker.backoff} seconds'
+                )
+                worker.backoff = min(worker.backoff * 2, self.max_backoff)
+                continue
+
+            if now >= worker.restart_at:
+                worker.restart_at = None
+                worker.restarts += 1
+                self._start_worker(worker)
+
+    @staticmethod
+    def _ask(worker: _Worker, command, timeout):
+        worker.request_id += 1
+        worker.conn.send((worker.request_id, command))
+        deadline = time.monotonic() + timeout
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not worker.conn.poll(remaining):
+                # a busy worker answers later, the reply is dropped by the next request
+                return None
+
+            request_id, reply = worker.conn.recv()
+            if request_id == worker.request_id:
+                return reply
+
+    def request(self, command, timeout=10):
+        """
+        :param command: 'status', 'metrics' or 'upcoming'
+        :param timeout: seconds per worker
+        :return: {shard index: reply, None for workers not answering}
+        """
+        replies = {}
+
+        for worker in self.workers:
+            replies[worker.index] = None
+
+            with worker.lock:
+                if not worker.process.is_alive():
+                    continue
+
+                try:
+                    replies[worker.index] = self._ask(worker, command, timeout)
+                except (OSError, EOFError):
+                    continue
+
+                if replies[worker.index] is not None or command == 'stop':
+                    worker.missed_replies = 0
+                    continue
+
+                worker.missed_replies += 1
+                logger.warning(f'shard {worker.index} did not answer {command} in {timeout} seconds')
+                if worker.missed_replies >= MAX_MISSED_REPLIES:
+                    # hung rather than busy, `check` restarts it
+                    logger.error(f'shard {worker.index} missed {worker.missed_replies} replies in a row, killing it')
+                    worker.process.kill()
+
+        return replies
+
+    def get_metrics(self):
+        metrics = self.request('metrics')
+
+        return {
+            worker.index: {**(metrics[worker.index] or {}), 'process_restarts': worker.restarts}
+            for worker in self.workers
+        }
+
+    def stop(self):
+        self.request('stop')
+
+        for worker in self.workers:
+            worker.process.join(5)
+            if worker.process.is_alive():
+                worker.process.kill()
+
+    def run_forever(self, report_interval=600):
+        reported_at = time.time()
+
+        while True:
+            time.sleep(self.check_interval)
+            self.check()
+
+            if time.time() - reported_at > report_interval:
+                reported_at = time.time()
+                logger.info(f'shards: {self.get_metrics()}')
+
+
+def read_accounts(accounts=None):
+    """
+    :param accounts: path to a json file of accounts, `accounts` of the config when omitted:
+                     [{"token": "...", "captcha_solver_config": {...}, "jobs": [...], "threads": [...]}, ...]
+    :return: the enabled ones
+    """
+    if accounts is None:
+        accounts = config.get('accounts', [])
+    elif isinstance(accounts, str):
+        accounts = json.load(open(accounts))
+
+    return [each for each in accounts if each.get('enabled', True)]
+
+
+def load_accounts(accounts=None):
+    """
+    :param accounts: see `read_accounts`, or a list of accounts
+    :return: [Account, ...]
+    """
+    return [
+        Account(each.get('token'), each.get('captcha_solver_config'), each.get('jobs'), each.get('threads'))
+        for each in read_accounts(accounts)
+    ]
+
+
+def main(accounts=None, processes=1):
+    """
+    :param accounts: see `read_accounts`
+    :param processes: worker processes to shard the accounts over, 0 for one per core, 1 runs them in this process
+    :return:
+    """
+    if processes != 1:
+        ShardedSupervisor(read_accounts(accounts), processes or os.cpu_count()).start().run_forever()
+        return
+
+    supervisor = Supervisor(load_accounts(accounts)).start()
+
+    while True:
+        time.sleep(600)
+        logger.info(f'accounts: {supervisor.get_metrics()}')
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
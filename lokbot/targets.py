@@ -0,0 +1,114 @@
+import math
+
+from lokbot.codec import FieldObject
+from lokbot.enum import *
+
+# every level allowed
+ALL_LEVELS = -1
+
+
+class TargetRule:
+    """
+    a compiled entry of the `targets` kwarg of `socf_thread`:
+
+    {
+        "code": 20100105,
+        "level": [1, 2],           // allowed levels, any level when empty
+        "min_value": 100000,       // optional, minimum remaining `param.value`
+        "max_distance": 200,       // optional, from the kingdom
+        "unoccupied": true         // optional
+    }
+    """
+    __slots__ = ('code', 'level_mask', 'march_type', 'predicates')
+
+    def __init__(self, code, level_mask, march_type, predicates):
+        self.code = code
+        self.level_mask = level_mask
+        self.march_type = march_type
+        self.predicates = predicates
+
+    def match_level(self, level):
+        return bool(self.level_mask >> level & 1)
+
+    def match(self, field_object: FieldObject):
+        """
+        :return: name of the first failed predicate, None if all passed
+        """
+        for name, predicate in self.predicates:
+            if not predicate(field_object):
+                return name
+
+        return None
+
+
+def _get_march_type(code):
+    if code in OBJECT_MINE_CODE_LIST:
+        return MARCH_TYPE_GATHER
+
+    if code in OBJECT_MONSTER_CODE_LIST:
+        return MARCH_TYPE_MONSTER
+
+    return None
+
+
+def _get_level_mask(levels):
+    if not levels:
+        return ALL_LEVELS
+
+    level_mask = 0
+    for level in levels:
+        level_mask |= 1 << level
+
+    return level_mask
+
+
+def _compile_predicates(target, from_loc):
+    predicates = []
+
+    if target.get('unoccupied'):
+        predicates.append(('unoccupied', lambda field_object: not field_object.occupied))
+
+    min_value = target.get('min_value')
+    if min_value:
+        predicates.append((
+            'min_value', lambda field_object: (field_object.raw.get('param') or {}).get('value', 0) >= min_value
+        ))
+
+    max_distance = target.get('max_distance')
+    if max_distance:
+        def within_distance(field_object):
+            loc = field_object.loc
+
+            return math.hypot(loc[1] - from_loc[1], loc[2] - from_loc[2]) <= max_distance
+
+        predicates.append(('max_distance', within_distance))
+
+    return tuple(predicates)
+
+
+class TargetRules:
+    """
+    `targets` compiled once into a code -> `TargetRule` table, matching an object is a dict lookup
+    and a bit test no matter how many targets are configured
+    """
+
+    def __init__(self, targets, from_loc):
+        """
+        :param targets: the `targets` kwarg of `socf_thread`, the first entry wins for duplicated codes
+        :param from_loc: loc of the kingdom
+        """
+        self.rules = {}
+        for target in targets:
+            code = target['code']
+            if code in self.rules:
+                continue
+
+            self.rules[code] = TargetRule(
+                code, _get_level_mask(target.get('level')), _get_march_type(code),
+                _compile_predicates(target, from_loc)
+            )
+
+        self.codes = frozenset(self.rules)
+
+    def get(self, code) -> TargetRule:
+        return self.rules.get(code)
@@ -37,5 +37,30 @@ def get_zone_id_by_coords(x, y):
     return (x // 32) + 64 * (y // 32)
 
 
+def truncate(obj, max_length=256, max_items=32):
+    """
+    Shrinks long strings and lists inside `obj`, e.g. for logging big responses
+    `None` disables the corresponding limit
+    """
+    if isinstance(obj, str):
+        if max_length is None or len(obj) <= max_length:
+            return obj
+
+        return f'{obj[:max_length]}...({len(obj) - max_length} chars truncated)'
+
+    if isinstance(obj, (list, tuple)):
+        items = [truncate(each, max_length, max_items) for each in obj[:max_items]]
+
+        if max_items is not None and len(obj) > max_items:
+            items.append(f'...({len(obj) - max_items} items truncated)')
+
+        return items
+
+    if isinstance(obj, dict):
+        return {k: truncate(v, max_length, max_items) for k, v in obj.items()}
+
+    return obj
+
+
 def decode_jwt(token):
     return jwt.decode(token, options={'verify_signature': False})
@@ -0,0 +1,71 @@
+import base64
+import gzip
+import json
+import threading
+
+import pytest
+
+from lokbot.codec import XorCodec, FieldPackDecoder
+
+PASSWORD = '5e0a9b7c1d3f'
+
+
+def make_pack(codec, count):
+    pack = {'objects': [
+        {'_id': f'{index:024x}', 'code': 20100101 + index % 4, 'level': index % 5 + 1, 'loc': [1, index, index]}
+        for index in range(count)
+    ]}
+
+    return pack, gzip.compress(base64.b64encode(codec.xor(json.dumps(pack).encode())))
+
+
+@pytest.fixture
+def codec():
+    return XorCodec(PASSWORD)
+
+
+@pytest.mark.parametrize('count', [0, 1, 100, 20000])
+@pytest.mark.parametrize('as_list', [False, True])
+def test_decode(codec, count, as_list):
+    pack, packs = make_pack(codec, count)
+    decoder = FieldPackDecoder(codec)
+
+    # twice, the second time through the reused buffers
+    assert decoder.decode(list(packs) if as_list else packs) == pack
+    assert decoder.decode(list(packs) if as_list else packs) == pack
+
+
+def test_buffers_shrink_to_a_smaller_pack(codec):
+    decoder = FieldPackDecoder(codec)
+    large, large_packs = make_pack(codec, 5000)
+    small, small_packs = make_pack(codec, 3)
+
+    assert decoder.decode(large_packs) == large
+    assert decoder.decode(small_packs) == small
+
+
+def test_concurrent_decodes(codec):
+    decoder = FieldPackDecoder(codec)
+    packs = [make_pack(codec, count) for count in (5, 500, 5000, 50)]
+    failures = []
+
+    def worker(pack, packed):
+        for _ in range(20):
+            if decoder.decode(packed) != pack:
+                failures.append(len(pack['objects']))
+
+    threads = [threading.Thread(target=worker, args=each) for each in packs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert failures == []
+
+
+def test_xor_into(codec):
+    plain = bytes(range(256)) * 3
+    out = bytearray(len(plain))
+
+    assert codec.xor_into(plain, out) == codec.xor(plain)
+    assert codec.xor_into(out, out) == plain
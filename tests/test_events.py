@@ -0,0 +1,112 @@
+import time
+
+import pytest
+
+from lokbot.events import EventBus, EVENT_TASK_CLAIMED, EVENT_TASK_FINISHED
+from lokbot.scheduler import Scheduler
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler(max_workers=4).start()
+    yield scheduler
+    scheduler.stop()
+
+
+@pytest.fixture
+def events(scheduler):
+    return EventBus(scheduler)
+
+
+def wait_for(predicate, timeout=3):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError('timed out')
+
+        time.sleep(0.01)
+
+
+def test_once_is_called_for_the_first_matched_event_only(events):
+    received = []
+    events.once(EVENT_TASK_CLAIMED, received.append, lambda task: task['code'] == 6)
+
+    events.publish(EVENT_TASK_CLAIMED, {'_id': 'a', 'code': 3})
+    events.publish(EVENT_TASK_CLAIMED, {'_id': 'b', 'code': 6})
+    events.publish(EVENT_TASK_CLAIMED, {'_id': 'c', 'code': 6})
+    events.publish(EVENT_TASK_FINISHED, {'_id': 'd', 'code': 6})
+
+    assert received == [{'_id': 'b', 'code': 6}]
+
+
+def test_once_takes_an_event_published_since(events):
+    started_at = time.time()
+    events.publish(EVENT_TASK_CLAIMED, {'_id': 'a', 'code': 6})
+
+    received = []
+    assert events.once(EVENT_TASK_CLAIMED, received.append, since=started_at) is None
+    assert received == [{'_id': 'a', 'code': 6}]
+
+
+def test_once_ignores_events_before_since_or_not_matched(events):
+    events.publish(EVENT_TASK_CLAIMED, {'_id': 'a', 'code': 6})
+    started_at = time.time()
+    events.publish(EVENT_TASK_CLAIMED, {'_id': 'b', 'code': 6})
+
+    received = []
+    events.once(EVENT_TASK_CLAIMED, received.append, lambda task: task['_id'] == 'c', since=started_at)
+    assert received == []
+
+    events.publish(EVENT_TASK_CLAIMED, {'_id': 'c', 'code': 6})
+    assert received == [{'_id': 'c', 'code': 6}]
+
+
+def test_once_falls_back_on_timeout(events):
+    received = []
+    timed_out = []
+    events.once(EVENT_TASK_CLAIMED, received.append, timeout=0.1, on_timeout=lambda: timed_out.append(True))
+
+    wait_for(lambda: timed_out)
+    # the subscription is gone once timed out
+    assert events.publish(EVENT_TASK_CLAIMED, {'_id': 'a'}) == 0
+    assert received == []
+
+
+def test_once_without_on_timeout_is_called_with_none(events):
+    received = []
+    events.once(EVENT_TASK_CLAIMED, received.append, timeout=0.1)
+
+    wait_for(lambda: received)
+    assert received == [None]
+
+
+def test_timeout_is_dropped_once_the_event_came(events):
+    received = []
+    timed_out = []
+    events.once(EVENT_TASK_CLAIMED, received.append, timeout=0.1, on_timeout=lambda: timed_out.append(True))
+
+    events.publish(EVENT_TASK_CLAIMED, {'_id': 'a'})
+    time.sleep(0.3)
+
+    assert received == [{'_id': 'a'}]
+    assert timed_out == []
+
+
+def test_once_with_a_key_replaces_the_pending_one(events):
+    received = []
+    timed_out = []
+    events.once(
+        EVENT_TASK_CLAIMED, lambda data: received.append(('replaced', data)), timeout=0.1,
+        on_timeout=lambda: timed_out.append('replaced'), key='academy_farmer_thread'
+    )
+    events.once(
+        EVENT_TASK_CLAIMED, lambda data: received.append(('kept', data)), timeout=0.2,
+        on_timeout=lambda: timed_out.append('kept'), key='academy_farmer_thread'
+    )
+
+    wait_for(lambda: timed_out)
+    time.sleep(0.1)
+    assert timed_out == ['kept']
+
+    events.publish(EVENT_TASK_CLAIMED, {'_id': 'a'})
+    assert received == []
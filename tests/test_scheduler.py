@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+from lokbot.scheduler import Scheduler
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler(max_workers=4).start()
+    yield scheduler
+    scheduler.stop()
+
+
+class Tracker:
+    """
+    records the runs of a job and how many of them overlapped
+    """
+
+    def __init__(self, duration=0.0):
+        self.duration = duration
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.runs = []
+
+    def __call__(self, tag=None):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            started_at = time.time()
+
+        time.sleep(self.duration)
+
+        with self.lock:
+            self.active -= 1
+            self.runs.append((tag, started_at, time.time()))
+
+
+def wait_for(predicate, timeout=3):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError('timed out')
+
+        time.sleep(0.01)
+
+
+def test_interval_job_is_skipped_while_running(scheduler):
+    tracker = Tracker(duration=0.3)
+    scheduler.every('slow', (0.05, 0.05), tracker)
+
+    wait_for(lambda: scheduler.get_stats().get('slow', {}).get('skips', 0) >= 2)
+    scheduler.cancel('slow')
+    wait_for(lambda: not scheduler.get_stats()['slow']['running'])
+
+    assert tracker.max_active == 1
+
+
+def test_one_shot_of_a_running_name_is_deferred(scheduler):
+    tracker = Tracker(duration=0.2)
+    scheduler.call_later(0, 'job', tracker, 'first')
+    wait_for(lambda: tracker.active)
+
+    scheduler.call_later(0, 'job', tracker, 'second')
+    wait_for(lambda: len(tracker.runs) == 2)
+
+    (first, _, first_ended_at), (second, second_started_at, _) = tracker.runs
+    assert (first, second) == ('first', 'second')
+    assert second_started_at >= first_ended_at
+    assert tracker.max_active == 1
+
+
+def test_pending_one_shot_is_replaced(scheduler):
+    tracker = Tracker()
+    scheduler.call_later(0.2, 'job', tracker, 'replaced')
+    scheduler.call_later(0.2, 'job', tracker, 'kept')
+
+    wait_for(lambda: tracker.runs)
+    time.sleep(0.3)
+
+    assert [tag for tag, _, _ in tracker.runs] == ['kept']
+
+
+def test_cancel_by_prefix(scheduler):
+    tracker = Tracker()
+    scheduler.every('account_1.harvester', (0.1, 0.1), tracker, 'account_1.harvester')
+    scheduler.call_later(0.1, 'account_1.building', tracker, 'account_1.building')
+    scheduler.call_later(0.1, 'account_2.building', tracker, 'account_2.building')
+
+    scheduler.cancel('account_1.')
+    wait_for(lambda: tracker.runs)
+    time.sleep(0.3)
+
+    assert [tag for tag, _, _ in tracker.runs] == ['account_2.building']
+
+
+def test_cancel_drops_deferred_one_shot(scheduler):
+    tracker = Tracker(duration=0.2)
+    scheduler.call_later(0, 'account_1.job', tracker, 'running')
+    wait_for(lambda: tracker.active)
+
+    scheduler.call_later(0, 'account_1.job', tracker, 'deferred')
+    time.sleep(0.05)
+    scheduler.cancel('account_1.')
+    time.sleep(0.4)
+
+    assert [tag for tag, _, _ in tracker.runs] == ['running']
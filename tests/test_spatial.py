@@ -0,0 +1,152 @@
+"""
+`lokbot.spatial` against the list based lookups it replaced in `LokFarmer`, kept here as the reference
+"""
+import json
+
+import numpy
+import pytest
+
+import lokbot.util
+from lokbot.spatial import DevrankStore, LandIndex, get_nearby_zone_ids, get_zone_id_by_land_id
+
+LOCS = [(0, 0), (1, 2047), (2047, 0), (2047, 2047), (1024, 1024), (37, 1500), (700, 9)]
+
+
+def blockshaped(arr, nrows, ncols):
+    h, w = arr.shape
+    return arr.reshape(h // nrows, nrows, -1, ncols).swapaxes(1, 2).reshape(-1, nrows, ncols)
+
+
+def neighbors(a, radius, row_number, column_number):
+    return [[a[i][j] if 0 <= i < len(a) and 0 <= j < len(a[0]) else 0
+             for j in range(column_number - 1 - radius, column_number + radius)]
+            for i in range(row_number - 1 - radius, row_number + radius)]
+
+
+LAND_ARRAY = numpy.arange(100000, 165536).reshape(256, 256)
+LAND_ARRAY_4_BY_4 = blockshaped(LAND_ARRAY, 4, 4)
+ZONE_ARRAY = numpy.arange(0, 4096).reshape(64, 64)
+
+
+def get_land_with_level(lands):
+    land_with_level = [[], [], [], [], [], [], [], [], [], []]
+    for index, level in enumerate(lands):
+        land_with_level[int(level)].append(100000 + index)
+
+    return land_with_level
+
+
+def get_nearest_land(lands, x, y, radius):
+    nearby_land_ids = neighbors(LAND_ARRAY, radius, y // 8 + 1, x // 8 + 1)
+    # a set instead of the list of the original, for speed only
+    nearby_land_ids = {item for sublist in nearby_land_ids for item in sublist if item != 0}
+
+    result = []
+    for index, each_level in enumerate(reversed(get_land_with_level(lands))):
+        level = 10 - index
+        result += [(each_land_id, level) for each_land_id in each_level if each_land_id in nearby_land_ids]
+
+    return result
+
+
+def get_zone_id_by_land_id_reference(land_id):
+    block, _, _ = numpy.argwhere(LAND_ARRAY_4_BY_4 == land_id)[0]
+
+    return int(block)
+
+
+def get_nearest_zone(lands, x, y, radius):
+    zones = []
+    for land_id, _ in get_nearest_land(lands, x, y, radius):
+        zone_id = get_zone_id_by_land_id_reference(land_id)
+        if zone_id not in zones:
+            zones.append(zone_id)
+
+    return zones
+
+
+def get_nearest_zone_ng(x, y, radius):
+    row, col = divmod(lokbot.util.get_zone_id_by_coords(x, y), 64)
+    nearby_zone_ids = neighbors(ZONE_ARRAY, radius, row + 1, col + 1)
+
+    return [item.item() for sublist in nearby_zone_ids for item in sublist if item != 0]
+
+
+def get_top_leveled_land(lands, limit):
+    result = []
+    for index, each_level in enumerate(reversed(get_land_with_level(lands))):
+        level = 10 - index
+        if level < 2:
+            continue
+
+        if len(each_level) > limit:
+            # the original returned bare land ids here
+            return result + [(each, level) for each in each_level[:limit]]
+
+        result += [(each, level) for each in each_level]
+        limit -= len(each_level)
+
+    return result
+
+
+@pytest.fixture(scope='module')
+def lands():
+    return ''.join(map(str, numpy.random.default_rng(0).integers(0, 10, 256 * 256)))
+
+
+@pytest.fixture(scope='module')
+def land_index(lands):
+    return LandIndex.from_devrank(lands)
+
+
+@pytest.mark.parametrize('x, y', LOCS)
+@pytest.mark.parametrize('radius', [0, 3, 8])
+def test_get_nearest_lands(lands, land_index, x, y, radius):
+    assert land_index.get_nearest_lands(x, y, radius) == get_nearest_land(lands, x, y, radius)
+
+
+@pytest.mark.parametrize('x, y', LOCS)
+def test_get_nearest_zone_ids(lands, land_index, x, y):
+    assert land_index.get_nearest_zone_ids(x, y, 6) == get_nearest_zone(lands, x, y, 6)
+
+
+@pytest.mark.parametrize('x, y', LOCS)
+@pytest.mark.parametrize('radius', [1, 8])
+def test_get_nearby_zone_ids(x, y, radius):
+    # the original dropped zone 0 along with the padding of the grid
+    assert [each for each in get_nearby_zone_ids(x, y, radius) if each != 0] == get_nearest_zone_ng(x, y, radius)
+
+
+@pytest.mark.parametrize('limit', [1, 1024, 60000])
+def test_get_top_lands(lands, land_index, limit):
+    assert land_index.get_top_lands(limit) == get_top_leveled_land(lands, limit)
+
+
+def test_get_zone_id_by_land_id():
+    for land_id in numpy.random.default_rng(1).integers(100000, 165536, 200).tolist() + [100000, 165535]:
+        assert get_zone_id_by_land_id(land_id) == get_zone_id_by_land_id_reference(land_id)
+
+
+def test_saved_index_loads_the_same(tmp_path, land_index):
+    land_index.save(tmp_path.joinpath('world_1'))
+    loaded = LandIndex.load(tmp_path.joinpath('world_1'))
+
+    assert loaded.get_nearest_lands(1024, 1024, 8) == land_index.get_nearest_lands(1024, 1024, 8)
+    assert loaded.get_top_lands(100) == land_index.get_top_lands(100)
+
+
+def test_devrank_store_swaps_whole_versions(tmp_path, lands):
+    store = DevrankStore(tmp_path)
+    versions = []
+    for _ in range(3):
+        store.refresh(1, lambda: {'lands': lands})
+        versions.append(json.loads(tmp_path.joinpath('world_1.json').read_text())['version'])
+
+    # the current version and the previous one for readers of the old manifest
+    assert sorted(path.name for path in tmp_path.iterdir() if path.is_dir()) == sorted(versions[-2:])
+
+    def fetch():
+        raise AssertionError('the saved version is loaded instead')
+
+    land_index = DevrankStore(tmp_path).get(1, fetch)
+    assert land_index.get_top_lands(100) == LandIndex.from_devrank(lands).get_top_lands(100)
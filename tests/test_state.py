@@ -0,0 +1,92 @@
+from lokbot.enum import BUILDING_CODE_MAP, TASK_CODE_ACADEMY, TASK_CODE_CAMP
+from lokbot.state import KingdomState
+
+BARRACK = BUILDING_CODE_MAP['barrack']
+ACADEMY = BUILDING_CODE_MAP['academy']
+
+
+def make_state():
+    state = KingdomState()
+    state.load_kingdom({
+        'buildings': [
+            {'position': 1, 'code': BARRACK, 'level': 1},
+            {'position': 2, 'code': BARRACK, 'level': 2},
+            {'position': 3, 'code': ACADEMY, 'level': 5},
+        ],
+        'resources': [1, 2, 3, 4],
+    })
+
+    return state
+
+
+def test_buildings_are_indexed_by_code():
+    state = make_state()
+
+    assert sorted(each['position'] for each in state.get_buildings(BARRACK)) == [1, 2]
+    assert state.get_building(3)['level'] == 5
+
+
+def test_building_code_change_moves_it_to_the_new_code():
+    state = make_state()
+
+    state.update_building({'position': 2, 'code': ACADEMY, 'level': 1})
+
+    assert [each['position'] for each in state.get_buildings(BARRACK)] == [1]
+    assert sorted(each['position'] for each in state.get_buildings(ACADEMY)) == [2, 3]
+    assert [each['position'] for each in state.snapshot().get_buildings(BARRACK)] == [1]
+
+
+def test_last_building_of_a_code_leaves_no_empty_index():
+    state = make_state()
+
+    state.update_building({'position': 3, 'code': BARRACK, 'level': 1})
+
+    assert state.get_buildings(ACADEMY) == []
+    assert ACADEMY not in state.positions_by_code
+    assert state.snapshot().get_buildings(ACADEMY) == ()
+
+
+def test_snapshot_is_kept_until_an_update():
+    state = make_state()
+    snapshot = state.snapshot()
+
+    assert state.snapshot() is snapshot
+
+    state.update_resource(0, 100)
+
+    assert snapshot.resources == (1, 2, 3, 4)
+    assert state.snapshot() is not snapshot
+    assert state.snapshot().resources == (100, 2, 3, 4)
+    assert state.snapshot().version > snapshot.version
+
+
+def test_on_response_takes_tasks_and_buildings():
+    state = make_state()
+
+    state.on_response({'kingdomTasks': [{'_id': 'a', 'code': TASK_CODE_CAMP, 'status': 1}]})
+    state.on_response({
+        'newTask': {'_id': 'b', 'code': TASK_CODE_ACADEMY, 'status': 1},
+        'updateBuilding': {'position': 3, 'code': ACADEMY, 'level': 6},
+    })
+
+    snapshot = state.snapshot()
+    assert [each['_id'] for each in snapshot.get_tasks(TASK_CODE_CAMP)] == ['a']
+    assert [each['_id'] for each in snapshot.get_tasks(TASK_CODE_ACADEMY)] == ['b']
+    assert snapshot.get_buildings(ACADEMY)[0]['level'] == 6
+
+
+def test_tasks_are_loaded_until_invalidated():
+    state = make_state()
+    assert not state.tasks_loaded
+
+    state.set_tasks([{'_id': 'a', 'code': TASK_CODE_CAMP, 'status': 1}])
+    assert state.tasks_loaded
+
+    state.update_task({'_id': 'a', 'code': TASK_CODE_CAMP, 'status': 3})
+    assert state.snapshot().get_tasks(TASK_CODE_CAMP)[0]['status'] == 3
+
+    state.remove_task('a')
+    assert state.snapshot().get_tasks(TASK_CODE_CAMP) == ()
+
+    state.invalidate_tasks()
+    assert not state.tasks_loaded